@@ -0,0 +1,1418 @@
+import base64
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.utils import PlotlyJSONEncoder
+
+from macroseismics_isoseismals import build_isoseismal_hulls
+from macroseismics_normalize import answer_observed_flags, normalize_answers
+from macroseismics_validation import (
+    VALIDATION_BITMASK_COL,
+    VALIDATION_TEXT_COL,
+    validate_reports,
+    validation_reason_text,
+)
+
+# --- Sdílená příprava dat, klasifikace a tvorba figur ---
+# Používá analytický skript i HTTP služba (macroseismics_service.py).
+
+COL_OBS_DATETIME = "eqdatetime"
+COL_LAT = "lat"
+COL_LON = "lon"
+COL_IN_BUILDING = "pozorovaniodkud"
+COL_FEAR = "reakcepanika"
+COL_TREMOR_TYPE = "popispohybu"
+COL_FELT_BY = "kolikpozorvenku"
+COLS_OBJECT_MOVEMENT_DETAILS = [
+    "nabytektezky",
+    "okna",
+    "dvere",
+    "zavespredmety",
+    "nadobi",
+    "malepredmety",
+    "kapalina",
+]
+COL_DAMAGE_OVERALL = "poskozomitka"
+COLS_SOUNDS = [
+    "zvukzavrzani",
+    "zvukduneni",
+    "zvukvibrace",
+    "zvukhuceni",
+    "zvukvrzani",
+    "zvukvitr",
+    "zvukexploze",
+    "zvuktanku",
+    "zvuknevin",
+]
+NEGATIVE_OR_EMPTY_VALUES = ["", "0", "ne", "no", "false", "nan", "null"]
+# Kanonické odpovědi dotazníku (po normalizaci); překlepy se k nim přiřadí
+# přibližným porovnáním, viz macroseismics_normalize.py
+MOVEMENT_ANSWERS = [
+    "nevím",
+    "nehýbal se",
+    "nehýbala se",
+    "nehýbaly se",
+    "nehýbalo se",
+    "zatřásl se",
+    "zhoupl se",
+    "pohnul se",
+    "převrhl se",
+    "drnčela",
+    "drnčely",
+    "řinčela",
+    "řinčely",
+    "řinčelo",
+    "otevírala se",
+    "otevíraly se",
+    "kývaly se",
+    "nepatrně se kývaly",
+    "značně se kývaly",
+    "cinkalo",
+    "padalo",
+    "posunuly se",
+    "spadly",
+]
+CANONICAL_ANSWERS = {
+    COL_IN_BUILDING: ["budova", "venku", "v autě stojícím", "v autě jedoucím"],
+    COL_FELT_BY: [
+        "pouze vy",
+        "několik",
+        "většina",
+        "většina ano",
+        "většina ne",
+        "mnoho",
+        "nevím",
+    ],
+    COL_TREMOR_TYPE: [
+        "žádný",
+        "nepocítěno",
+        "lehké chvění",
+        "chvění",
+        "houpání",
+        "slabé zachvění",
+        "silné zachvění",
+        "slabé zhoupnutí",
+        "silné zhoupnutí",
+        "slabé zakymácení",
+        "silné zakymácení",
+        "silné otřesy",
+        "nevím",
+    ],
+    COL_DAMAGE_OVERALL: ["bylo", "nebylo", "nevím"],
+    **{col: MOVEMENT_ANSWERS for col in COLS_OBJECT_MOVEMENT_DETAILS},
+}
+MOVEMENT_NEGATIVE_ANSWERS = [
+    "nevím",
+    "nehýbal se",
+    "nehýbala se",
+    "nehýbaly se",
+    "nehýbalo se",
+]
+# Odpovědi, které neznamenají pozorovaný pohyb předmětů: jedna sada pro
+# klasifikaci, souhrny i kontrolu kvality
+MOVEMENT_NOT_OBSERVED_VALUES = NEGATIVE_OR_EMPTY_VALUES + MOVEMENT_NEGATIVE_ANSWERS
+
+# Pravidla kontroly kvality hlášení, viz macroseismics_validation.py
+# ("reject" = hlášení se vyřadí, "flag" = jen se označí v bitové masce)
+REPORT_TIMEZONE = "Europe/Prague"  # časy v tabulce hlášení jsou místní
+VALIDATION_MIN_DATETIME = "1990-01-01"
+VALIDATION_BOUNDS_CR = {COL_LAT: (48.55, 51.06), COL_LON: (12.09, 18.86)}
+VALIDATION_RULES = [
+    {
+        "name": "cas_neplatny",
+        "kind": "datetime_invalid",
+        "column": COL_OBS_DATETIME,
+        "action": "reject",
+        "description": "Čas pozorování chybí nebo nejde převést",
+    },
+    {
+        "name": "cas_nepravdepodobny",
+        "kind": "datetime_range",
+        "column": COL_OBS_DATETIME,
+        "min": VALIDATION_MIN_DATETIME,
+        "action": "reject",
+        "description": f"Čas pozorování před {VALIDATION_MIN_DATETIME}",
+    },
+    {
+        "name": "cas_v_budoucnosti",
+        "kind": "datetime_range",
+        "column": COL_OBS_DATETIME,
+        "max_ahead": "1D",
+        "action": "reject",
+        "description": "Čas pozorování více než den po okamžiku zpracování",
+    },
+    {
+        "name": "cas_prechod_letniho_casu",
+        "kind": "datetime_local_invalid",
+        "column": COL_OBS_DATETIME,
+        "timezone": REPORT_TIMEZONE,
+        "action": "reject",
+        "description": "Místní čas neexistuje nebo je nejednoznačný (změna času)",
+    },
+    {
+        "name": "souradnice_neplatne",
+        "kind": "numeric_invalid",
+        "columns": [COL_LAT, COL_LON],
+        "action": "reject",
+        "description": "Souřadnice chybí nebo nejsou číselné",
+    },
+    {
+        "name": "souradnice_mimo_cr",
+        "kind": "range",
+        "bounds": VALIDATION_BOUNDS_CR,
+        "action": "reject",
+        "description": "Souřadnice mimo obdélník České republiky",
+    },
+    {
+        "name": "nepocitano_s_pohybem_predmetu",
+        "kind": "contradiction",
+        "column": COL_TREMOR_TYPE,
+        "vocabulary": CANONICAL_ANSWERS[COL_TREMOR_TYPE],
+        "values": ["žádný", "nepocítěno"],
+        "effect_columns": COLS_OBJECT_MOVEMENT_DETAILS,
+        "effect_negative_values": MOVEMENT_NOT_OBSERVED_VALUES,
+        "action": "flag",
+        "description": "Otřesy nepocítěny, ale hlášen pohyb předmětů",
+    },
+    {
+        "name": "nepocitano_s_poskozenim",
+        "kind": "contradiction",
+        "column": COL_TREMOR_TYPE,
+        "vocabulary": CANONICAL_ANSWERS[COL_TREMOR_TYPE],
+        "values": ["žádný", "nepocítěno"],
+        "effect_columns": [COL_DAMAGE_OVERALL],
+        "effect_negative_values": NEGATIVE_OR_EMPTY_VALUES + ["nebylo", "nevím"],
+        "action": "flag",
+        "description": "Otřesy nepocítěny, ale hlášeno poškození budovy",
+    },
+]
+
+
+# --- Načtení a základní příprava dat ---
+def load_report_table(
+    data_file_path,
+    sheet_name=0,
+    validation_rules=None,
+    return_validation=False,
+    now=None,
+):
+    # validation_rules=None -> VALIDATION_RULES; return_validation=True vrací
+    # navíc {"rule_counts": počty podle pravidel, "rejected": vyřazené řádky};
+    # now = okamžik pro pravidla "v budoucnosti" (None = aktuální čas)
+    print(f"\n--- Načítání dat z: {data_file_path} ---")
+    df = pd.read_excel(
+        data_file_path, sheet_name=sheet_name, na_values=["NULL", "null", ""]
+    )
+    print(f"Úspěšně načteno {len(df)} řádků z Excelu.")
+    if df.empty:
+        raise ValueError("Načtený DataFrame je prázdný.")
+    if COL_OBS_DATETIME not in df.columns:
+        raise ValueError(f"Sloupec '{COL_OBS_DATETIME}' nenalezen.")
+    if COL_LAT not in df.columns or COL_LON not in df.columns:
+        raise ValueError("Sloupce souřadnic nenalezeny.")
+
+    print("\n--- Kontrola kvality hlášení ---")
+    rules = VALIDATION_RULES if validation_rules is None else validation_rules
+    validation = validate_reports(df, rules, now=now)
+    rule_counts = validation["rule_counts"]
+    if not rule_counts.empty:
+        print(rule_counts[["rule", "action", "n_violations"]].to_string(index=False))
+    # Převedené sloupce z kontroly se použijí znovu (pokud je pravidla převedla)
+    parsed = validation["parsed"]
+    obs_datetime = parsed.get(("datetime", COL_OBS_DATETIME))
+    if obs_datetime is None:
+        obs_datetime = pd.to_datetime(
+            df[COL_OBS_DATETIME], dayfirst=True, errors="coerce"
+        )
+    df[COL_OBS_DATETIME] = obs_datetime
+    for col in (COL_LAT, COL_LON):
+        coords = parsed.get(("numeric", col))
+        if coords is None:
+            coords = pd.to_numeric(df[col], errors="coerce")
+        df[col] = coords
+    df[VALIDATION_BITMASK_COL] = validation["bitmask"]
+    df[VALIDATION_TEXT_COL] = validation_reason_text(validation["bitmask"], rules)
+
+    # Řádky bez času nebo souřadnic se vyřadí i bez odpovídajícího pravidla
+    rejected = (
+        validation["rejected"]
+        | df[COL_OBS_DATETIME].isna().to_numpy()
+        | df[COL_LAT].isna().to_numpy()
+        | df[COL_LON].isna().to_numpy()
+    )
+    df_rejected = df[rejected]
+    df = df[~rejected].copy()
+    print(
+        f"Po kontrole kvality: {len(df)} řádků "
+        f"({len(df_rejected)} vyřazeno, "
+        f"{int((df[VALIDATION_BITMASK_COL] != 0).sum())} označeno)."
+    )
+    if df.empty:
+        raise ValueError("Žádná platná hlášení po kontrole kvality.")
+
+    print(f"\n--- Zpracování časových údajů (sloupec '{COL_OBS_DATETIME}') ---")
+    # Nejednoznačné a neexistující místní časy vyřazuje pravidlo
+    # cas_prechod_letniho_casu; bez něj (vlastní pravidla) se vyřadí zde,
+    # jeden takový řádek nesmí shodit načtení celé tabulky
+    if df[COL_OBS_DATETIME].dt.tz is None:
+        df[COL_OBS_DATETIME] = (
+            df[COL_OBS_DATETIME]
+            .dt.tz_localize(REPORT_TIMEZONE, ambiguous="NaT", nonexistent="NaT")
+            .dt.tz_convert("UTC")
+        )
+    else:
+        df[COL_OBS_DATETIME] = df[COL_OBS_DATETIME].dt.tz_convert("UTC")
+    unlocalized = df[COL_OBS_DATETIME].isna()
+    if unlocalized.any():
+        print(
+            f"VAROVÁNÍ: {int(unlocalized.sum())} řádků s nejednoznačným nebo "
+            "neexistujícím místním časem vyřazeno."
+        )
+        df_rejected = pd.concat([df_rejected, df[unlocalized]])
+        df = df[~unlocalized]
+        if df.empty:
+            raise ValueError("Žádná platná hlášení po převodu času do UTC.")
+    print("Časová zóna aplikována.")
+    if return_validation:
+        return df, {"rule_counts": rule_counts, "rejected": df_rejected}
+    return df
+
+
+def select_event_window(df, eq_datetime_utc, window_hours):
+    time_delta_filter = pd.Timedelta(hours=window_hours)
+    return df.loc[
+        (df[COL_OBS_DATETIME] >= eq_datetime_utc - time_delta_filter)
+        & (df[COL_OBS_DATETIME] <= eq_datetime_utc + time_delta_filter)
+    ].copy()
+
+
+# --- Předběžné zpracování kategorií ---
+def normalize_report_answers(df_event, verbose=True):
+    # Kanonické odpovědi kategoriálních sloupců (jen sloupce přítomné v datech)
+    return pd.DataFrame(
+        {
+            col: normalize_answers(df_event[col], vocabulary, verbose=verbose)
+            for col, vocabulary in CANONICAL_ANSWERS.items()
+            if col in df_event.columns
+        },
+        index=df_event.index,
+    )
+
+
+def movement_observed_flags(df_event, answers=None):
+    # Příznaky pozorovaného pohybu předmětů po sloupcích z kanonických odpovědí;
+    # answers = výsledek normalize_report_answers (jinak se normalizuje zde)
+    cols = [col for col in COLS_OBJECT_MOVEMENT_DETAILS if col in df_event.columns]
+    if answers is None:
+        answers = normalize_report_answers(df_event[cols], verbose=False)
+    return answer_observed_flags(answers, cols, MOVEMENT_NOT_OBSERVED_VALUES)
+
+
+def prepare_categories(df_event, verbose=True):
+    if verbose:
+        print("\n--- Předzpracování kategorií ---")
+    answers = normalize_report_answers(df_event, verbose=verbose)
+    in_building = answers.get(COL_IN_BUILDING, pd.Series(np.nan, index=df_event.index))
+    df_event.loc[:, "Mist_Pozorovani_Kat_Full"] = np.where(
+        in_building == "budova", "Doma (uvnitř)", "Venku/Nezadáno v budově"
+    )
+    df_event.loc[:, "Mist_Pozorovani_Legenda"] = np.where(
+        in_building == "budova", "Doma", "Venku/Nezadáno"
+    )
+    df_event.loc[:, "Pocit_Kategorie_Text_Full"] = (
+        answers[COL_FELT_BY]
+        .map(
+            {
+                "pouze vy": "Pocítil(a) jen respondent",
+                "většina ano": "Pocítila většina přítomných",
+            }
+        )
+        .fillna("Nezadáno/Jiná odpověď")
+    )
+    df_event.loc[:, "Pocit_Kategorie_Legenda"] = (
+        answers[COL_FELT_BY]
+        .map({"pouze vy": "Jen respondent", "většina ano": "Většina"})
+        .fillna("Nezadáno")
+    )
+    df_event.loc[:, "Intenzita_Kat_Full"] = answers[COL_TREMOR_TYPE].fillna("Nezadáno")
+    df_event.loc[:, "Intenzita_Kat_Legenda"] = df_event["Intenzita_Kat_Full"]
+    df_event.loc[:, "Strach_Pocit_Kat_Text_Full"] = (
+        (pd.to_numeric(df_event[COL_FEAR], errors="coerce") == 1)
+        .map({True: "Ano (strach/panika)", False: "Ne/Nezadáno strach"})
+        .fillna("Ne/Nezadáno strach")
+    )
+    df_event.loc[:, "Strach_Pocit_Legenda"] = (
+        (pd.to_numeric(df_event[COL_FEAR], errors="coerce") == 1)
+        .map({True: "Ano", False: "Ne/Nezadáno"})
+        .fillna("Ne/Nezadáno")
+    )
+    actual_movement_detail_cols = [
+        col for col in COLS_OBJECT_MOVEMENT_DETAILS if col in df_event.columns
+    ]
+    if actual_movement_detail_cols:
+        df_event.loc[:, "Pohyb_Predmetu_Agregovany_Bool"] = movement_observed_flags(
+            df_event, answers
+        ).any(axis=1)
+        df_event.loc[:, "Pohyb_Predmetu_Agregovany_Text_Full"] = df_event[
+            "Pohyb_Predmetu_Agregovany_Bool"
+        ].map({True: "Ano (pohyb předmětů)", False: "Ne (žádný pohyb předmětů)"})
+        df_event.loc[:, "Pohyb_Predmetu_Legenda"] = df_event[
+            "Pohyb_Predmetu_Agregovany_Bool"
+        ].map({True: "Ano", False: "Ne"})
+    else:
+        df_event.loc[:, "Pohyb_Predmetu_Agregovany_Text_Full"] = (
+            "Nezadáno (info o pohybu chybí)"
+        )
+        df_event.loc[:, "Pohyb_Predmetu_Legenda"] = "Nezadáno"
+    df_event.loc[:, "Poskozeni_Obecne_Text_Full"] = (
+        answers[COL_DAMAGE_OVERALL]
+        .map({"bylo": "Ano (poškození hlášeno)", "nebylo": "Ne (poškození nehlášeno)"})
+        .fillna("Nezadáno/Jiná hodnota")
+    )
+    df_event.loc[:, "Poskozeni_Obecne_Legenda"] = (
+        answers[COL_DAMAGE_OVERALL]
+        .map({"bylo": "Ano", "nebylo": "Ne"})
+        .fillna("Nezadáno")
+    )
+    actual_sound_cols = [col for col in COLS_SOUNDS if col in df_event.columns]
+    if actual_sound_cols:
+        df_event.loc[:, "Zvuk_Reportovan_Bool"] = answer_observed_flags(
+            df_event, actual_sound_cols, NEGATIVE_OR_EMPTY_VALUES
+        ).any(axis=1)
+        df_event.loc[:, "Zvuk_Reportovan_Text_Full"] = df_event[
+            "Zvuk_Reportovan_Bool"
+        ].map({True: "Ano (zvuk reportován)", False: "Ne (bez zvuku)"})
+        df_event.loc[:, "Zvuk_Reportovan_Legenda"] = df_event[
+            "Zvuk_Reportovan_Bool"
+        ].map({True: "Ano", False: "Ne"})
+    else:
+        df_event.loc[:, "Zvuk_Reportovan_Text_Full"] = "Nezadáno (info chybí)"
+        df_event.loc[:, "Zvuk_Reportovan_Legenda"] = "Nezadáno"
+    if verbose:
+        print("Předzpracování kategorií dokončeno.")
+    return df_event
+
+
+def sort_ems_key(ems_string):
+    roman_map = {
+        "I": 1,
+        "II": 2,
+        "III": 3,
+        "IV": 4,
+        "V": 5,
+        "VI": 6,
+        "VII": 7,
+        "VIII": 8,
+        "IX": 9,
+        "X": 10,
+    }
+    parts = str(ems_string).split(" - ")[0]
+    value = 900
+    if parts in roman_map:
+        value = roman_map[parts]
+    elif parts == "Neklasifikováno":
+        value = 1000
+    return value
+
+
+# --- UPRAVENÁ Funkce pro odhad EMS-98 intenzity ---
+# Řádek obsahuje kanonické odpovědi (viz classify_ems_intensity), příznak
+# strachu a pro sloupce pohybu předmětů příznak "pohyb pozorován".
+def assign_ems_intensity(row):
+    popis_pohybu = row.get(COL_TREMOR_TYPE) or ""
+    felt_by_str = row.get(COL_FELT_BY) or ""
+    in_building_str = row.get(COL_IN_BUILDING) or ""
+    damage_overall_str = row.get(COL_DAMAGE_OVERALL) or ""
+    in_building = in_building_str == "budova"
+    felt_by_only_respondent = felt_by_str == "pouze vy"
+    felt_by_some_or_many = felt_by_str in ["několik", "většina ano"]
+    felt_by_most = felt_by_str == "většina ano"
+    fear = bool(row.get(COL_FEAR, False))
+    damage_overall = damage_overall_str == "bylo"
+
+    def was_object_effect_observed(col_name_list):
+        if not isinstance(col_name_list, list):
+            col_name_list = [col_name_list]
+        return any(bool(row.get(col_name, False)) for col_name in col_name_list)
+
+    if damage_overall:
+        return "VI - Mírně ničivé"
+    if (
+        fear
+        and felt_by_most
+        and popis_pohybu == "silné otřesy"
+        and (was_object_effect_observed(["malepredmety", "nadobi"]))
+    ):
+        return "VI - Mírně ničivé"
+    is_strong_tremor = popis_pohybu == "silné otřesy"
+    significant_object_movement_V = was_object_effect_observed(
+        ["malepredmety", "nadobi", "zavespredmety", "dvere", "okna"]
+    )
+    if (is_strong_tremor or (felt_by_most and fear)) and significant_object_movement_V:
+        return "V - Silné"
+    if (
+        felt_by_most
+        and is_strong_tremor
+        and was_object_effect_observed(["malepredmety"])
+    ):
+        return "V - Silné"
+    object_movement_IV = was_object_effect_observed(
+        ["okna", "dvere", "nadobi", "zavespredmety"]
+    )
+    if is_strong_tremor and not fear and object_movement_IV:
+        return "IV - Značně pozorované"
+    if felt_by_some_or_many and in_building and object_movement_IV:
+        return "IV - Značně pozorované"
+    if (
+        felt_by_some_or_many
+        and in_building
+        and popis_pohybu in ["slabé zachvění", "chvění", "houpání"]
+        and was_object_effect_observed(["okna", "dvere"])
+    ):
+        return "IV - Značně pozorované"
+    object_movement_III_hanging = was_object_effect_observed(["zavespredmety"])
+    is_weak_tremor = popis_pohybu in [
+        "slabé zachvění",
+        "lehké chvění",
+        "houpání",
+        "chvění",
+    ]
+    if (
+        felt_by_some_or_many
+        and in_building
+        and is_weak_tremor
+        and not was_object_effect_observed(["okna", "dvere", "nadobi", "malepredmety"])
+    ):
+        return "III - Slabé"
+    if (
+        felt_by_only_respondent
+        and in_building
+        and is_weak_tremor
+        and not fear
+        and (
+            not was_object_effect_observed(COLS_OBJECT_MOVEMENT_DETAILS)
+            or object_movement_III_hanging
+        )
+    ):
+        return "III - Slabé"
+    if (
+        object_movement_III_hanging
+        and not is_strong_tremor
+        and not fear
+        and not was_object_effect_observed(
+            ["okna", "dvere", "nadobi", "malepredmety", "nabytektezky"]
+        )
+    ):
+        return "III - Slabé"
+    if (
+        felt_by_only_respondent
+        and in_building
+        and popis_pohybu == "slabé zachvění"
+        and not fear
+        and not was_object_effect_observed(COLS_OBJECT_MOVEMENT_DETAILS)
+    ):
+        return "II - Zřídka pocítěno"
+    if popis_pohybu == "žádný":
+        if not (felt_by_some_or_many or felt_by_only_respondent):
+            return "I - Nepocítěno"
+        if (
+            felt_by_only_respondent
+            and not was_object_effect_observed(COLS_OBJECT_MOVEMENT_DETAILS)
+            and not fear
+        ):
+            return "I - Nepocítěno"
+    if popis_pohybu == "nepocítěno":
+        return "I - Nepocítěno"
+    return "Neklasifikováno"
+
+
+def classify_ems_intensity(df_event):
+    # Pravidla se vyhodnotí jen pro unikátní kombinace vstupů, ne pro každý řádek
+    answers = normalize_report_answers(df_event, verbose=False)
+    ems_inputs = pd.DataFrame(index=df_event.index)
+    for col in (COL_TREMOR_TYPE, COL_FELT_BY, COL_IN_BUILDING, COL_DAMAGE_OVERALL):
+        if col in answers.columns:
+            ems_inputs[col] = answers[col].fillna("")
+    ems_inputs[COL_FEAR] = (
+        pd.to_numeric(df_event[COL_FEAR], errors="coerce") == 1
+        if COL_FEAR in df_event.columns
+        else False
+    )
+    ems_inputs = ems_inputs.join(movement_observed_flags(df_event, answers))
+    if ems_inputs.empty:
+        return pd.Series(index=df_event.index, dtype=object)
+    unique_inputs = ems_inputs.drop_duplicates()
+    unique_inputs = unique_inputs.assign(
+        EMS_Intensity_Est=unique_inputs.apply(assign_ems_intensity, axis=1)
+    )
+    merged = ems_inputs.merge(unique_inputs, on=list(ems_inputs.columns), how="left")
+    return pd.Series(
+        merged["EMS_Intensity_Est"].to_numpy(),
+        index=df_event.index,
+        name="EMS_Intensity_Est",
+    )
+
+
+EMS_COLOR_MAP = {
+    "I - Nepocítěno": "rgb(200,220,255)",
+    "II - Zřídka pocítěno": "rgb(160,200,255)",
+    "III - Slabé": "rgb(100,220,220)",
+    "IV - Značně pozorované": "rgb(120,255,120)",
+    "V - Silné": "rgb(255,255,100)",
+    "VI - Mírně ničivé": "rgb(255,180,100)",
+    "Neklasifikováno": "rgb(200,200,200)",
+}
+
+# Sloupce hoveru hlavní mapy pozorování
+HOVER_DATA_MAIN_MAP_COLS = [
+    COL_OBS_DATETIME,
+    "Mist_Pozorovani_Kat_Full",
+    "Pocit_Kategorie_Text_Full",
+    "Intenzita_Kat_Full",
+    "Strach_Pocit_Kat_Text_Full",
+    "Pohyb_Predmetu_Agregovany_Text_Full",
+    "Poskozeni_Obecne_Text_Full",
+    "Zvuk_Reportovan_Text_Full",
+    "EMS_Intensity_Est",
+    "Podezrele_Hlaseni_Text",
+]
+
+# Parametrické mapy: (sloupec barvy, titulek, název souboru, barvy, hover navíc, hlavní hover)
+MAP_CONFIGS = [
+    (
+        "Pocit_Kategorie_Legenda",
+        "Kdo pocítil otřesy",
+        "felt_by",
+        {"Většina": "green", "Jen respondent": "orange", "Nezadáno": "lightgrey"},
+        None,
+        "Pocit_Kategorie_Text_Full",
+    ),
+    (
+        "Zvuk_Reportovan_Legenda",
+        "Reportované zvuky",
+        "sounds_reported",
+        {"Ano": "purple", "Ne": "lightskyblue", "Nezadáno": "lightgrey"},
+        None,
+        "Zvuk_Reportovan_Text_Full",
+    ),
+    (
+        "Poskozeni_Obecne_Legenda",
+        "Poškození budov",
+        "damage",
+        {"Ano": "darkred", "Ne": "darkgreen", "Nezadáno": "lightgrey"},
+        None,
+        "Poskozeni_Obecne_Text_Full",
+    ),
+    (
+        "Pohyb_Predmetu_Legenda",
+        "Pohyb předmětů",
+        "object_movement",
+        {"Ano": "orangered", "Ne": "mediumseagreen", "Nezadáno": "lightgrey"},
+        None,
+        "Pohyb_Predmetu_Agregovany_Text_Full",
+    ),
+    (
+        "Intenzita_Kat_Legenda",
+        "Intenzita otřesů (popis)",
+        "tremor_intensity_descr",
+        None,
+        None,
+        "Intenzita_Kat_Full",
+    ),
+    (
+        "Strach_Pocit_Legenda",
+        "Pocit strachu/paniky",
+        "fear",
+        {"Ano": "crimson", "Ne/Nezadáno": "teal"},
+        None,
+        "Strach_Pocit_Kat_Text_Full",
+    ),
+    (
+        "Mist_Pozorovani_Legenda",
+        "Místo pozorování",
+        "in_building",
+        {"Doma": "sandybrown", "Venku/Nezadáno": "skyblue"},
+        None,
+        "Mist_Pozorovani_Kat_Full",
+    ),
+]
+
+
+def parametric_category_order(df_event, color_column, color_map):
+    # Pořadí kategorií v legendě: nejdřív barevná mapa, "Nezadáno" vždy na konec
+    category_order = []
+    if color_column in df_event.columns and df_event[color_column].nunique() > 0:
+        unique_values = df_event[color_column].unique().tolist()
+        if color_map:
+            category_order = list(color_map.keys())
+            missing = sorted([v for v in unique_values if v not in category_order])
+            category_order.extend(missing)
+        else:
+            nezadano_like = [
+                "Nezadáno",
+                "Nezadáno/Jiné",
+                "Nezadáno (info chybí)",
+                "Neklasifikováno",
+                "nan",
+            ]
+            standard_vals = sorted(
+                [
+                    v
+                    for v in unique_values
+                    if str(v) not in nezadano_like and not pd.isna(v)
+                ],
+                key=lambda x: str(x).lower(),
+            )
+            nezadano_vals = sorted(
+                [v for v in unique_values if str(v) in nezadano_like or pd.isna(v)],
+                key=lambda x: str(x).lower(),
+            )
+            category_order = standard_vals + nezadano_vals
+    return category_order
+
+
+def make_event_info(
+    eq_lat,
+    eq_lon,
+    eq_magnitude,
+    eq_gfu_id,
+    eq_location_name,
+    center_lat,
+    center_lon,
+    zoom,
+):
+    return {
+        "lat": eq_lat,
+        "lon": eq_lon,
+        "magnitude": eq_magnitude,
+        "gfu_id": eq_gfu_id,
+        "location_name": eq_location_name,
+        "center_lat": center_lat,
+        "center_lon": center_lon,
+        "zoom": zoom,
+    }
+
+
+def format_magnitude(magnitude):
+    return "neznámá" if magnitude is None else f"{magnitude}"
+
+
+# Pomocná funkce pro hovertemplate
+def build_hovertemplate_string(hover_data_config, main_hover_col):
+    template_parts = []
+    # Najdeme index hlavního sloupce pro customdata
+    custom_data_keys = list(hover_data_config.keys())
+
+    if main_hover_col and main_hover_col in custom_data_keys:
+        main_col_idx = custom_data_keys.index(main_hover_col)
+        template_parts.append(
+            f"<b>{main_hover_col}</b>: %{{customdata[{main_col_idx}]}}<br>"
+        )
+
+    for i, col_name in enumerate(custom_data_keys):
+        if hover_data_config[col_name] and col_name != main_hover_col:
+            template_parts.append(f"{col_name}: %{{customdata[{i}]}}<br>")
+    template_parts.append("<extra></extra>")
+    return "".join(template_parts)
+
+
+# --- Helper funkce pro tvorbu map ---
+# event_info: slovník s klíči lat, lon, magnitude, gfu_id, location_name,
+# center_lat, center_lon, zoom (viz make_event_info)
+def build_map_figure(
+    df_map_data,
+    color_column_name,
+    map_title_suffix,
+    event_info,
+    category_orders_dict=None,
+    color_discrete_map_dict=None,
+    hover_data_extra=None,
+    hover_text_column_name=None,
+    show_isoseismal_areas=False,
+    ems_color_map_for_hulls=None,
+    sort_ems_key_func=None,
+    isoseismal_hulls=None,
+    isoseismal_metrics=None,
+):
+    if color_column_name not in df_map_data.columns and color_column_name is not None:
+        print(
+            f"INFO: Sloupec '{color_column_name}' pro mapu '{map_title_suffix}' nenalezen."
+        )
+        return None
+
+    # Příprava hover dat
+    active_hover_data_config = {
+        COL_OBS_DATETIME: True
+    }  # COL_OBS_DATETIME je vždy přítomen
+    # Efektivní sloupec pro hlavní text v hoveru (tučně)
+    effective_main_hover_text_col = (
+        hover_text_column_name
+        if hover_text_column_name and hover_text_column_name in df_map_data.columns
+        else color_column_name
+    )
+
+    if (
+        effective_main_hover_text_col
+        and effective_main_hover_text_col in df_map_data.columns
+    ):
+        active_hover_data_config[effective_main_hover_text_col] = True
+    if hover_data_extra:
+        for item in hover_data_extra:
+            if item in df_map_data.columns:
+                active_hover_data_config[item] = True
+
+    # Odstraníme duplicity a zajistíme, že klíče v active_hover_data_config jsou unikátní a existují v df_map_data
+    final_hover_data_cols = [
+        col
+        for col in list(dict.fromkeys(active_hover_data_config.keys()))
+        if col in df_map_data.columns
+    ]
+    df_for_customdata = df_map_data[final_hover_data_cols]
+
+    if (
+        show_isoseismal_areas
+        and color_column_name == "EMS_Intensity_Est"
+        and "EMS_Intensity_Est" in df_map_data.columns
+        and ems_color_map_for_hulls
+        and sort_ems_key_func
+    ):
+        fig = go.Figure()
+        if isoseismal_hulls is None:
+            isoseismal_hulls = build_isoseismal_hulls(
+                df_map_data,
+                ems_color_map_for_hulls.keys(),
+                sort_ems_key_func,
+                lat_col=COL_LAT,
+                lon_col=COL_LON,
+            )
+        metrics_by_level = {}
+        if isoseismal_metrics is not None and not isoseismal_metrics.empty:
+            metrics_by_level = isoseismal_metrics.set_index("ems_level").to_dict(
+                "index"
+            )
+        for hull in isoseismal_hulls:
+            ems_level_str = hull["level"]
+            hull_name = f"Oblast {ems_level_str.split(' - ')[0]}"
+            if ems_level_str in metrics_by_level:
+                level_metrics = metrics_by_level[ems_level_str]
+                hull_name += (
+                    f" ({level_metrics['area_km2']:.0f} km², "
+                    f"r={level_metrics['equivalent_radius_km']:.1f} km)"
+                )
+            fig.add_trace(
+                go.Scattermapbox(
+                    lon=hull["lons"],
+                    lat=hull["lats"],
+                    mode="none",
+                    fill="toself",
+                    fillcolor=ems_color_map_for_hulls.get(ems_level_str, "grey"),
+                    name=hull_name,
+                    hoverinfo="name",
+                    legendgroup="isoseismals",
+                    showlegend=True,
+                    opacity=0.5,
+                )
+            )
+
+        point_colors_mapped = None
+        if (
+            color_column_name
+            and color_discrete_map_dict
+            and color_column_name in df_map_data.columns
+        ):
+            point_colors_mapped = (
+                df_map_data[color_column_name]
+                .map(color_discrete_map_dict)
+                .fillna("grey")
+            )  # grey pro nemapované
+
+        fig.add_trace(
+            go.Scattermapbox(
+                lat=df_map_data[COL_LAT],
+                lon=df_map_data[COL_LON],
+                mode="markers",
+                marker=go.scattermapbox.Marker(
+                    size=8,
+                    color=point_colors_mapped
+                    if point_colors_mapped is not None
+                    else "blue",  # Použije namapované barvy
+                    opacity=0.9,
+                ),
+                customdata=df_for_customdata.values,
+                hovertemplate=build_hovertemplate_string(
+                    dict.fromkeys(final_hover_data_cols, True),
+                    effective_main_hover_text_col,
+                ),
+                name="Pozorování",
+                legendgroup="observations",
+                showlegend=True,
+            )
+        )
+    else:
+        fig = px.scatter_mapbox(
+            df_map_data,
+            lat=COL_LAT,
+            lon=COL_LON,
+            hover_name=df_map_data.index
+            if df_map_data.index.name
+            else None,  # Může být jméno sloupce nebo index
+            hover_data={
+                col: True for col in final_hover_data_cols
+            },  # Použijeme dict pro hover_data
+            color=color_column_name
+            if color_column_name and color_column_name in df_map_data.columns
+            else None,
+            category_orders=category_orders_dict
+            if color_column_name and color_column_name in df_map_data.columns
+            else None,
+            color_discrete_map=color_discrete_map_dict
+            if color_column_name and color_column_name in df_map_data.columns
+            else None,
+            size_max=10,
+            opacity=0.8,
+            zoom=event_info["zoom"],
+            center={"lat": event_info["center_lat"], "lon": event_info["center_lon"]},
+        )
+        if not (color_column_name and color_column_name in df_map_data.columns):
+            fig.update_traces(marker=dict(size=7))
+
+    fig.add_trace(
+        go.Scattermapbox(
+            lat=[event_info["lat"]],
+            lon=[event_info["lon"]],
+            mode="markers",
+            marker=go.scattermapbox.Marker(
+                size=17, color="red", symbol="star", opacity=1
+            ),
+            name=f"Epicentrum (Mag: {format_magnitude(event_info['magnitude'])})",
+            text=[
+                f"Epicentrum {event_info['location_name']}<br>Magnituda: {format_magnitude(event_info['magnitude'])}<br>ID: {event_info['gfu_id']}"
+            ],
+            hoverinfo="text",
+            showlegend=True,
+        )
+    )
+    main_title = f"Zemětřesení {event_info['location_name']}"
+    legend_title_for_map = map_title_suffix
+    if (
+        not (color_column_name and color_column_name in df_map_data.columns)
+        and not show_isoseismal_areas
+    ):
+        legend_title_for_map = "Legenda"
+    fig.update_layout(
+        mapbox_style="open-street-map",
+        margin={"r": 10, "t": 50, "l": 10, "b": 10},
+        title=main_title,
+        legend_title_text=legend_title_for_map,
+        legend=dict(
+            bgcolor="rgba(255,255,255,0.9)",
+            bordercolor="Black",
+            borderwidth=1,
+            title_font_family="Arial",
+            font=dict(family="Arial", size=10, color="black"),
+            itemsizing="constant",
+            traceorder="reversed",
+            yanchor="top",
+            y=0.98,
+            xanchor="right",
+            x=0.98,
+        ),
+        mapbox_zoom=event_info["zoom"],
+        mapbox_center={
+            "lat": event_info["center_lat"],
+            "lon": event_info["center_lon"],
+        },
+    )
+    return fig
+
+
+# --- Jedna interaktivní mapa s přepínáním vrstev ---
+# Body a hover data jsou ve figuře jen jednou; vrstva (barevný sloupec) se
+# přepíná v prohlížeči tlačítkem, které změní kódy barev bodů, diskrétní
+# barevnou škálu, hovertemplate a zobrazené položky legendy.
+# layers: seznam (sloupec barvy nebo None, titulek, barvy, hlavní hover sloupec)
+def _discrete_colorscale(colors):
+    n_colors = len(colors)
+    scale = []
+    for i, color in enumerate(colors):
+        scale += [[i / n_colors, color], [(i + 1) / n_colors, color]]
+    return scale
+
+
+def build_multilayer_map_figure(df_map_data, layers, event_info, hover_data_extra=None):
+    layer_specs = []
+    for color_column, layer_title, color_map, hover_column in layers:
+        if color_column is None:
+            codes = np.zeros(len(df_map_data), dtype=int)
+            categories = ["Pozorování"]
+            colors = ["blue"]
+        elif color_column in df_map_data.columns:
+            values = df_map_data[color_column].astype(object)
+            values = values.where(values.notna(), "Nezadáno")
+            categories = parametric_category_order(
+                values.to_frame(color_column), color_column, color_map
+            )
+            categories = [c for c in categories if c in set(values.unique())]
+            codes = pd.Categorical(values, categories=categories).codes
+            palette = px.colors.qualitative.Plotly
+            colors = [
+                (color_map or {}).get(c, palette[i % len(palette)])
+                for i, c in enumerate(categories)
+            ]
+        else:
+            print(f"INFO: Sloupec '{color_column}' pro vrstvu '{layer_title}' chybí.")
+            continue
+        layer_specs.append(
+            {
+                "title": layer_title,
+                "hover_column": hover_column or color_column,
+                "codes": codes,
+                "categories": categories,
+                "colors": colors,
+            }
+        )
+    if not layer_specs:
+        return None
+
+    hover_cols = [COL_OBS_DATETIME]
+    hover_cols += [spec["hover_column"] for spec in layer_specs]
+    hover_cols += list(hover_data_extra or [])
+    hover_cols = [
+        col for col in dict.fromkeys(hover_cols) if col and col in df_map_data.columns
+    ]
+    hover_config = dict.fromkeys(hover_cols, True)
+    for spec in layer_specs:
+        spec["hovertemplate"] = build_hovertemplate_string(
+            hover_config, spec["hover_column"]
+        )
+
+    fig = go.Figure()
+    first = layer_specs[0]
+    fig.add_trace(
+        go.Scattermapbox(
+            lat=df_map_data[COL_LAT],
+            lon=df_map_data[COL_LON],
+            mode="markers",
+            marker=go.scattermapbox.Marker(
+                size=8,
+                color=first["codes"],
+                colorscale=_discrete_colorscale(first["colors"]),
+                cmin=-0.5,
+                cmax=len(first["colors"]) - 0.5,
+                opacity=0.8,
+            ),
+            customdata=df_map_data[hover_cols].values,
+            hovertemplate=first["hovertemplate"],
+            name="Pozorování",
+            showlegend=False,
+        )
+    )
+    # Zástupné stopy legendy (bez bodů), viditelné jen pro aktivní vrstvu
+    proxy_layer_index = []
+    proxy_colors = []
+    for layer_index, spec in enumerate(layer_specs):
+        for category, color in zip(spec["categories"], spec["colors"]):
+            fig.add_trace(
+                go.Scattermapbox(
+                    lat=[None],
+                    lon=[None],
+                    mode="markers",
+                    marker=go.scattermapbox.Marker(size=10, color=color),
+                    name=str(category),
+                    legendgroup=f"vrstva_{layer_index}",
+                    showlegend=True,
+                    visible=layer_index == 0,
+                )
+            )
+            proxy_layer_index.append(layer_index)
+            proxy_colors.append(color)
+    fig.add_trace(
+        go.Scattermapbox(
+            lat=[event_info["lat"]],
+            lon=[event_info["lon"]],
+            mode="markers",
+            marker=go.scattermapbox.Marker(
+                size=17, color="red", symbol="star", opacity=1
+            ),
+            name=f"Epicentrum (Mag: {format_magnitude(event_info['magnitude'])})",
+            text=[
+                f"Epicentrum {event_info['location_name']}<br>Magnituda: {format_magnitude(event_info['magnitude'])}<br>ID: {event_info['gfu_id']}"
+            ],
+            hoverinfo="text",
+            showlegend=True,
+        )
+    )
+
+    buttons = []
+    for layer_index, spec in enumerate(layer_specs):
+        # Hodnoty pro všechny stopy v pořadí: body, zástupci legendy, epicentrum
+        buttons.append(
+            dict(
+                label=spec["title"],
+                method="update",
+                args=[
+                    {
+                        "visible": [True]
+                        + [i == layer_index for i in proxy_layer_index]
+                        + [True],
+                        "marker.color": [spec["codes"]] + proxy_colors + ["red"],
+                        "marker.colorscale": [_discrete_colorscale(spec["colors"])]
+                        + [None] * (len(proxy_colors) + 1),
+                        "marker.cmax": [len(spec["colors"]) - 0.5]
+                        + [None] * (len(proxy_colors) + 1),
+                        "hovertemplate": [spec["hovertemplate"]]
+                        + [None] * (len(proxy_colors) + 1),
+                    },
+                    {"legend.title.text": spec["title"]},
+                ],
+            )
+        )
+    fig.update_layout(
+        mapbox_style="open-street-map",
+        margin={"r": 10, "t": 50, "l": 10, "b": 10},
+        title=f"Zemětřesení {event_info['location_name']}",
+        legend_title_text=first["title"],
+        legend=dict(
+            bgcolor="rgba(255,255,255,0.9)",
+            bordercolor="Black",
+            borderwidth=1,
+            title_font_family="Arial",
+            font=dict(family="Arial", size=10, color="black"),
+            itemsizing="constant",
+            yanchor="top",
+            y=0.98,
+            xanchor="right",
+            x=0.98,
+        ),
+        updatemenus=[
+            dict(
+                type="dropdown",
+                buttons=buttons,
+                direction="down",
+                showactive=True,
+                x=0.01,
+                xanchor="left",
+                y=0.99,
+                yanchor="top",
+                bgcolor="rgba(255,255,255,0.9)",
+            )
+        ],
+        mapbox_zoom=event_info["zoom"],
+        mapbox_center={
+            "lat": event_info["center_lat"],
+            "lon": event_info["center_lon"],
+        },
+    )
+    return fig
+
+
+# --- Helper funkce pro tvorbu sloupcových grafů ---
+def build_bar_figure(
+    data_series,
+    chart_title,
+    xaxis_title,
+    yaxis_title="Počet pozorování",
+    show_percentages=False,
+    n_total_observations=None,
+):
+    if data_series.empty:
+        print(f"INFO: Graf '{chart_title}' se negeneruje (žádná data).")
+        return None  # Vracíme None, pokud se graf negeneruje
+
+    total_observations_for_chart_title = data_series.sum()
+    fig = px.bar(
+        x=data_series.index,
+        y=data_series.values,
+        labels={"x": xaxis_title, "y": yaxis_title},
+        title=chart_title
+        + f" (celkem {total_observations_for_chart_title} pozorování)",
+    )
+    fig.update_layout(xaxis_title=xaxis_title, yaxis_title=yaxis_title)
+
+    if show_percentages and n_total_observations:
+        percentages = (data_series / n_total_observations) * 100
+        fig.update_traces(
+            texttemplate="%{y} (%{customdata:.1f}%)",
+            textposition="outside",
+            customdata=percentages,
+        )
+    else:
+        fig.update_traces(texttemplate="%{y}", textposition="outside")
+    return fig
+
+
+# --- Kompaktní serializace figur (HTML a JSON) ---
+# Souřadnice se zaokrouhlí na coord_decimals a uloží jako binární pole
+# (typed array {"dtype", "bdata"}, plotly.js je dekóduje sám). Sloupce
+# customdata se uloží po sloupcích do layout.meta: texty jako indexy do
+# seznamu unikátních hodnot, časy jako místní celé sekundy od nejmenšího
+# času s nanosekundami a posunem zóny, čísla jako float64. Skript
+# COMPACT_FIGURE_POST_SCRIPT po načtení stránky customdata složí zpět, hover
+# tedy vypadá stejně jako dřív. Pole pro jednotlivé stopy v argumentech
+# tlačítek (updatemenus) se kódují binárně jako pole stop.
+COMPACT_COORD_DECIMALS = 5  # ~1 m; do 5 desetinných míst stačí float32
+COMPACT_MIN_POINTS = 16  # kratší pole (epicentrum, legenda) zůstávají textem
+COMPACT_META_KEY = "kompaktni_customdata"
+_MISSING_SECONDS = np.iinfo(np.int32).min
+
+COMPACT_FIGURE_POST_SCRIPT = """
+(function () {
+  var gd = document.getElementById("{plot_id}");
+  var meta = gd.layout.meta || {};
+  var packed = meta.__META_KEY__;
+  if (!packed) return;
+  var arrayTypes = {u1: Uint8Array, u2: Uint16Array, i4: Int32Array, f8: Float64Array};
+  function decode(column) {
+    var bytes = atob(column.bdata);
+    var view = new Uint8Array(bytes.length);
+    for (var i = 0; i < bytes.length; i++) view[i] = bytes.charCodeAt(i);
+    return new arrayTypes[column.dtype](view.buffer);
+  }
+  function pad(number, width) {
+    var text = String(number);
+    while (text.length < width) text = "0" + text;
+    return text;
+  }
+  // Stejný zápis jako isoformat() v Pythonu: zlomky sekund a posun zóny
+  function formatSeconds(column, nanoseconds, offsets, value, row) {
+    if (value === __MISSING_SECONDS__) return null;
+    var text = new Date((column.epoch + value) * 1000).toISOString().slice(0, 19);
+    var fraction = nanoseconds[row];
+    if (fraction) {
+      text += "." + (fraction % 1000 ? pad(fraction, 9) : pad(fraction / 1000, 6));
+    }
+    var offset = offsets ? offsets[row] : __MISSING_SECONDS__;
+    if (offset !== __MISSING_SECONDS__) {
+      var minutes = Math.abs(offset) / 60;
+      text += (offset < 0 ? "-" : "+") + pad(Math.floor(minutes / 60), 2) + ":" +
+        pad(minutes % 60, 2);
+    }
+    return text;
+  }
+  var traceIndices = [];
+  var customdata = [];
+  Object.keys(packed).forEach(function (traceIndex) {
+    var columns = packed[traceIndex].map(function (column) {
+      var values = decode(column);
+      var nanoseconds = column.nanoseconds && decode(column.nanoseconds);
+      var offsets = column.offsets && decode(column.offsets);
+      return Array.prototype.map.call(values, function (value, row) {
+        if (column.kind === "labels") return column.labels[value];
+        if (column.kind === "seconds") {
+          return formatSeconds(column, nanoseconds, offsets, value, row);
+        }
+        return isNaN(value) ? null : value;
+      });
+    });
+    var rows = columns[0].map(function (_, row) {
+      return columns.map(function (values) { return values[row]; });
+    });
+    traceIndices.push(Number(traceIndex));
+    customdata.push(rows);
+  });
+  Plotly.restyle(gd, {customdata: customdata}, traceIndices);
+})();
+""".replace("__META_KEY__", COMPACT_META_KEY).replace(
+    "__MISSING_SECONDS__", str(_MISSING_SECONDS)
+)
+
+
+def _typed_array(values, dtype):
+    array = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {
+        "dtype": array.dtype.kind + str(array.dtype.itemsize),
+        "bdata": base64.b64encode(array.tobytes()).decode("ascii"),
+    }
+
+
+def _index_dtype(n_values):
+    if n_values <= np.iinfo(np.uint8).max:
+        return "u1"
+    if n_values <= np.iinfo(np.uint16).max:
+        return "u2"
+    return "i4"
+
+
+def _json_value(value):
+    # Hodnota tak, jak by ji zapsal PlotlyJSONEncoder (numpy -> Python)
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _pack_customdata_column(values):
+    values = pd.Series(values, dtype=object)
+    present = values.notna().to_numpy()
+    sample = values[present]
+    if len(sample) and all(
+        isinstance(v, (pd.Timestamp, datetime.datetime)) for v in sample
+    ):
+        # Místní čas hodnoty (celé sekundy + nanosekundy) a její posun zóny,
+        # aby hover zůstal stejný jako isoformat() i u smíšených zón
+        stamps = [pd.Timestamp(v) for v in sample]
+        offsets = np.full(len(values), _MISSING_SECONDS, dtype=np.int64)
+        offsets[present] = [
+            _MISSING_SECONDS
+            if stamp.tzinfo is None
+            else int(stamp.utcoffset().total_seconds())
+            for stamp in stamps
+        ]
+        wall_ns = np.array(
+            [stamp.tz_localize(None).value for stamp in stamps], dtype=np.int64
+        )
+        seconds = np.full(len(values), _MISSING_SECONDS, dtype=np.int64)
+        nanoseconds = np.zeros(len(values), dtype=np.int64)
+        seconds[present], nanoseconds[present] = np.divmod(wall_ns, 10**9)
+        epoch = int(seconds[present].min())
+        seconds[present] -= epoch
+        column = {
+            "kind": "seconds",
+            "epoch": epoch,
+            "nanoseconds": _typed_array(nanoseconds, "i4"),
+            **_typed_array(seconds, "i4"),
+        }
+        if (offsets[present] != _MISSING_SECONDS).any():
+            column["offsets"] = _typed_array(offsets, "i4")
+        return column
+    if len(sample) and all(
+        isinstance(v, (int, float, np.integer, np.floating))
+        and not isinstance(v, (bool, np.bool_))
+        for v in sample
+    ):
+        return {
+            "kind": "numbers",
+            **_typed_array(pd.to_numeric(values, errors="coerce"), "f8"),
+        }
+    # Texty a ostatní hodnoty: indexy do seznamu unikátních hodnot (poslední = null)
+    codes, uniques = pd.factorize(values)
+    labels = [_json_value(u) for u in uniques] + [None]
+    codes = np.where(codes < 0, len(uniques), codes)
+    return {
+        "kind": "labels",
+        "labels": labels,
+        **_typed_array(codes, _index_dtype(len(labels))),
+    }
+
+
+def _compact_numeric(values, decimals=None, dtype="f8"):
+    try:
+        array = np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        return None
+    if array.ndim != 1 or len(array) < COMPACT_MIN_POINTS:
+        return None
+    if decimals is not None:
+        array = np.round(array, decimals)
+    return _typed_array(array, dtype)
+
+
+def _compact_marker_values(values):
+    values = np.asarray(values)
+    if values.ndim != 1 or len(values) < COMPACT_MIN_POINTS:
+        return None
+    # Celočíselné kódy nejmenším typem, spojité hodnoty jako float64
+    if values.dtype.kind in "iu" and values.min() >= 0:
+        return _typed_array(values, _index_dtype(int(values.max()) + 1))
+    if values.dtype.kind == "f":
+        return _typed_array(values, "f8")
+    return None
+
+
+def compact_figure_dict(fig, coord_decimals=COMPACT_COORD_DECIMALS):
+    fig_dict = fig.to_plotly_json()
+    coord_dtype = "f4" if coord_decimals is not None and coord_decimals <= 5 else "f8"
+    packed_customdata = {}
+    for trace_index, trace in enumerate(fig_dict["data"]):
+        for key in ("lat", "lon"):
+            if trace.get(key) is not None:
+                encoded = _compact_numeric(trace[key], coord_decimals, coord_dtype)
+                if encoded is not None:
+                    trace[key] = encoded
+        hovertemplate = trace.get("hovertemplate")
+        if isinstance(hovertemplate, str) and coord_decimals is not None:
+            for key in ("lat", "lon"):
+                hovertemplate = hovertemplate.replace(
+                    f"%{{{key}}}", f"%{{{key}:.{coord_decimals}f}}"
+                )
+            trace["hovertemplate"] = hovertemplate
+        for key in ("x", "y", "z"):
+            if trace.get(key) is not None:
+                encoded = _compact_numeric(trace[key])
+                if encoded is not None:
+                    trace[key] = encoded
+        marker = trace.get("marker")
+        for key in ("color", "size"):
+            if not isinstance(marker, dict) or marker.get(key) is None:
+                continue
+            encoded = _compact_marker_values(marker[key])
+            if encoded is not None:
+                marker[key] = encoded
+
+        customdata = trace.get("customdata")
+        if customdata is None or len(customdata) < COMPACT_MIN_POINTS:
+            continue
+        customdata = np.asarray(customdata, dtype=object)
+        if customdata.ndim == 1:
+            encoded = _compact_numeric(customdata)
+            if encoded is not None:
+                trace["customdata"] = encoded
+            continue
+        packed_customdata[str(trace_index)] = [
+            _pack_customdata_column(customdata[:, col])
+            for col in range(customdata.shape[1])
+        ]
+        del trace["customdata"]
+
+    # Argumenty tlačítek vrstev (hodnoty pro jednotlivé stopy) stejně binárně
+    for menu in fig_dict.get("layout", {}).get("updatemenus") or []:
+        for button in menu.get("buttons") or []:
+            for arg in button.get("args") or []:
+                if not isinstance(arg, dict):
+                    continue
+                for key, per_trace in arg.items():
+                    if not isinstance(per_trace, list):
+                        continue
+                    packed = []
+                    for value in per_trace:
+                        encoded = None
+                        if isinstance(value, (list, tuple, np.ndarray)):
+                            encoded = _compact_marker_values(value)
+                        packed.append(value if encoded is None else encoded)
+                    arg[key] = packed
+
+    if packed_customdata:
+        layout = fig_dict.setdefault("layout", {})
+        meta = layout.get("meta")
+        layout["meta"] = dict(meta if isinstance(meta, dict) else {})
+        layout["meta"][COMPACT_META_KEY] = packed_customdata
+    return fig_dict
+
+
+def compact_figure_json(fig, coord_decimals=COMPACT_COORD_DECIMALS):
+    return json.dumps(
+        compact_figure_dict(fig, coord_decimals),
+        cls=PlotlyJSONEncoder,
+        separators=(",", ":"),
+    )
+
+
+def write_figure_html(
+    fig,
+    html_path,
+    compact=False,
+    coord_decimals=COMPACT_COORD_DECIMALS,
+    include_plotlyjs=True,
+):
+    if not compact:
+        fig.write_html(html_path, include_plotlyjs=include_plotlyjs)
+        return
+    pio.write_html(
+        compact_figure_dict(fig, coord_decimals),
+        html_path,
+        validate=False,
+        include_plotlyjs=include_plotlyjs,
+        post_script=COMPACT_FIGURE_POST_SCRIPT,
+    )
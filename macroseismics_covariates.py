@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# --- Vzorkování pomocných rastrů v místech hlášení ---
+# Souřadnice všech hlášení se jedním vektorizovaným krokem převedou inverzní
+# afinní transformací rastru na indexy pixelů. Čtou se jen bloky (dlaždice)
+# rastru, do kterých nějaké hlášení padne, celý rastr se do paměti nenačítá.
+COVARIATE_COLUMN_PREFIX = "Kovariata_"
+
+
+def _pixel_indices(transform, xs, ys):
+    # Inverzní afinní transformace pro pole souřadnic najednou
+    inverse = ~transform
+    cols = inverse.a * xs + inverse.b * ys + inverse.c
+    rows = inverse.d * xs + inverse.e * ys + inverse.f
+    return np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+
+
+def sample_raster(raster_path, lons, lats, band=1):
+    try:
+        import rasterio
+        from rasterio.warp import transform as warp_transform
+        from rasterio.windows import Window
+    except ImportError:
+        print("INFO: Vzorkování rastrů přeskočeno - chybí knihovna 'rasterio'.")
+        print("      Nainstalujte 'rasterio': pip install rasterio")
+        return None
+
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    values = np.full(len(lons), np.nan)
+    with rasterio.open(raster_path) as src:
+        finite = np.isfinite(lons) & np.isfinite(lats)
+        xs, ys = lons[finite], lats[finite]
+        if src.crs is not None and not src.crs.is_geographic and finite.any():
+            xs, ys = warp_transform("EPSG:4326", src.crs, xs, ys)
+        rows = np.full(len(lons), -1, dtype=np.int64)
+        cols = np.full(len(lons), -1, dtype=np.int64)
+        rows[finite], cols[finite] = _pixel_indices(
+            src.transform, np.asarray(xs), np.asarray(ys)
+        )
+        inside = (
+            finite
+            & (rows >= 0)
+            & (rows < src.height)
+            & (cols >= 0)
+            & (cols < src.width)
+        )
+        if not inside.any():
+            return values
+
+        # Seskupení bodů podle bloků rastru, každý blok se čte právě jednou
+        block_h, block_w = src.block_shapes[band - 1]
+        point_ids = np.flatnonzero(inside)
+        block_rows = rows[point_ids] // block_h
+        block_cols = cols[point_ids] // block_w
+        n_block_cols = (src.width + block_w - 1) // block_w
+        block_ids = block_rows * n_block_cols + block_cols
+        order = np.argsort(block_ids, kind="stable")
+        unique_blocks, starts = np.unique(block_ids[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        nodata = src.nodatavals[band - 1]
+        for block_id, start, end in zip(unique_blocks, starts, ends):
+            block_row, block_col = divmod(int(block_id), n_block_cols)
+            row_off = block_row * block_h
+            col_off = block_col * block_w
+            window = Window(
+                col_off,
+                row_off,
+                min(block_w, src.width - col_off),
+                min(block_h, src.height - row_off),
+            )
+            block = src.read(band, window=window).astype(float)
+            if nodata is not None:
+                block[block == nodata] = np.nan
+            ids = point_ids[order[start:end]]
+            values[ids] = block[rows[ids] - row_off, cols[ids] - col_off]
+    return values
+
+
+def attach_covariates(
+    df_reports, covariate_rasters, lat_col="lat", lon_col="lon", search_dirs=(".",)
+):
+    # covariate_rasters: {název: cesta} nebo {název: {"path": ..., "band": ...}}
+    added_columns = []
+    for name, spec in covariate_rasters.items():
+        if isinstance(spec, dict):
+            raster_path, band = spec["path"], spec.get("band", 1)
+        else:
+            raster_path, band = spec, 1
+        # Relativní cesty se hledají postupně v search_dirs
+        candidates = [
+            raster_path if os.path.isabs(raster_path) else os.path.join(d, raster_path)
+            for d in search_dirs
+        ]
+        raster_path = next((c for c in candidates if os.path.exists(c)), None)
+        if raster_path is None:
+            print(f"INFO: Rastr kovariáty '{name}' nenalezen ({candidates[0]}).")
+            continue
+        try:
+            sampled = sample_raster(
+                raster_path,
+                pd.to_numeric(df_reports[lon_col], errors="coerce"),
+                pd.to_numeric(df_reports[lat_col], errors="coerce"),
+                band=band,
+            )
+        except Exception as e:
+            print(f"CHYBA při vzorkování rastru '{raster_path}': {e}")
+            continue
+        if sampled is None:
+            break
+        column = f"{COVARIATE_COLUMN_PREFIX}{name}"
+        df_reports[column] = sampled
+        added_columns.append(column)
+        print(
+            f"Kovariáta '{name}': {int(np.isfinite(sampled).sum())} z "
+            f"{len(sampled)} hlášení má hodnotu ({raster_path})."
+        )
+    return added_columns
@@ -0,0 +1,257 @@
+import base64
+import io
+
+import numpy as np
+import plotly.colors as plotly_colors
+import plotly.graph_objects as go
+from scipy.signal import fftconvolve
+
+from macroseismics_geo import project_equal_area, unproject_equal_area
+
+# --- Hustota hlášení (histogram na síti + Gaussovo vyhlazení přes FFT) ---
+# Hlášení se v rovinné projekci kolem epicentra sečtou do pravidelné sítě
+# (histogram2d, jeden průchod přes body) a síť se vyhladí konvolucí
+# s Gaussovým jádrem přes FFT. Cena vyhlazení závisí jen na velikosti sítě,
+# ne na počtu hlášení. Volitelně se hustota vydělí referenční hustotou
+# (body nebo rastr, např. obyvatelstvo) vyhlazenou stejným jádrem.
+# Do mapy se síť vkládá jako obrázek (vrstva mapbox "image") převzorkovaný do
+# Web Mercatoru; klient ji tedy znovu nevyhlazuje a obraz nezávisí na přiblížení.
+DENSITY_TRUNCATE_SIGMAS = 4.0
+DENSITY_MIN_REFERENCE_FRACTION = 0.01  # relativní hustota jen kde ref. >= 1 % max.
+DENSITY_MIN_DISPLAY_FRACTION = 0.02  # buňky pod 2 % maxima se nevykreslují
+DENSITY_IMAGE_PX_PER_CELL = 2
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def _gaussian_kernel(bandwidth_cells, truncate=DENSITY_TRUNCATE_SIGMAS):
+    # Normalizované 2D jádro (součet 1), oříznuté na truncate * sigma
+    radius = max(int(np.ceil(truncate * bandwidth_cells)), 1)
+    offsets = np.arange(-radius, radius + 1)
+    profile = np.exp(-0.5 * (offsets / max(bandwidth_cells, 1e-9)) ** 2)
+    kernel = np.outer(profile, profile)
+    return kernel / kernel.sum()
+
+
+def _smoothed_counts(x, y, edges, kernel):
+    counts, _, _ = np.histogram2d(y, x, bins=[edges, edges])
+    # Zaokrouhlovací chyby FFT dávají drobné záporné hodnoty mimo body
+    return np.clip(fftconvolve(counts, kernel, mode="same"), 0.0, None)
+
+
+def report_density_grid(
+    lons,
+    lats,
+    center_lon,
+    center_lat,
+    half_width_km=100.0,
+    cell_km=1.0,
+    bandwidth_km=3.0,
+    reference_lons=None,
+    reference_lats=None,
+    reference_raster=None,
+    min_reference_fraction=DENSITY_MIN_REFERENCE_FRACTION,
+):
+    # Hustota v hlášeních na km² na síti (řádky = y, sloupce = x v km),
+    # relative = hustota / referenční hustota (kde je reference dostatečná)
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    valid = np.isfinite(lons) & np.isfinite(lats)
+    x, y = project_equal_area(lons[valid], lats[valid], center_lon, center_lat)
+
+    n_cells = max(int(round(2 * half_width_km / cell_km)), 1)
+    half_width_km = n_cells * cell_km / 2.0
+    edges = np.linspace(-half_width_km, half_width_km, n_cells + 1)
+    centres = (edges[:-1] + edges[1:]) / 2.0
+    kernel = _gaussian_kernel(bandwidth_km / cell_km)
+    inside = (np.abs(x) <= half_width_km) & (np.abs(y) <= half_width_km)
+    density = _smoothed_counts(x, y, edges, kernel) / cell_km**2
+
+    mesh_x, mesh_y = np.meshgrid(centres, centres)
+    grid_lons, grid_lats = unproject_equal_area(mesh_x, mesh_y, center_lon, center_lat)
+
+    reference = None
+    if reference_lons is not None and reference_lats is not None:
+        ref_lons = np.asarray(reference_lons, dtype=float)
+        ref_lats = np.asarray(reference_lats, dtype=float)
+        ref_valid = np.isfinite(ref_lons) & np.isfinite(ref_lats)
+        ref_x, ref_y = project_equal_area(
+            ref_lons[ref_valid], ref_lats[ref_valid], center_lon, center_lat
+        )
+        reference = _smoothed_counts(ref_x, ref_y, edges, kernel) / cell_km**2
+    elif reference_raster is not None:
+        from macroseismics_covariates import sample_raster
+
+        # Rastr se vzorkuje ve středech buněk a vyhladí stejným jádrem
+        sampled = sample_raster(reference_raster, grid_lons.ravel(), grid_lats.ravel())
+        if sampled is not None:
+            sampled = np.nan_to_num(sampled.reshape(grid_lons.shape), nan=0.0)
+            reference = np.clip(fftconvolve(sampled, kernel, mode="same"), 0.0, None)
+
+    relative = None
+    if reference is not None:
+        threshold = min_reference_fraction * reference.max()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            relative = np.where(
+                (reference > threshold) & (reference > 0),
+                density / reference,
+                np.nan,
+            )
+    return {
+        "lons": grid_lons,
+        "lats": grid_lats,
+        "density": density,
+        "reference": reference,
+        "relative": relative,
+        "cell_km": cell_km,
+        "half_width_km": half_width_km,
+        "center_lon": center_lon,
+        "center_lat": center_lat,
+        "bandwidth_km": bandwidth_km,
+        "n_points": int(inside.sum()),
+        "n_outside": int(len(lons) - inside.sum()),
+    }
+
+
+def _mercator_y(lats):
+    lats = np.clip(np.asarray(lats, dtype=float), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    return np.log(np.tan(np.pi / 4.0 + np.radians(lats) / 2.0))
+
+
+def _colorscale_lut(colorscale, n_colors=256):
+    samples = plotly_colors.sample_colorscale(
+        colorscale, np.linspace(0.0, 1.0, n_colors)
+    )
+    return np.array([plotly_colors.unlabel_rgb(c) for c in samples]).astype(np.uint8)
+
+
+def density_image(
+    density_grid,
+    values,
+    z_max,
+    colorscale="YlOrRd",
+    opacity=0.6,
+    min_display_fraction=DENSITY_MIN_DISPLAY_FRACTION,
+    px_per_cell=DENSITY_IMAGE_PX_PER_CELL,
+):
+    # RGBA obrázek sítě v pravidelné síti délky a Mercatorovy y (tak mapbox
+    # obrázek roztáhne mezi rohy); každý pixel nese hodnotu buňky, do které
+    # padne, buňky pod prahem a mimo síť jsou průhledné
+    half_width_km = density_grid["half_width_km"]
+    cell_km = density_grid["cell_km"]
+    n_cells = values.shape[0]
+    edge = np.linspace(-half_width_km, half_width_km, 4 * n_cells + 1)
+    border_x = np.concatenate(
+        [
+            edge,
+            edge,
+            np.full_like(edge, -half_width_km),
+            np.full_like(edge, half_width_km),
+        ]
+    )
+    border_y = np.concatenate(
+        [
+            np.full_like(edge, -half_width_km),
+            np.full_like(edge, half_width_km),
+            edge,
+            edge,
+        ]
+    )
+    border_lons, border_lats = unproject_equal_area(
+        border_x, border_y, density_grid["center_lon"], density_grid["center_lat"]
+    )
+    west, east = float(border_lons.min()), float(border_lons.max())
+    south, north = float(border_lats.min()), float(border_lats.max())
+
+    n_px = px_per_cell * n_cells
+    px_lons = np.linspace(west, east, n_px)
+    px_merc = np.linspace(_mercator_y(north), _mercator_y(south), n_px)
+    px_lats = np.degrees(2.0 * np.arctan(np.exp(px_merc)) - np.pi / 2.0)
+    mesh_lons, mesh_lats = np.meshgrid(px_lons, px_lats)
+    x, y = project_equal_area(
+        mesh_lons, mesh_lats, density_grid["center_lon"], density_grid["center_lat"]
+    )
+    col = np.floor((x + half_width_km) / cell_km).astype(int)
+    row = np.floor((y + half_width_km) / cell_km).astype(int)
+    inside = (col >= 0) & (col < n_cells) & (row >= 0) & (row < n_cells)
+    px_values = np.full(mesh_lons.shape, np.nan)
+    px_values[inside] = values[row[inside], col[inside]]
+
+    shown = np.isfinite(px_values) & (px_values >= min_display_fraction * z_max)
+    lut = _colorscale_lut(colorscale)
+    levels = np.clip(np.nan_to_num(px_values / z_max) * (len(lut) - 1), 0, len(lut) - 1)
+    rgba = np.zeros(mesh_lons.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = lut[levels.astype(int)]
+    rgba[..., 3] = np.where(shown, int(round(255 * opacity)), 0)
+    corners = [[west, north], [east, north], [east, south], [west, south]]
+    return rgba, corners
+
+
+def add_density_layer(
+    fig,
+    density_grid,
+    use_relative=None,
+    colorscale="YlOrRd",
+    opacity=0.6,
+    min_display_fraction=DENSITY_MIN_DISPLAY_FRACTION,
+):
+    # Vyhlazená síť jako obrázková vrstva pod stopami (body hlášení zůstávají
+    # nahoře) + neviditelná stopa, která nese barevnou škálu
+    try:
+        from PIL import Image
+    except ImportError:
+        print("INFO: Vrstva hustoty hlášení přeskočena - chybí balík 'Pillow'.")
+        return None
+    if use_relative is None:
+        use_relative = density_grid["relative"] is not None
+    values = density_grid["relative" if use_relative else "density"]
+    if values is None:
+        return None
+    finite = np.isfinite(values)
+    if not finite.any() or values[finite].max() <= 0:
+        print("INFO: Vrstva hustoty hlášení se nevykresluje (nulová hustota).")
+        return None
+    z_max = float(values[finite].max())
+    rgba, corners = density_image(
+        density_grid, values, z_max, colorscale, opacity, min_display_fraction
+    )
+    png = io.BytesIO()
+    Image.fromarray(rgba, mode="RGBA").save(png, format="PNG", optimize=True)
+    source = "data:image/png;base64," + base64.b64encode(png.getvalue()).decode("ascii")
+    fig.update_layout(
+        mapbox_layers=list(fig.layout.mapbox.layers)
+        + [
+            {
+                "sourcetype": "image",
+                "source": source,
+                "coordinates": corners,
+                "below": "traces",
+            }
+        ]
+    )
+
+    title = (
+        "Relativní hustota"
+        if use_relative
+        else f"Hlášení / km² (σ={density_grid['bandwidth_km']:g} km)"
+    )
+    fig.add_trace(
+        go.Scattermapbox(
+            lat=[density_grid["center_lat"]],
+            lon=[density_grid["center_lon"]],
+            mode="markers",
+            marker=dict(
+                size=0,
+                opacity=0,
+                color=[z_max],
+                cmin=0.0,
+                cmax=z_max,
+                colorscale=colorscale,
+                showscale=True,
+                colorbar=dict(title=dict(text=title), x=0.0, xanchor="left", len=0.5),
+            ),
+            hoverinfo="skip",
+            name="Hustota hlášení",
+            showlegend=False,
+        )
+    )
+    return fig
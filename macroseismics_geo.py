@@ -0,0 +1,62 @@
+import numpy as np
+
+# --- Lokální projekce pro výpočty v km ---
+# Lambertova azimutální stejnoplochá projekce (koule) se středem v epicentru.
+# Plochy jsou zachovány přesně, vzdálenosti od středu téměř přesně, což pro
+# regionální makroseismiku (stovky km) plně postačuje.
+EARTH_RADIUS_KM = 6371.0088
+
+
+def project_equal_area(lons, lats, lon0, lat0):
+    lon = np.radians(np.asarray(lons, dtype=float))
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lam0 = np.radians(lon0)
+    phi0 = np.radians(lat0)
+    d_lam = lon - lam0
+    cos_lat = np.cos(lat)
+    denom = 1.0 + np.sin(phi0) * np.sin(lat) + np.cos(phi0) * cos_lat * np.cos(d_lam)
+    k = np.sqrt(2.0 / np.clip(denom, 1e-12, None))
+    x = EARTH_RADIUS_KM * k * cos_lat * np.sin(d_lam)
+    y = (
+        EARTH_RADIUS_KM
+        * k
+        * (np.cos(phi0) * np.sin(lat) - np.sin(phi0) * cos_lat * np.cos(d_lam))
+    )
+    return x, y
+
+
+def unproject_equal_area(x, y, lon0, lat0):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    lam0 = np.radians(lon0)
+    phi0 = np.radians(lat0)
+    rho = np.hypot(x, y)
+    c = 2.0 * np.arcsin(np.clip(rho / (2.0 * EARTH_RADIUS_KM), -1.0, 1.0))
+    sin_c = np.sin(c)
+    cos_c = np.cos(c)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        lat = np.where(
+            rho > 0,
+            np.arcsin(
+                cos_c * np.sin(phi0)
+                + y * sin_c * np.cos(phi0) / np.where(rho > 0, rho, 1)
+            ),
+            phi0,
+        )
+        lon = lam0 + np.arctan2(
+            x * sin_c, rho * np.cos(phi0) * cos_c - y * np.sin(phi0) * sin_c
+        )
+    return np.degrees(lon), np.degrees(lat)
+
+
+def haversine_km(lons, lats, lon0, lat0):
+    # Vzdálenost po hlavní kružnici od bodu (lon0, lat0) v km
+    lon = np.radians(np.asarray(lons, dtype=float))
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lam0 = np.radians(lon0)
+    phi0 = np.radians(lat0)
+    a = (
+        np.sin((lat - phi0) / 2.0) ** 2
+        + np.cos(lat) * np.cos(phi0) * np.sin((lon - lam0) / 2.0) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
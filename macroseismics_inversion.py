@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+from macroseismics_geo import project_equal_area
+from macroseismics_stages import fork_process_pool
+
+# --- Makroseismická inverze (grid search epicentra a magnitudy) ---
+# Vztah útlumu intenzity (IPE): I = a + b*M + c*log10(R) + d*R,
+# R = sqrt(De^2 + h^2) v km. Koeficienty jsou výchozí odhad pro malá
+# mělká zemětřesení a lze je přepsat z konfigurace skriptu.
+DEFAULT_IPE_COEFFS = {"a": 1.5, "b": 1.5, "c": -2.5, "d": -0.002}
+DEFAULT_DEPTH_KM = 10.0
+# Maximální počet prvků matice (uzly x pozorování) zpracovaných najednou
+MAX_CHUNK_ELEMENTS = 2_000_000
+
+
+def _residual_sums_chunk(args):
+    # Pro blok uzlů sítě spočítá sum(y) a sum(y^2), kde y = I_obs - (a + c*log10(R) + d*R).
+    # Člen b*M je na poloze nezávislý, misfit pro všechny magnitudy se pak dopočte analyticky.
+    node_x, node_y, obs_x, obs_y, obs_i, coeffs, depth_km = args
+    dx = node_x[:, None] - obs_x[None, :]
+    dy = node_y[:, None] - obs_y[None, :]
+    r = np.sqrt(dx * dx + dy * dy + depth_km * depth_km)
+    y = obs_i[None, :] - (coeffs["a"] + coeffs["c"] * np.log10(r) + coeffs["d"] * r)
+    return y.sum(axis=1), (y * y).sum(axis=1)
+
+
+def invert_macroseismic_epicentre(
+    obs_lats,
+    obs_lons,
+    obs_intensities,
+    center_lat,
+    center_lon,
+    half_width_deg=1.0,
+    step_deg=0.02,
+    magnitudes=None,
+    depth_km=DEFAULT_DEPTH_KM,
+    ipe_coeffs=None,
+    n_processes=1,
+):
+    coeffs = dict(DEFAULT_IPE_COEFFS)
+    if ipe_coeffs:
+        coeffs.update(ipe_coeffs)
+    if magnitudes is None:
+        magnitudes = np.round(np.arange(1.5, 5.01, 0.1), 2)
+    magnitudes = np.asarray(magnitudes, dtype=float)
+
+    obs_lats = np.asarray(obs_lats, dtype=float)
+    obs_lons = np.asarray(obs_lons, dtype=float)
+    obs_i = np.asarray(obs_intensities, dtype=float)
+    valid = np.isfinite(obs_lats) & np.isfinite(obs_lons) & np.isfinite(obs_i)
+    obs_lats, obs_lons, obs_i = obs_lats[valid], obs_lons[valid], obs_i[valid]
+    n_obs = len(obs_i)
+    if n_obs < 3:
+        print(f"INFO: Inverze přeskočena - málo pozorování ({n_obs}).")
+        return None
+
+    grid_lats = center_lat + np.arange(
+        -half_width_deg, half_width_deg + step_deg / 2, step_deg
+    )
+    grid_lons = center_lon + np.arange(
+        -half_width_deg, half_width_deg + step_deg / 2, step_deg
+    )
+    mesh_lons, mesh_lats = np.meshgrid(grid_lons, grid_lats)
+    node_x, node_y = project_equal_area(
+        mesh_lons.ravel(), mesh_lats.ravel(), center_lon, center_lat
+    )
+    obs_x, obs_y = project_equal_area(obs_lons, obs_lats, center_lon, center_lat)
+
+    n_nodes = len(node_x)
+    chunk_size = max(1, MAX_CHUNK_ELEMENTS // n_obs)
+    tasks = [
+        (
+            node_x[s : s + chunk_size],
+            node_y[s : s + chunk_size],
+            obs_x,
+            obs_y,
+            obs_i,
+            coeffs,
+            depth_km,
+        )
+        for s in range(0, n_nodes, chunk_size)
+    ]
+
+    results = None
+    if n_processes and n_processes > 1 and len(tasks) > 1:
+        executor = fork_process_pool(n_processes, "inverze poběží v jednom procesu")
+        if executor is not None:
+            with executor:
+                results = list(executor.map(_residual_sums_chunk, tasks))
+    if results is None:
+        results = [_residual_sums_chunk(task) for task in tasks]
+
+    sum_y = np.concatenate([r[0] for r in results])
+    sum_yy = np.concatenate([r[1] for r in results])
+
+    # RMS misfit pro všechny uzly a magnitudy najednou (uzly x magnitudy)
+    b_m = coeffs["b"] * magnitudes[None, :]
+    mse = (sum_yy[:, None] - 2.0 * b_m * sum_y[:, None] + b_m * b_m * n_obs) / n_obs
+    rms = np.sqrt(np.clip(mse, 0.0, None))
+
+    best_m_idx = rms.argmin(axis=1)
+    misfit_surface = rms[np.arange(n_nodes), best_m_idx].reshape(mesh_lats.shape)
+    best_mag_surface = magnitudes[best_m_idx].reshape(mesh_lats.shape)
+    best_flat = int(misfit_surface.argmin())
+    best_row, best_col = np.unravel_index(best_flat, misfit_surface.shape)
+
+    # Minimum na okraji sítě nebo rozsahu magnitud = řešení není omezené daty
+    on_grid_edge = bool(
+        best_row in (0, len(grid_lats) - 1)
+        or best_col in (0, len(grid_lons) - 1)
+        or best_mag_surface[best_row, best_col] in (magnitudes[0], magnitudes[-1])
+    )
+
+    return {
+        "lat": float(grid_lats[best_row]),
+        "lon": float(grid_lons[best_col]),
+        "magnitude": float(best_mag_surface[best_row, best_col]),
+        "misfit": float(misfit_surface[best_row, best_col]),
+        "n_observations": n_obs,
+        "on_grid_edge": on_grid_edge,
+        "grid_lats": grid_lats,
+        "grid_lons": grid_lons,
+        "magnitudes": magnitudes,
+        "misfit_surface": misfit_surface,
+        "best_magnitude_surface": best_mag_surface,
+    }
+
+
+def misfit_surface_to_frame(inversion_result):
+    # Plochá tabulka uzlů sítě (např. pro export do CSV/QGIS nebo mapu)
+    mesh_lons, mesh_lats = np.meshgrid(
+        inversion_result["grid_lons"], inversion_result["grid_lats"]
+    )
+    return pd.DataFrame(
+        {
+            "lat": mesh_lats.ravel(),
+            "lon": mesh_lons.ravel(),
+            "misfit_rms": inversion_result["misfit_surface"].ravel(),
+            "best_magnitude": inversion_result["best_magnitude_surface"].ravel(),
+        }
+    )
@@ -0,0 +1,200 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import ConvexHull, QhullError
+
+from macroseismics_geo import project_equal_area
+
+# Nejvyšší řadicí hodnota skutečného stupně EMS-98 (XII)
+MAX_EMS_SORT_VALUE = 12
+
+
+# --- Vnořené izoseismální oblasti (konvexní obálky) ---
+# Obálky se počítají od nejvyššího stupně k nejnižšímu: obálka stupně k je
+# obálkou vrcholů obálky k+1 a nově přidaných bodů stupně k, takže se žádný
+# bod nezpracovává opakovaně. Hotové polygony se ukládají do cache podle
+# otisku vstupních dat, opakované vykreslení map je tak znovu nepočítá.
+# Cache sdílejí etapy běžící ve vláknech, přístup chrání zámek. Volající
+# dostávají kopie, úprava vrácených obálek tak cache nezmění.
+HULL_CACHE_MAX_ENTRIES = 16
+_hull_cache = OrderedDict()
+_hull_cache_lock = threading.Lock()
+
+
+def _hull_cache_key(lons, lats, sort_vals, levels):
+    digest = hashlib.blake2b(digest_size=16)
+    for arr in (lons, lats, sort_vals):
+        digest.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+    digest.update("|".join(levels).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _copy_hulls(hulls):
+    return [dict(h, lons=h["lons"].copy(), lats=h["lats"].copy()) for h in hulls]
+
+
+def clear_isoseismal_hull_cache():
+    with _hull_cache_lock:
+        _hull_cache.clear()
+
+
+def build_isoseismal_hulls(
+    df_map_data,
+    ems_levels,
+    sort_ems_key_func,
+    lat_col="lat",
+    lon_col="lon",
+    ems_col="EMS_Intensity_Est",
+    use_cache=True,
+):
+    # Pro každý stupeň EMS s vlastními hlášeními obálka všech bodů se stupněm
+    # >= daný stupeň
+    valid_ems_levels_desc = sorted(
+        [
+            level
+            for level in ems_levels
+            if "Neklasifikováno" not in level and "Nepocítěno" not in level
+        ],
+        key=sort_ems_key_func,
+        reverse=True,
+    )
+    lats = pd.to_numeric(df_map_data[lat_col], errors="coerce").to_numpy(dtype=float)
+    lons = pd.to_numeric(df_map_data[lon_col], errors="coerce").to_numpy(dtype=float)
+    # Řadicí hodnoty jen pro unikátní stupně, na řádky se rozšíří přes kódy
+    ems_codes, ems_uniques = pd.factorize(df_map_data[ems_col])
+    unique_sort_vals = np.array(
+        [sort_ems_key_func(level) for level in ems_uniques] + [np.nan], dtype=float
+    )
+    sort_vals = unique_sort_vals[ems_codes]  # kód -1 (NaN) ukazuje na poslední prvek
+    # Neklasifikované záznamy (řadicí hodnota 900/1000) do obálek nepatří
+    valid = (
+        np.isfinite(lats)
+        & np.isfinite(lons)
+        & np.isfinite(sort_vals)
+        & (sort_vals <= MAX_EMS_SORT_VALUE)
+    )
+    lats, lons, sort_vals = lats[valid], lons[valid], sort_vals[valid]
+
+    cache_key = None
+    if use_cache:
+        cache_key = _hull_cache_key(lons, lats, sort_vals, valid_ems_levels_desc)
+        with _hull_cache_lock:
+            if cache_key in _hull_cache:
+                _hull_cache.move_to_end(cache_key)
+                return _copy_hulls(_hull_cache[cache_key])
+
+    # Body seřazené sestupně podle stupně; pro každý stupeň stačí hranice řezu
+    order = np.argsort(-sort_vals, kind="stable")
+    coordinates_sorted = np.column_stack([lons[order], lats[order]])
+    neg_sorted_vals = -sort_vals[order]
+
+    hulls_desc = []
+    seed_points = np.empty((0, 2))
+    n_added = 0
+    for ems_level_str in valid_ems_levels_desc:
+        current_level_sort_val = sort_ems_key_func(ems_level_str)
+        n_points = int(
+            np.searchsorted(neg_sorted_vals, -current_level_sort_val, side="right")
+        )
+        new_points = coordinates_sorted[n_added:n_points]
+        n_added = n_points
+        if len(new_points) == 0:
+            # Stupeň bez vlastních hlášení nemá izoseistu (obálka by jen
+            # opakovala vyšší stupeň)
+            continue
+        candidate_points = np.vstack([seed_points, new_points])
+        seed_points = candidate_points
+        if n_points < 3:
+            continue
+        try:
+            hull = ConvexHull(candidate_points)
+        except QhullError:
+            print(f"INFO: ConvexHull pro {ems_level_str} ({n_points} bodů) přeskočen.")
+            continue
+        except Exception as e:
+            print(f"CHYBA: ConvexHull pro {ems_level_str}: {e}")
+            continue
+        seed_points = candidate_points[hull.vertices]
+        hull_lons = seed_points[:, 0]
+        hull_lats = seed_points[:, 1]
+        hulls_desc.append(
+            {
+                "level": ems_level_str,
+                "lons": np.append(hull_lons, hull_lons[0]),
+                "lats": np.append(hull_lats, hull_lats[0]),
+                "n_points": n_points,
+            }
+        )
+
+    hulls = hulls_desc[::-1]
+    if use_cache:
+        with _hull_cache_lock:
+            _hull_cache[cache_key] = _copy_hulls(hulls)
+            while len(_hull_cache) > HULL_CACHE_MAX_ENTRIES:
+                _hull_cache.popitem(last=False)
+    return hulls
+
+
+# --- Metriky plochy pocítění a izoseist ---
+def _polygon_moments(x, y):
+    # Plocha, těžiště a centrální momenty 2. řádu uzavřeného polygonu (shoelace)
+    x0, y0 = x[:-1], y[:-1]
+    x1, y1 = x[1:], y[1:]
+    cross = x0 * y1 - x1 * y0
+    area = cross.sum() / 2.0
+    if abs(area) < 1e-12:
+        return 0.0, float(np.mean(x0)), float(np.mean(y0)), 0.0, 0.0, 0.0
+    cx = ((x0 + x1) * cross).sum() / (6.0 * area)
+    cy = ((y0 + y1) * cross).sum() / (6.0 * area)
+    ixx = ((y0 * y0 + y0 * y1 + y1 * y1) * cross).sum() / 12.0
+    iyy = ((x0 * x0 + x0 * x1 + x1 * x1) * cross).sum() / 12.0
+    ixy = ((x0 * y1 + 2 * x0 * y0 + 2 * x1 * y1 + x1 * y0) * cross).sum() / 24.0
+    # Přesun k těžišti (znaménko plochy pokrývá orientaci polygonu)
+    mu_yy = ixx / area - cy * cy
+    mu_xx = iyy / area - cx * cx
+    mu_xy = ixy / area - cx * cy
+    return abs(area), cx, cy, mu_xx, mu_yy, mu_xy
+
+
+def compute_isoseismal_metrics(hulls, eq_lat, eq_lon):
+    rows = []
+    for hull in hulls:
+        x, y = project_equal_area(hull["lons"], hull["lats"], eq_lon, eq_lat)
+        area, cx, cy, mu_xx, mu_yy, mu_xy = _polygon_moments(x, y)
+        # Hlavní osy z kovarianční matice polygonu
+        half_trace = (mu_xx + mu_yy) / 2.0
+        root = np.sqrt(((mu_xx - mu_yy) / 2.0) ** 2 + mu_xy**2)
+        lambda_major = half_trace + root
+        lambda_minor = max(half_trace - root, 0.0)
+        # Azimut hlavní osy od severu po směru hodinových ručiček, 0-180°
+        major_azimuth = np.degrees(np.arctan2(2.0 * mu_xy, mu_yy - mu_xx) / 2.0) % 180.0
+        rows.append(
+            {
+                "ems_level": hull["level"],
+                "n_points": hull["n_points"],
+                "area_km2": area,
+                "equivalent_radius_km": np.sqrt(area / np.pi),
+                "centroid_offset_km": float(np.hypot(cx, cy)),
+                "centroid_azimuth_deg": float(np.degrees(np.arctan2(cx, cy)) % 360.0),
+                "major_axis_azimuth_deg": float(major_azimuth),
+                "elongation": float(np.sqrt(lambda_major / lambda_minor))
+                if lambda_minor > 0
+                else np.nan,
+            }
+        )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "ems_level",
+            "n_points",
+            "area_km2",
+            "equivalent_radius_km",
+            "centroid_offset_km",
+            "centroid_azimuth_deg",
+            "major_axis_azimuth_deg",
+            "elongation",
+        ],
+    )
@@ -1,15 +1,77 @@
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import functools
 import os
 import sys
-import numpy as np
-from scipy.spatial import ConvexHull
-from scipy.spatial import QhullError  # Správný import
+import threading
 
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
 from pptx import Presentation
 from pptx.util import Inches
 
+from macroseismics_core import (
+    COL_DAMAGE_OVERALL,
+    COL_FELT_BY,
+    COL_LAT,
+    COL_LON,
+    COL_OBS_DATETIME,
+    COL_TREMOR_TYPE,
+    COLS_OBJECT_MOVEMENT_DETAILS,
+    COLS_SOUNDS,
+    EMS_COLOR_MAP,
+    HOVER_DATA_MAIN_MAP_COLS,
+    MAP_CONFIGS,
+    NEGATIVE_OR_EMPTY_VALUES,
+    build_bar_figure,
+    build_map_figure,
+    build_multilayer_map_figure,
+    classify_ems_intensity,
+    format_magnitude,
+    load_report_table,
+    make_event_info,
+    movement_observed_flags,
+    parametric_category_order,
+    prepare_categories,
+    select_event_window,
+    sort_ems_key,
+    write_figure_html,
+)
+from macroseismics_covariates import attach_covariates
+from macroseismics_density import add_density_layer, report_density_grid
+from macroseismics_inversion import (
+    invert_macroseismic_epicentre,
+    misfit_surface_to_frame,
+)
+from macroseismics_isoseismals import (
+    build_isoseismal_hulls,
+    compute_isoseismal_metrics,
+)
+from macroseismics_monitor import (
+    candidate_event_window,
+    detect_events,
+    detected_event_identity,
+)
+from macroseismics_normalize import answer_observed_flags
+from macroseismics_outliers import detect_spatial_outliers, outlier_reason_text
+from macroseismics_raster import (
+    aggregate_locality_intensities,
+    write_intensity_geotiff,
+)
+from macroseismics_stages import Stage, StageScheduler
+from macroseismics_store import (
+    events_within_km,
+    pooled_intensity_distance,
+    store_event_results,
+)
+from macroseismics_sweep import (
+    STABLE_ADDED_TVD_THRESHOLD,
+    build_sweep_figure,
+    mark_stable_windows,
+    time_window_sweep,
+)
+from macroseismics_tiles import write_tile_viewer_html, write_vector_tiles
+from macroseismics_workbook import count_table, write_summary_workbook
+
 print("--- START SKRIPTU ---")
 
 # --- Konfigurace ---
@@ -27,100 +89,195 @@ EQ_MAGNITUDE = 3.1
 EQ_GFU_ID = 1773
 EQ_LOCATION_NAME = "u Mirotic"
 TIME_WINDOW_HOURS_FILTER = 1.5
+# Čas a poloha mohou přijít z monitoru hlášení (macroseismics_monitor.py).
+# Jiná událost bez zadané identity dostane ID a název odvozené z času a
+# neznámou magnitudu, aby nepřepsala výstupy ani databázi výchozí události.
+if os.environ.get("MACROSEIS_EQ_DATETIME_UTC"):
+    EQ_DATETIME_UTC_STR = os.environ["MACROSEIS_EQ_DATETIME_UTC"]
+    _eq_override_ts = pd.Timestamp(EQ_DATETIME_UTC_STR)
+    EQ_YEAR_TARGET = _eq_override_ts.year
+    EQ_MONTH_TARGET = _eq_override_ts.month
+    EQ_DAY_TARGET = _eq_override_ts.day
+    EQ_LAT = float(os.environ.get("MACROSEIS_EQ_LAT", EQ_LAT))
+    EQ_LON = float(os.environ.get("MACROSEIS_EQ_LON", EQ_LON))
+    _eq_identity = detected_event_identity(_eq_override_ts)
+    EQ_GFU_ID = _eq_identity["gfu_id"]
+    EQ_LOCATION_NAME = _eq_identity["location_name"]
+    EQ_MAGNITUDE = _eq_identity["magnitude"]
+if os.environ.get("MACROSEIS_EQ_GFU_ID"):
+    EQ_GFU_ID = int(os.environ["MACROSEIS_EQ_GFU_ID"])
+if os.environ.get("MACROSEIS_EQ_LOCATION_NAME"):
+    EQ_LOCATION_NAME = os.environ["MACROSEIS_EQ_LOCATION_NAME"]
+if os.environ.get("MACROSEIS_EQ_MAGNITUDE"):
+    EQ_MAGNITUDE = float(os.environ["MACROSEIS_EQ_MAGNITUDE"])
+# Automatická detekce události ze shluků hlášení (místo ručního zadání času)
+AUTO_DETECT_EVENT = False
+MONITOR_BUCKET_MINUTES = 10
+MONITOR_WINDOW_BUCKETS = 3
+MONITOR_BACKGROUND_BUCKETS = 144
+MONITOR_CELL_DEG = 0.5
+MONITOR_MIN_REPORTS = 10
+MONITOR_RATE_FACTOR = 5.0
 CENTER_LAT_CR_ZOOMED = 49.81746
 CENTER_LON_CR_ZOOMED = 15.47490
 ZOOM_LEVEL_CR_ZOOMED = 6.0
+# Makroseismická inverze epicentra a magnitudy z odhadů EMS
+RUN_MACROSEISMIC_INVERSION = True
+INVERSION_GRID_HALF_WIDTH_DEG = 1.0
+INVERSION_GRID_STEP_DEG = 0.02
+INVERSION_MAGNITUDES = np.round(np.arange(1.5, 5.01, 0.1), 2)
+INVERSION_DEPTH_KM = 10.0
+INVERSION_IPE_COEFFS = None  # None = výchozí koeficienty z macroseismics_inversion
+INVERSION_N_PROCESSES = 1
+# Rastr interpolované intenzity (dlaždicový GeoTIFF s přehledy)
+RUN_INTENSITY_RASTER_EXPORT = True
+RASTER_HALF_WIDTH_DEG = 1.5
+RASTER_CELL_SIZE_DEG = 0.005
+RASTER_LOCALITY_CELL_DEG = 0.02  # None = interpolace přímo z jednotlivých hlášení
+RASTER_IDW_NEIGHBOURS = 12
+RASTER_IDW_POWER = 2.0
+RASTER_MAX_DISTANCE_KM = 25.0
+# Interaktivní výstup: jedna mapa s přepínáním vrstev místo samostatných HTML
+# map pozorování; statická PNG těchto map se renderují jen pro prezentaci.
+MULTILAYER_INTERACTIVE_MAP = True
+GENERATE_PPTX = True
+# Kompaktní HTML figur: souřadnice a customdata jako binární pole (viz
+# macroseismics_core); "cdn" místo True ušetří ~3.5 MB plotly.js v každém souboru
+COMPACT_FIGURE_OUTPUT = True
+COMPACT_COORD_DECIMALS = 5
+FIGURE_INCLUDE_PLOTLYJS = True
+# Souběžné spouštění nezávislých etap ("thread" nebo "process"). V procesech
+# (fork) mohou etapy samy paralelizovat přes procesy (dlaždice, inverze);
+# ve vláknech by fork vícevláknového procesu hrozil uváznutím, takže tyto
+# etapy pak běží v jednom procesu.
+STAGE_EXECUTOR = "process"
+STAGE_MAX_WORKERS = 4
+# Detekce hlášení nekonzistentních se sousedy a se vzdáleností od epicentra
+RUN_OUTLIER_DETECTION = True
+OUTLIER_K_NEIGHBOURS = 12
+OUTLIER_MAX_NEIGHBOUR_DISTANCE_KM = 30.0
+OUTLIER_EMS_THRESHOLD = 3.0  # rozdíl stupňů EMS proti mediánu sousedů
+OUTLIER_MIN_CRITERIA = 2  # podezřelé, shodnou-li se alespoň 2 ze 3 kritérií
+OUTLIER_EXCLUDE_FROM_HULLS = False  # vynechat podezřelá hlášení z izoseist
+# Pomocné rastry (GeoTIFF) vzorkované v místech hlášení -> sloupce Kovariata_*
+# Relativní cesty se hledají v pracovním a ve výstupním adresáři.
+RUN_COVARIATE_SAMPLING = True
+COVARIATE_RASTERS = {
+    "hrrr": "hrrr.tif",
+    # "hustota_obyvatel": "hustota_obyvatel.tif",
+    # "trida_podlozi": {"path": "geologie.tif", "band": 1},
+}
+# Citlivost rozdělení kategorií na šířku časového okna (+/- hodin)
+RUN_TIME_WINDOW_SWEEP = True
+SWEEP_WINDOW_HOURS = [0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 6.0, 12.0]
+SWEEP_CATEGORY_COLUMNS = [
+    "EMS_Intensity_Est",
+    "Mist_Pozorovani_Kat_Full",
+    "Pocit_Kategorie_Text_Full",
+    "Intenzita_Kat_Full",
+    "Strach_Pocit_Kat_Text_Full",
+    "Pohyb_Predmetu_Agregovany_Text_Full",
+    "Poskozeni_Obecne_Text_Full",
+    "Zvuk_Reportovan_Text_Full",
+]
+# Vektorové dlaždice (MVT) hlášení a izoseist pro prohlížení velkých souborů
+RUN_VECTOR_TILE_EXPORT = True
+VECTOR_TILE_FORMAT = "dir"  # "dir" (z/x/y.pbf + index.html) nebo "mbtiles"
+VECTOR_TILE_MIN_ZOOM = 4
+VECTOR_TILE_MAX_ZOOM = 11
+VECTOR_TILE_N_PROCESSES = 4  # jen se STAGE_EXECUTOR = "process"
+VECTOR_TILE_CATEGORY_COLUMNS = [config[0] for config in MAP_CONFIGS]
+# Souhrnný sešit Excel (počty kategorií a klasifikovaná hlášení)
+RUN_SUMMARY_WORKBOOK = True
+SUMMARY_WORKBOOK_CATEGORY_SHEETS = {
+    "Misto_pozorovani": "Mist_Pozorovani_Kat_Full",
+    "Typ_pocitu": "Pocit_Kategorie_Text_Full",
+    "Intenzita_popis": "Intenzita_Kat_Full",
+    "Strach_panika": "Strach_Pocit_Kat_Text_Full",
+    "Pohyb_predmetu": "Pohyb_Predmetu_Agregovany_Text_Full",
+    "Poskozeni_budov": "Poskozeni_Obecne_Text_Full",
+    "Zvuky": "Zvuk_Reportovan_Text_Full",
+}
+# Mapa hustoty hlášení (histogram na síti + Gaussovo vyhlazení přes FFT)
+RUN_DENSITY_MAP = True
+DENSITY_HALF_WIDTH_KM = 150.0
+DENSITY_CELL_KM = 1.0
+DENSITY_BANDWIDTH_KM = 3.0
+# Referenční rastr pro relativní hustotu (např. obyvatelé na buňku), None = bez
+DENSITY_REFERENCE_RASTER = None  # "hustota_obyvatel.tif"
+# Společná databáze výsledků všech zpracovaných událostí (SQLite)
+RUN_RESULTS_STORE = True
+RESULTS_DB_PATH = "makroseismika_vysledky.sqlite"
+RESULTS_NEARBY_EVENTS_KM = 50.0
 OUTPUT_DIR = f"analyza_vysledky_{EQ_LOCATION_NAME.lower().replace(' ', '_').replace('-', '_')}_{EQ_YEAR_TARGET}"
 print(f"Výstupní adresář bude: {os.path.abspath(OUTPUT_DIR)}")
 
-COL_OBS_DATETIME = "eqdatetime"
-COL_LAT = "lat"
-COL_LON = "lon"
-COL_IN_BUILDING = "pozorovaniodkud"
-COL_FEAR = "reakcepanika"
-COL_TREMOR_TYPE = "popispohybu"
-COL_FELT_BY = "kolikpozorvenku"
-COLS_OBJECT_MOVEMENT_DETAILS = [
-    "nabytektezky",
-    "okna",
-    "dvere",
-    "zavespredmety",
-    "nadobi",
-    "malepredmety",
-    "kapalina",
-]
-COL_DAMAGE_OVERALL = "poskozomitka"
-COLS_SOUNDS = [
-    "zvukzavrzani",
-    "zvukduneni",
-    "zvukvibrace",
-    "zvukhuceni",
-    "zvukvrzani",
-    "zvukvitr",
-    "zvukexploze",
-    "zvuktanku",
-    "zvuknevin",
-]
-NEGATIVE_OR_EMPTY_VALUES = ["", "0", "ne", "no", "false", "nan", "null"]
-
 # --- Načtení a základní příprava dat ---
-print(f"\n--- Načítání dat z: {DATA_FILE_PATH} ---")
 try:
-    df = pd.read_excel(
-        DATA_FILE_PATH, sheet_name=SHEET_NAME, na_values=["NULL", "null", ""]
+    df, validation_report = load_report_table(
+        DATA_FILE_PATH, SHEET_NAME, return_validation=True
     )
-    print(f"Úspěšně načteno {len(df)} řádků z Excelu.")
-    if df.empty:
-        print("CHYBA: Načtený DataFrame je prázdný.")
-        sys.exit("Skript ukončen - prázdný DataFrame.")
 except FileNotFoundError:
     print(f"CHYBA: Soubor {DATA_FILE_PATH} nebyl nalezen.")
     sys.exit(f"Skript ukončen - soubor nenalezen.")
 except Exception as e:
-    print(f"CHYBA při načítání Excelu: {e}")
-    sys.exit(f"Skript ukončen - chyba Excelu: {e}")
+    print(f"CHYBA při načítání a přípravě dat: {e}")
+    sys.exit(f"Skript ukončen - chyba dat: {e}")
 
-print(f"\n--- Zpracování časových údajů (sloupec '{COL_OBS_DATETIME}') ---")
-try:
-    if COL_OBS_DATETIME not in df.columns:
-        print(f"CHYBA: Sloupec '{COL_OBS_DATETIME}' nenalezen.")
-        sys.exit(f"Skript ukončen - chybí {COL_OBS_DATETIME}.")
-    df[COL_OBS_DATETIME] = pd.to_datetime(
-        df[COL_OBS_DATETIME], dayfirst=True, errors="coerce"
+if AUTO_DETECT_EVENT:
+    print("\n--- Automatická detekce události z četnosti hlášení ---")
+    event_candidates = detect_events(
+        df,
+        col_datetime=COL_OBS_DATETIME,
+        col_lat=COL_LAT,
+        col_lon=COL_LON,
+        bucket_minutes=MONITOR_BUCKET_MINUTES,
+        window_buckets=MONITOR_WINDOW_BUCKETS,
+        background_buckets=MONITOR_BACKGROUND_BUCKETS,
+        cell_deg=MONITOR_CELL_DEG,
+        min_reports=MONITOR_MIN_REPORTS,
+        rate_factor=MONITOR_RATE_FACTOR,
     )
-    df.dropna(subset=[COL_OBS_DATETIME], inplace=True)
-    print(f"Po konverzi času: {len(df)} řádků.")
-    if df.empty:
-        print("CHYBA: Žádná platná časová data.")
-        sys.exit("Skript ukončen - žádná časová data.")
-    if df[COL_OBS_DATETIME].dt.tz is None:
-        df[COL_OBS_DATETIME] = (
-            df[COL_OBS_DATETIME]
-            .dt.tz_localize("Europe/Prague", ambiguous="infer")
-            .dt.tz_convert("UTC")
+    if not event_candidates:
+        sys.exit("Skript ukončen - žádný shluk hlášení nenalezen.")
+    for candidate in event_candidates:
+        print(
+            f"Kandidát: {candidate['trigger_report_utc']} "
+            f"({candidate['first_report_utc']} - {candidate['last_report_utc']}), "
+            f"{candidate['lat']:.3f} N, {candidate['lon']:.3f} E, "
+            f"{candidate['n_reports']} hlášení"
         )
-    else:
-        df[COL_OBS_DATETIME] = df[COL_OBS_DATETIME].dt.tz_convert("UTC")
-    print("Časová zóna aplikována.")
-except Exception as e:
-    print(f"CHYBA při zpracování času: {e}")
-    sys.exit(f"Skript ukončen - chyba času: {e}")
-
-print(f"\n--- Zpracování souřadnic ('{COL_LAT}', '{COL_LON}') ---")
-try:
-    if COL_LAT not in df.columns or COL_LON not in df.columns:
-        print(f"CHYBA: Sloupce souřadnic nenalezeny.")
-        sys.exit("Skript ukončen - chybí souřadnice.")
-    df[COL_LAT] = pd.to_numeric(df[COL_LAT], errors="coerce")
-    df[COL_LON] = pd.to_numeric(df[COL_LON], errors="coerce")
-    df.dropna(subset=[COL_LAT, COL_LON], inplace=True)
-    print(f"Po konverzi souřadnic: {len(df)} řádků.")
-    if df.empty:
-        print("CHYBA: Žádná platná data souřadnic.")
-        sys.exit("Skript ukončen - žádné souřadnice.")
-except Exception as e:
-    print(f"CHYBA při zpracování souřadnic: {e}")
-    sys.exit(f"Skript ukončen - chyba souřadnic: {e}")
+    detected_window = candidate_event_window(
+        max(event_candidates, key=lambda c: c["trigger_report_utc"])
+    )
+    EQ_DATETIME_UTC_STR = detected_window["eq_datetime_utc"].strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    EQ_YEAR_TARGET = detected_window["eq_datetime_utc"].year
+    EQ_MONTH_TARGET = detected_window["eq_datetime_utc"].month
+    EQ_DAY_TARGET = detected_window["eq_datetime_utc"].day
+    EQ_LAT = detected_window["lat"]
+    EQ_LON = detected_window["lon"]
+    # Identitu z proměnných prostředí (MACROSEIS_EQ_*) detekce nepřepisuje
+    detected_identity = detected_event_identity(detected_window["eq_datetime_utc"])
+    EQ_GFU_ID = int(
+        os.environ.get("MACROSEIS_EQ_GFU_ID") or detected_identity["gfu_id"]
+    )
+    EQ_LOCATION_NAME = (
+        os.environ.get("MACROSEIS_EQ_LOCATION_NAME")
+        or detected_identity["location_name"]
+    )
+    EQ_MAGNITUDE = (
+        float(os.environ["MACROSEIS_EQ_MAGNITUDE"])
+        if os.environ.get("MACROSEIS_EQ_MAGNITUDE")
+        else detected_identity["magnitude"]
+    )
+    OUTPUT_DIR = f"analyza_vysledky_{EQ_LOCATION_NAME.lower().replace(' ', '_').replace('-', '_')}_{EQ_YEAR_TARGET}"
+    print(
+        f"Vybrána nejnovější událost: {EQ_DATETIME_UTC_STR} UTC, "
+        f"{EQ_LAT:.3f} N, {EQ_LON:.3f} E"
+    )
+    print(f"Výstupní adresář bude: {os.path.abspath(OUTPUT_DIR)}")
 
 print(f"\n--- Filtrování ({EQ_YEAR_TARGET}/{EQ_MONTH_TARGET}) ---")
 df_filtered_year_month = df[
@@ -160,27 +317,56 @@ if not os.path.exists(OUTPUT_DIR):
 else:
     print(f"Adresář {OUTPUT_DIR} již existuje.")
 
+try:
+    validation_rules_path = os.path.join(
+        OUTPUT_DIR, f"validace_pravidla_{EQ_YEAR_TARGET}.csv"
+    )
+    validation_report["rule_counts"].to_csv(validation_rules_path, index=False)
+    rejected_rows_path = os.path.join(
+        OUTPUT_DIR, f"vyrazena_hlaseni_{EQ_YEAR_TARGET}.csv"
+    )
+    validation_report["rejected"].to_csv(rejected_rows_path, index=False)
+    print(
+        f"Kontrola kvality: {len(validation_report['rejected'])} vyřazených hlášení "
+        f"uloženo do: {rejected_rows_path}"
+    )
+except Exception as e:
+    print(f"CHYBA při ukládání výsledků kontroly kvality: {e}")
 
-# Pomocná funkce pro hovertemplate
-def build_hovertemplate_string(hover_data_config, main_hover_col):
-    template_parts = []
-    # Najdeme index hlavního sloupce pro customdata
-    custom_data_keys = list(hover_data_config.keys())
+EVENT_INFO = make_event_info(
+    EQ_LAT,
+    EQ_LON,
+    EQ_MAGNITUDE,
+    EQ_GFU_ID,
+    EQ_LOCATION_NAME,
+    CENTER_LAT_CR_ZOOMED,
+    CENTER_LON_CR_ZOOMED,
+    ZOOM_LEVEL_CR_ZOOMED,
+)
 
-    if main_hover_col and main_hover_col in custom_data_keys:
-        main_col_idx = custom_data_keys.index(main_hover_col)
-        template_parts.append(
-            f"<b>{main_hover_col}</b>: %{{customdata[{main_col_idx}]}}<br>"
-        )
 
-    for i, col_name in enumerate(custom_data_keys):
-        if hover_data_config[col_name] and col_name != main_hover_col:
-            template_parts.append(f"{col_name}: %{{customdata[{i}]}}<br>")
-    template_parts.append("<extra></extra>")
-    return "".join(template_parts)
+# --- Uložení figury do HTML (kompaktní nebo standardní serializace) ---
+def save_figure_html(fig, html_path):
+    write_figure_html(
+        fig,
+        html_path,
+        compact=COMPACT_FIGURE_OUTPUT,
+        coord_decimals=COMPACT_COORD_DECIMALS,
+        include_plotlyjs=FIGURE_INCLUDE_PLOTLYJS,
+    )
+
+
+# Export PNG (kaleido) není zdokumentovaný jako bezpečný pro souběžná vlákna,
+# mapové etapy proto exportují obrázky jedna po druhé
+image_export_lock = threading.Lock()
+
+
+def save_figure_png(fig, png_path):
+    with image_export_lock:
+        fig.write_image(png_path, scale=3, width=1000, height=750)
 
 
-# --- Helper funkce pro tvorbu map ---
+# --- Helper funkce pro tvorbu map (figura z macroseismics_core + uložení) ---
 def create_custom_map(
     df_map_data,
     color_column_name,
@@ -193,227 +379,46 @@ def create_custom_map(
     show_isoseismal_areas=False,
     ems_color_map_for_hulls=None,
     sort_ems_key_func=None,
+    isoseismal_hulls=None,
+    isoseismal_metrics=None,
+    write_html=True,
+    write_png=True,
+    density_grid=None,
 ):
-    if color_column_name not in df_map_data.columns and color_column_name is not None:
-        print(
-            f"INFO: Sloupec '{color_column_name}' pro mapu '{map_title_suffix}' nenalezen."
-        )
+    if not (write_html or write_png):
+        return None
+    fig = build_map_figure(
+        df_map_data,
+        color_column_name,
+        map_title_suffix,
+        EVENT_INFO,
+        category_orders_dict,
+        color_discrete_map_dict,
+        hover_data_extra,
+        hover_text_column_name,
+        show_isoseismal_areas=show_isoseismal_areas,
+        ems_color_map_for_hulls=ems_color_map_for_hulls,
+        sort_ems_key_func=sort_ems_key_func,
+        isoseismal_hulls=isoseismal_hulls,
+        isoseismal_metrics=isoseismal_metrics,
+    )
+    if fig is None:
         return None
+    if density_grid is not None:
+        add_density_layer(fig, density_grid)
     png_path = os.path.join(
         OUTPUT_DIR, f"mapa_{output_filename_base}_{EQ_YEAR_TARGET}.png"
     )
-
-    # Příprava hover dat
-    active_hover_data_config = {
-        COL_OBS_DATETIME: True
-    }  # COL_OBS_DATETIME je vždy přítomen
-    # Efektivní sloupec pro hlavní text v hoveru (tučně)
-    effective_main_hover_text_col = (
-        hover_text_column_name
-        if hover_text_column_name and hover_text_column_name in df_map_data.columns
-        else color_column_name
-    )
-
-    if (
-        effective_main_hover_text_col
-        and effective_main_hover_text_col in df_map_data.columns
-    ):
-        active_hover_data_config[effective_main_hover_text_col] = True
-    if hover_data_extra:
-        for item in hover_data_extra:
-            if item in df_map_data.columns:
-                active_hover_data_config[item] = True
-
-    # Odstraníme duplicity a zajistíme, že klíče v active_hover_data_config jsou unikátní a existují v df_map_data
-    final_hover_data_cols = [
-        col
-        for col in list(dict.fromkeys(active_hover_data_config.keys()))
-        if col in df_map_data.columns
-    ]
-    df_for_customdata = df_map_data[final_hover_data_cols]
-
-    if (
-        show_isoseismal_areas
-        and color_column_name == "EMS_Intensity_Est"
-        and "EMS_Intensity_Est" in df_map_data.columns
-        and ems_color_map_for_hulls
-        and sort_ems_key_func
-    ):
-        fig = go.Figure()
-        valid_ems_levels_for_hulls_asc = sorted(
-            [
-                level
-                for level in ems_color_map_for_hulls.keys()
-                if "Neklasifikováno" not in level and "Nepocítěno" not in level
-            ],
-            key=sort_ems_key_func,
-            reverse=False,
-        )
-        df_for_hulls = df_map_data.copy()
-        df_for_hulls[COL_LAT] = pd.to_numeric(df_for_hulls[COL_LAT], errors="coerce")
-        df_for_hulls[COL_LON] = pd.to_numeric(df_for_hulls[COL_LON], errors="coerce")
-        df_for_hulls.dropna(
-            subset=[COL_LAT, COL_LON, "EMS_Intensity_Est"], inplace=True
-        )
-        if "EMS_Intensity_Est_SortVal" not in df_for_hulls.columns:
-            ems_string_to_sort_val = {
-                level: sort_ems_key_func(level)
-                for level in df_for_hulls["EMS_Intensity_Est"].unique()
-            }
-            df_for_hulls = df_for_hulls.assign(
-                EMS_Intensity_Est_SortVal=df_for_hulls["EMS_Intensity_Est"].map(
-                    ems_string_to_sort_val
-                )
-            )
-        for ems_level_str in valid_ems_levels_for_hulls_asc:
-            current_level_sort_val = sort_ems_key_func(ems_level_str)
-            points_for_hull_df = df_for_hulls[
-                df_for_hulls["EMS_Intensity_Est_SortVal"] >= current_level_sort_val
-            ]
-            if len(points_for_hull_df) >= 3:
-                coordinates = points_for_hull_df[[COL_LON, COL_LAT]].values
-                try:
-                    hull = ConvexHull(coordinates)
-                    hull_lons = coordinates[hull.vertices, 0]
-                    hull_lats = coordinates[hull.vertices, 1]
-                    hull_lons = np.append(hull_lons, hull_lons[0])
-                    hull_lats = np.append(hull_lats, hull_lats[0])
-                    fig.add_trace(
-                        go.Scattermapbox(
-                            lon=hull_lons,
-                            lat=hull_lats,
-                            mode="none",
-                            fill="toself",
-                            fillcolor=ems_color_map_for_hulls.get(
-                                ems_level_str, "grey"
-                            ),
-                            name=f"Oblast {ems_level_str.split(' - ')[0]}",
-                            hoverinfo="name",
-                            legendgroup="isoseismals",
-                            showlegend=True,
-                            opacity=0.5,
-                        )
-                    )
-                except QhullError:
-                    print(
-                        f"INFO: ConvexHull pro {ems_level_str} ({len(points_for_hull_df)} bodů) přeskočen."
-                    )
-                except Exception as e:
-                    print(f"CHYBA: ConvexHull pro {ems_level_str}: {e}")
-
-        point_colors_mapped = None
-        if (
-            color_column_name
-            and color_discrete_map_dict
-            and color_column_name in df_map_data.columns
-        ):
-            point_colors_mapped = (
-                df_map_data[color_column_name]
-                .map(color_discrete_map_dict)
-                .fillna("grey")
-            )  # grey pro nemapované
-
-        fig.add_trace(
-            go.Scattermapbox(
-                lat=df_map_data[COL_LAT],
-                lon=df_map_data[COL_LON],
-                mode="markers",
-                marker=go.scattermapbox.Marker(
-                    size=8,
-                    color=point_colors_mapped
-                    if point_colors_mapped is not None
-                    else "blue",  # Použije namapované barvy
-                    opacity=0.9,
-                ),
-                customdata=df_for_customdata.values,
-                hovertemplate=build_hovertemplate_string(
-                    dict.fromkeys(final_hover_data_cols, True),
-                    effective_main_hover_text_col,
-                ),
-                name="Pozorování",
-                legendgroup="observations",
-                showlegend=True,
-            )
-        )
-    else:
-        fig = px.scatter_mapbox(
-            df_map_data,
-            lat=COL_LAT,
-            lon=COL_LON,
-            hover_name=df_map_data.index
-            if df_map_data.index.name
-            else None,  # Může být jméno sloupce nebo index
-            hover_data={
-                col: True for col in final_hover_data_cols
-            },  # Použijeme dict pro hover_data
-            color=color_column_name
-            if color_column_name and color_column_name in df_map_data.columns
-            else None,
-            category_orders=category_orders_dict
-            if color_column_name and color_column_name in df_map_data.columns
-            else None,
-            color_discrete_map=color_discrete_map_dict
-            if color_column_name and color_column_name in df_map_data.columns
-            else None,
-            size_max=10,
-            opacity=0.8,
-            zoom=ZOOM_LEVEL_CR_ZOOMED,
-            center={"lat": CENTER_LAT_CR_ZOOMED, "lon": CENTER_LON_CR_ZOOMED},
-        )
-        if not (color_column_name and color_column_name in df_map_data.columns):
-            fig.update_traces(marker=dict(size=7))
-
-    fig.add_trace(
-        go.Scattermapbox(
-            lat=[EQ_LAT],
-            lon=[EQ_LON],
-            mode="markers",
-            marker=go.scattermapbox.Marker(
-                size=17, color="red", symbol="star", opacity=1
-            ),
-            name=f"Epicentrum (Mag: {EQ_MAGNITUDE})",
-            text=[
-                f"Epicentrum {EQ_LOCATION_NAME}<br>Magnituda: {EQ_MAGNITUDE}<br>ID: {EQ_GFU_ID}"
-            ],
-            hoverinfo="text",
-            showlegend=True,
-        )
-    )
-    main_title = f"Zemětřesení {EQ_LOCATION_NAME}"
-    legend_title_for_map = map_title_suffix
-    if (
-        not (color_column_name and color_column_name in df_map_data.columns)
-        and not show_isoseismal_areas
-    ):
-        legend_title_for_map = "Legenda"
-    fig.update_layout(
-        mapbox_style="open-street-map",
-        margin={"r": 10, "t": 50, "l": 10, "b": 10},
-        title=main_title,
-        legend_title_text=legend_title_for_map,
-        legend=dict(
-            bgcolor="rgba(255,255,255,0.9)",
-            bordercolor="Black",
-            borderwidth=1,
-            title_font_family="Arial",
-            font=dict(family="Arial", size=10, color="black"),
-            itemsizing="constant",
-            traceorder="reversed",
-            yanchor="top",
-            y=0.98,
-            xanchor="right",
-            x=0.98,
-        ),
-        mapbox_zoom=ZOOM_LEVEL_CR_ZOOMED,
-        mapbox_center={"lat": CENTER_LAT_CR_ZOOMED, "lon": CENTER_LON_CR_ZOOMED},
-    )
     try:
-        html_path = os.path.join(
-            OUTPUT_DIR, f"mapa_{output_filename_base}_{EQ_YEAR_TARGET}.html"
-        )
-        fig.write_html(html_path)
-        print(f"Mapa '{map_title_suffix}' uložena do HTML: {html_path}")
-        fig.write_image(png_path, scale=3, width=1000, height=750)
+        if write_html:
+            html_path = os.path.join(
+                OUTPUT_DIR, f"mapa_{output_filename_base}_{EQ_YEAR_TARGET}.html"
+            )
+            save_figure_html(fig, html_path)
+            print(f"Mapa '{map_title_suffix}' uložena do HTML: {html_path}")
+        if not write_png:
+            return None
+        save_figure_png(fig, png_path)
         print(f"Mapa '{map_title_suffix}' uložena do PNG: {png_path}")
         return png_path
     except Exception as e:
@@ -423,7 +428,6 @@ def create_custom_map(
         return None
 
 
-# ZDE JE DEFINICE create_bar_chart PŘESUNUTA NA SPRÁVNÉ MÍSTO
 # --- Helper funkce pro tvorbu sloupcových grafů ---
 def create_bar_chart(
     data_series,
@@ -436,34 +440,18 @@ def create_bar_chart(
     if data_series.empty:
         print(f"INFO: Graf '{chart_title}' se negeneruje (žádná data).")
         return None  # Vracíme None, pokud se graf negeneruje
-
-    total_observations_for_chart_title = data_series.sum()
-    fig = px.bar(
-        x=data_series.index,
-        y=data_series.values,
-        labels={"x": xaxis_title, "y": yaxis_title},
-        title=chart_title
-        + f" (celkem {total_observations_for_chart_title} pozorování)",
+    fig = build_bar_figure(
+        data_series,
+        chart_title,
+        xaxis_title,
+        yaxis_title,
+        show_percentages=show_percentages,
+        n_total_observations=len(df_event),
     )
-    fig.update_layout(xaxis_title=xaxis_title, yaxis_title=yaxis_title)
-
-    if show_percentages and not df_event.empty:
-        percentages = (data_series / len(df_event)) * 100
-        fig.update_traces(
-            texttemplate="%{y} (%{customdata:.1f}%)",
-            textposition="outside",
-            customdata=percentages,
-        )
-    else:
-        fig.update_traces(texttemplate="%{y}", textposition="outside")
     try:
         path = os.path.join(OUTPUT_DIR, f"graf_{filename_base}_{EQ_YEAR_TARGET}.html")
-        fig.write_html(path)
+        save_figure_html(fig, path)
         print(f"Graf '{chart_title}' uložen do: {path}")
-        # Mohli bychom vracet i cestu k HTML grafu, pokud by to bylo potřeba
-        # png_path_graf = os.path.join(OUTPUT_DIR, f"graf_{filename_base}_{EQ_YEAR_TARGET}.png")
-        # fig.write_image(png_path_graf)
-        # print(f"Graf '{chart_title}' uložen do PNG: {png_path_graf}")
         return fig  # Vracíme objekt figury
     except Exception as e:
         print(f"CHYBA při ukládání grafu '{chart_title}': {e}")
@@ -472,258 +460,14 @@ def create_bar_chart(
         return None
 
 
-# --- Předběžné zpracování kategorií ---
-print("\n--- Předzpracování kategorií ---")
-df_event.loc[:, "Mist_Pozorovani_Kat_Full"] = (
-    df_event[COL_IN_BUILDING]
-    .fillna("")
-    .astype(str)
-    .str.lower()
-    .apply(lambda x: "Doma (uvnitř)" if x == "budova" else "Venku/Nezadáno v budově")
-)
-df_event.loc[:, "Mist_Pozorovani_Legenda"] = (
-    df_event[COL_IN_BUILDING]
-    .fillna("")
-    .astype(str)
-    .str.lower()
-    .apply(lambda x: "Doma" if x == "budova" else "Venku/Nezadáno")
-)
-df_event.loc[:, "Pocit_Kategorie_Text_Full"] = (
-    df_event[COL_FELT_BY]
-    .astype(str)
-    .str.lower()
-    .str.strip()
-    .map(
-        {
-            "pouze vy": "Pocítil(a) jen respondent",
-            "většina ano": "Pocítila většina přítomných",
-        }
-    )
-    .fillna("Nezadáno/Jiná odpověď")
-)
-df_event.loc[:, "Pocit_Kategorie_Legenda"] = (
-    df_event[COL_FELT_BY]
-    .astype(str)
-    .str.lower()
-    .str.strip()
-    .map({"pouze vy": "Jen respondent", "většina ano": "Většina"})
-    .fillna("Nezadáno")
-)
-df_event.loc[:, "Intenzita_Kat_Full"] = (
-    df_event[COL_TREMOR_TYPE].astype(str).str.lower().fillna("Nezadáno")
-)
-df_event.loc[:, "Intenzita_Kat_Legenda"] = df_event["Intenzita_Kat_Full"]
-df_event.loc[:, "Strach_Pocit_Kat_Text_Full"] = (
-    (pd.to_numeric(df_event[COL_FEAR], errors="coerce") == 1)
-    .map({True: "Ano (strach/panika)", False: "Ne/Nezadáno strach"})
-    .fillna("Ne/Nezadáno strach")
-)
-df_event.loc[:, "Strach_Pocit_Legenda"] = (
-    (pd.to_numeric(df_event[COL_FEAR], errors="coerce") == 1)
-    .map({True: "Ano", False: "Ne/Nezadáno"})
-    .fillna("Ne/Nezadáno")
-)
+df_event = prepare_categories(df_event)
 actual_movement_detail_cols = [
     col for col in COLS_OBJECT_MOVEMENT_DETAILS if col in df_event.columns
 ]
-if actual_movement_detail_cols:
-    df_event.loc[:, "Pohyb_Predmetu_Agregovany_Bool"] = df_event[
-        actual_movement_detail_cols
-    ].apply(
-        lambda r: any(
-            pd.notna(v) and str(v).strip().lower() not in NEGATIVE_OR_EMPTY_VALUES
-            for v in r
-        ),
-        axis=1,
-    )
-    df_event.loc[:, "Pohyb_Predmetu_Agregovany_Text_Full"] = df_event[
-        "Pohyb_Predmetu_Agregovany_Bool"
-    ].map({True: "Ano (pohyb předmětů)", False: "Ne (žádný pohyb předmětů)"})
-    df_event.loc[:, "Pohyb_Predmetu_Legenda"] = df_event[
-        "Pohyb_Predmetu_Agregovany_Bool"
-    ].map({True: "Ano", False: "Ne"})
-else:
-    df_event.loc[:, "Pohyb_Predmetu_Agregovany_Text_Full"] = (
-        "Nezadáno (info o pohybu chybí)"
-    )
-    df_event.loc[:, "Pohyb_Predmetu_Legenda"] = "Nezadáno"
-df_event.loc[:, "Poskozeni_Obecne_Text_Full"] = (
-    df_event[COL_DAMAGE_OVERALL]
-    .astype(str)
-    .str.lower()
-    .str.strip()
-    .map({"bylo": "Ano (poškození hlášeno)", "nebylo": "Ne (poškození nehlášeno)"})
-    .fillna("Nezadáno/Jiná hodnota")
-)
-df_event.loc[:, "Poskozeni_Obecne_Legenda"] = (
-    df_event[COL_DAMAGE_OVERALL]
-    .astype(str)
-    .str.lower()
-    .str.strip()
-    .map({"bylo": "Ano", "nebylo": "Ne"})
-    .fillna("Nezadáno")
-)
 actual_sound_cols = [col for col in COLS_SOUNDS if col in df_event.columns]
-if actual_sound_cols:
-    df_event.loc[:, "Zvuk_Reportovan_Bool"] = df_event[actual_sound_cols].apply(
-        lambda r: any(
-            pd.notna(v) and str(v).strip().lower() not in NEGATIVE_OR_EMPTY_VALUES
-            for v in r
-        ),
-        axis=1,
-    )
-    df_event.loc[:, "Zvuk_Reportovan_Text_Full"] = df_event["Zvuk_Reportovan_Bool"].map(
-        {True: "Ano (zvuk reportován)", False: "Ne (bez zvuku)"}
-    )
-    df_event.loc[:, "Zvuk_Reportovan_Legenda"] = df_event["Zvuk_Reportovan_Bool"].map(
-        {True: "Ano", False: "Ne"}
-    )
-else:
-    df_event.loc[:, "Zvuk_Reportovan_Text_Full"] = "Nezadáno (info chybí)"
-    df_event.loc[:, "Zvuk_Reportovan_Legenda"] = "Nezadáno"
-print("Předzpracování kategorií dokončeno.")
-
-
-def sort_ems_key(ems_string):
-    roman_map = {
-        "I": 1,
-        "II": 2,
-        "III": 3,
-        "IV": 4,
-        "V": 5,
-        "VI": 6,
-        "VII": 7,
-        "VIII": 8,
-        "IX": 9,
-        "X": 10,
-    }
-    parts = str(ems_string).split(" - ")[0]
-    value = 900
-    if parts in roman_map:
-        value = roman_map[parts]
-    elif parts == "Neklasifikováno":
-        value = 1000
-    return value
-
-
-# --- UPRAVENÁ Funkce pro odhad EMS-98 intenzity ---
-def assign_ems_intensity(row):
-    popis_pohybu = str(row.get(COL_TREMOR_TYPE, "")).strip().lower()
-    felt_by_str = str(row.get(COL_FELT_BY, "")).strip().lower()
-    in_building_str = str(row.get(COL_IN_BUILDING, "")).strip().lower()
-    fear_val = pd.to_numeric(row.get(COL_FEAR), errors="coerce")
-    damage_overall_str = str(row.get(COL_DAMAGE_OVERALL, "")).strip().lower()
-    in_building = in_building_str == "budova"
-    felt_by_only_respondent = felt_by_str == "pouze vy"
-    felt_by_some_or_many = felt_by_str in ["několik", "většina ano"]
-    felt_by_most = felt_by_str == "většina ano"
-    fear = fear_val == 1
-    damage_overall = damage_overall_str == "bylo"
-
-    def was_object_effect_observed(col_name_list):
-        if not isinstance(col_name_list, list):
-            col_name_list = [col_name_list]
-        for col_name in col_name_list:
-            val = row.get(col_name)
-            if (
-                pd.notna(val)
-                and str(val).strip().lower() not in NEGATIVE_OR_EMPTY_VALUES
-            ):
-                return True
-        return False
-
-    if damage_overall:
-        return "VI - Mírně ničivé"
-    if (
-        fear
-        and felt_by_most
-        and popis_pohybu == "silné otřesy"
-        and (was_object_effect_observed(["malepredmety", "nadobi"]))
-    ):
-        return "VI - Mírně ničivé"
-    is_strong_tremor = popis_pohybu == "silné otřesy"
-    significant_object_movement_V = was_object_effect_observed(
-        ["malepredmety", "nadobi", "zavespredmety", "dvere", "okna"]
-    )
-    if (is_strong_tremor or (felt_by_most and fear)) and significant_object_movement_V:
-        return "V - Silné"
-    if (
-        felt_by_most
-        and is_strong_tremor
-        and was_object_effect_observed(["malepredmety"])
-    ):
-        return "V - Silné"
-    object_movement_IV = was_object_effect_observed(
-        ["okna", "dvere", "nadobi", "zavespredmety"]
-    )
-    if is_strong_tremor and not fear and object_movement_IV:
-        return "IV - Značně pozorované"
-    if felt_by_some_or_many and in_building and object_movement_IV:
-        return "IV - Značně pozorované"
-    if (
-        felt_by_some_or_many
-        and in_building
-        and popis_pohybu in ["slabé zachvění", "chvění", "houpání"]
-        and was_object_effect_observed(["okna", "dvere"])
-    ):
-        return "IV - Značně pozorované"
-    object_movement_III_hanging = was_object_effect_observed(["zavespredmety"])
-    is_weak_tremor = popis_pohybu in [
-        "slabé zachvění",
-        "lehké chvění",
-        "houpání",
-        "chvění",
-    ]
-    if (
-        felt_by_some_or_many
-        and in_building
-        and is_weak_tremor
-        and not was_object_effect_observed(["okna", "dvere", "nadobi", "malepredmety"])
-    ):
-        return "III - Slabé"
-    if (
-        felt_by_only_respondent
-        and in_building
-        and is_weak_tremor
-        and not fear
-        and (
-            not was_object_effect_observed(COLS_OBJECT_MOVEMENT_DETAILS)
-            or object_movement_III_hanging
-        )
-    ):
-        return "III - Slabé"
-    if (
-        object_movement_III_hanging
-        and not is_strong_tremor
-        and not fear
-        and not was_object_effect_observed(
-            ["okna", "dvere", "nadobi", "malepredmety", "nabytektezky"]
-        )
-    ):
-        return "III - Slabé"
-    if (
-        felt_by_only_respondent
-        and in_building
-        and popis_pohybu == "slabé zachvění"
-        and not fear
-        and not was_object_effect_observed(COLS_OBJECT_MOVEMENT_DETAILS)
-    ):
-        return "II - Zřídka pocítěno"
-    if popis_pohybu == "žádný":
-        if not (felt_by_some_or_many or felt_by_only_respondent):
-            return "I - Nepocítěno"
-        if (
-            felt_by_only_respondent
-            and not was_object_effect_observed(COLS_OBJECT_MOVEMENT_DETAILS)
-            and not fear
-        ):
-            return "I - Nepocítěno"
-    if popis_pohybu == "nepocítěno":
-        return "I - Nepocítěno"
-    return "Neklasifikováno"
-
-
-df_event["EMS_Intensity_Est"] = df_event.apply(assign_ems_intensity, axis=1)
+
+
+df_event["EMS_Intensity_Est"] = classify_ems_intensity(df_event)
 print("\n--- Odhadovaná EMS-98 Intenzita (po revizi) ---")
 ems_counts = df_event["EMS_Intensity_Est"].value_counts()
 sorted_ems_keys = sorted(ems_counts.index, key=lambda x: sort_ems_key(x))
@@ -734,293 +478,480 @@ if not df_event.empty:
     print("\nProcentuálně:")
     print(ems_percentages.round(1).astype(str) + "%")
 
-ems_color_map = {
-    "I - Nepocítěno": "rgb(200,220,255)",
-    "II - Zřídka pocítěno": "rgb(160,200,255)",
-    "III - Slabé": "rgb(100,220,220)",
-    "IV - Značně pozorované": "rgb(120,255,120)",
-    "V - Silné": "rgb(255,255,100)",
-    "VI - Mírně ničivé": "rgb(255,180,100)",
-    "Neklasifikováno": "rgb(200,200,200)",
-}
+if RUN_OUTLIER_DETECTION:
+    print("\n--- Detekce podezřelých hlášení (KD-strom sousedů) ---")
+    df_outliers = detect_spatial_outliers(
+        df_event,
+        "EMS_Intensity_Est",
+        sort_ems_key,
+        EQ_LAT,
+        EQ_LON,
+        lat_col=COL_LAT,
+        lon_col=COL_LON,
+        flag_cols=["Pohyb_Predmetu_Agregovany_Bool", "Zvuk_Reportovan_Bool"],
+        k_neighbours=OUTLIER_K_NEIGHBOURS,
+        max_neighbour_distance_km=OUTLIER_MAX_NEIGHBOUR_DISTANCE_KM,
+        ems_threshold=OUTLIER_EMS_THRESHOLD,
+        min_criteria=OUTLIER_MIN_CRITERIA,
+    )
+    df_event["Podezrele_Hlaseni"] = df_outliers["is_outlier"]
+    df_event["Podezrele_Hlaseni_Text"] = outlier_reason_text(df_outliers)
+    print(
+        f"Podezřelá hlášení: {int(df_outliers['is_outlier'].sum())} z {len(df_event)} "
+        f"(EMS vs. okolí {int(df_outliers['outlier_ems_neighbours'].sum())}, "
+        f"EMS vs. vzdálenost {int(df_outliers['outlier_ems_distance'].sum())}, "
+        f"projevy vs. okolí {int(df_outliers['outlier_effects'].sum())})"
+    )
+    try:
+        outliers_path = os.path.join(
+            OUTPUT_DIR, f"podezrela_hlaseni_{EQ_YEAR_TARGET}.csv"
+        )
+        df_event.loc[
+            df_outliers["is_outlier"],
+            [COL_OBS_DATETIME, COL_LAT, COL_LON, "EMS_Intensity_Est"],
+        ].join(df_outliers[df_outliers["is_outlier"]]).to_csv(
+            outliers_path, index=False
+        )
+        print(f"Podezřelá hlášení uložena do: {outliers_path}")
+    except Exception as e:
+        print(f"CHYBA při ukládání podezřelých hlášení: {e}")
 
-# --- Hlavní mapa pozorování ---
-print("\n--- Hlavní mapa pozorování ---")
-hover_data_main_map_cols = [
-    COL_OBS_DATETIME,
-    "Mist_Pozorovani_Kat_Full",
-    "Pocit_Kategorie_Text_Full",
-    "Intenzita_Kat_Full",
-    "Strach_Pocit_Kat_Text_Full",
-    "Pohyb_Predmetu_Agregovany_Text_Full",
-    "Poskozeni_Obecne_Text_Full",
-    "Zvuk_Reportovan_Text_Full",
-    "EMS_Intensity_Est",
-]
-valid_hover_cols = [col for col in hover_data_main_map_cols if col in df_event.columns]
-main_map_png_path = create_custom_map(
-    df_event,
-    None,
-    "Přehled pozorování",
-    "pozorovani_hlavni",
-    hover_data_extra=valid_hover_cols,
-)
-generated_map_files_for_pptx = []
-if main_map_png_path:
-    generated_map_files_for_pptx.append((main_map_png_path, "Přehled pozorování"))
-
-# --- TEXTOVÉ ANALÝZY A GRAFY ---
-print(f"\n--- Pozorování doma vs. venku ---")
-misto_counts = df_event["Mist_Pozorovani_Kat_Full"].value_counts()
-print(misto_counts)
-if not df_event.empty:
-    misto_percentages = (misto_counts / len(df_event)) * 100
-    print("\nProcentuálně:")
-    print(misto_percentages.round(1).astype(str) + "%")
-create_bar_chart(
-    misto_counts,
-    "Pozorování doma vs. venku",
-    "pozorovani_misto",
-    "Místo pozorování",
-    show_percentages=True,
-)  # ZDE JE PRVNÍ VOLÁNÍ
-
-# ... (zbytek kódu pro další grafy a mapy) ...
-print(f"\n--- Typ pocítění ---")
-pocit_counts = df_event["Pocit_Kategorie_Text_Full"].value_counts()
-print(pocit_counts)
-if not df_event.empty:
-    pocit_percentages = (pocit_counts / len(df_event)) * 100
-    print("\nProcentuálně:")
-    print(pocit_percentages.round(1).astype(str) + "%")
-create_bar_chart(
-    pocit_counts,
-    "Typ pocítění",
-    "pocit_kdo",
-    "Kategorie pocítění",
-    show_percentages=True,
-)
-print(f"\n--- Intenzita otřesů (popis) ---")
-intenzita_counts = df_event["Intenzita_Kat_Full"].value_counts()
-print(intenzita_counts)
-if not df_event.empty:
-    intenzita_percentages = (intenzita_counts / len(df_event)) * 100
-    print("\nProcentuálně:")
-    print(intenzita_percentages.round(1).astype(str) + "%")
-create_bar_chart(
-    intenzita_counts,
-    "Intenzita otřesů (popis)",
-    "intenzita_popis",
-    "Popis intenzity",
-    show_percentages=True,
-)
-print(f"\n--- Strach/Panika ---")
-strach_counts = df_event["Strach_Pocit_Kat_Text_Full"].value_counts()
-print(strach_counts)
-if not df_event.empty:
-    strach_percentages = (strach_counts / len(df_event)) * 100
-    print("\nProcentuálně:")
-    print(strach_percentages.round(1).astype(str) + "%")
-create_bar_chart(
-    strach_counts,
-    "Pocit strachu/paniky",
-    "strach_panika",
-    "Hlášení strachu/paniky",
-    show_percentages=True,
-)
-print("\n--- Pohyb předmětů ---")
-if "Pohyb_Predmetu_Agregovany_Text_Full" in df_event.columns:
-    pohyb_agreg_counts = df_event["Pohyb_Predmetu_Agregovany_Text_Full"].value_counts()
-    print(pohyb_agreg_counts)
-    if not df_event.empty:
-        pohyb_agreg_percentages = (pohyb_agreg_counts / len(df_event)) * 100
-        print("\nProcentuálně:")
-        print(pohyb_agreg_percentages.round(1).astype(str) + "%")
-    if pohyb_agreg_counts.get("Ano (pohyb předmětů)", 0) > 0:
-        create_bar_chart(
-            pohyb_agreg_counts,
-            "Agregovaný pohyb předmětů",
-            "pohyb_predmetu_agreg",
-            "Pozorován pohyb?",
-            show_percentages=True,
+covariate_columns = []
+if RUN_COVARIATE_SAMPLING and COVARIATE_RASTERS:
+    print("\n--- Vzorkování pomocných rastrů (kovariáty hlášení) ---")
+    covariate_columns = attach_covariates(
+        df_event,
+        COVARIATE_RASTERS,
+        lat_col=COL_LAT,
+        lon_col=COL_LON,
+        search_dirs=(".", OUTPUT_DIR),
+    )
+    for covariate_col in covariate_columns:
+        print(f"\n{covariate_col}:")
+        print(df_event[covariate_col].describe().round(3).to_string())
+        print("Medián podle odhadu EMS:")
+        print(
+            df_event.groupby("EMS_Intensity_Est")[covariate_col]
+            .median()
+            .reindex(sorted(df_event["EMS_Intensity_Est"].unique(), key=sort_ems_key))
+            .round(3)
+            .to_string()
         )
-    if actual_movement_detail_cols:
-        movement_details_data = {}
-        for col_name in actual_movement_detail_cols:
-            s = df_event[col_name]
-            s_str_lower_stripped = s.astype(str).str.strip().str.lower()
-            condition = s.notna() & (
-                ~s_str_lower_stripped.isin(NEGATIVE_OR_EMPTY_VALUES)
+
+
+# --- Etapy výpočtu (graf závislostí pro StageScheduler) ---
+# Každá etapa je funkce na úrovni modulu (kvůli pool procesů), vstupy dostává
+# jako pojmenované argumenty a vrací svůj výstup. Mapové etapy vrací cestu k PNG.
+def stage_inversion(df_event):
+    print("\n--- Makroseismická inverze (grid search) ---")
+    ems_numeric_values = df_event["EMS_Intensity_Est"].map(sort_ems_key)
+    ems_numeric_values = ems_numeric_values.where(ems_numeric_values <= 12)
+    macroseismic_solution = invert_macroseismic_epicentre(
+        df_event[COL_LAT],
+        df_event[COL_LON],
+        ems_numeric_values,
+        EQ_LAT,
+        EQ_LON,
+        half_width_deg=INVERSION_GRID_HALF_WIDTH_DEG,
+        step_deg=INVERSION_GRID_STEP_DEG,
+        magnitudes=INVERSION_MAGNITUDES,
+        depth_km=INVERSION_DEPTH_KM,
+        ipe_coeffs=INVERSION_IPE_COEFFS,
+        n_processes=INVERSION_N_PROCESSES,
+    )
+    df_misfit = None
+    if macroseismic_solution:
+        print(
+            f"Makroseismické epicentrum: {macroseismic_solution['lat']:.3f} N, "
+            f"{macroseismic_solution['lon']:.3f} E, "
+            f"Mm = {macroseismic_solution['magnitude']:.1f} "
+            f"(RMS misfit {macroseismic_solution['misfit']:.2f}, "
+            f"{macroseismic_solution['n_observations']} pozorování)"
+        )
+        print(
+            f"Instrumentální epicentrum: {EQ_LAT:.3f} N, {EQ_LON:.3f} E, "
+            f"M = {format_magnitude(EQ_MAGNITUDE)}"
+        )
+        if macroseismic_solution["on_grid_edge"]:
+            print(
+                "VAROVÁNÍ: Minimum misfitu leží na okraji sítě nebo rozsahu magnitud,"
+                " řešení není daty dobře omezené."
+            )
+        df_misfit = misfit_surface_to_frame(macroseismic_solution)
+        try:
+            misfit_csv_path = os.path.join(
+                OUTPUT_DIR, f"inverze_misfit_{EQ_YEAR_TARGET}.csv"
             )
-            observed_count = condition.sum()
-            if observed_count > 0:
-                movement_details_data[col_name] = observed_count
-        if movement_details_data:
-            pohyb_detail_series = pd.Series(movement_details_data).sort_values(
-                ascending=False
+            df_misfit.to_csv(misfit_csv_path, index=False)
+            print(f"Plocha misfitu uložena do: {misfit_csv_path}")
+        except Exception as e:
+            print(f"CHYBA při ukládání plochy misfitu: {e}")
+    return {"macroseismic_solution": macroseismic_solution, "df_misfit": df_misfit}
+
+
+def stage_main_map(df_event):
+    print("\n--- Hlavní mapa pozorování ---")
+    valid_hover_cols = [
+        col
+        for col in HOVER_DATA_MAIN_MAP_COLS + covariate_columns
+        if col in df_event.columns
+    ]
+    return create_custom_map(
+        df_event,
+        None,
+        "Přehled pozorování",
+        "pozorovani_hlavni",
+        hover_data_extra=valid_hover_cols,
+        write_html=not MULTILAYER_INTERACTIVE_MAP,
+        write_png=GENERATE_PPTX,
+    )
+
+
+def stage_density_map(df_event):
+    print("\n--- Mapa hustoty hlášení ---")
+    reference_raster = None
+    if DENSITY_REFERENCE_RASTER:
+        reference_raster = next(
+            (
+                path
+                for path in (
+                    DENSITY_REFERENCE_RASTER,
+                    os.path.join(OUTPUT_DIR, DENSITY_REFERENCE_RASTER),
+                )
+                if os.path.exists(path)
+            ),
+            None,
+        )
+        if reference_raster is None:
+            print(
+                f"INFO: Referenční rastr '{DENSITY_REFERENCE_RASTER}' nenalezen, "
+                "kreslí se absolutní hustota."
             )
-            print("Detaily pohybů (počet):")
-            print(pohyb_detail_series)
-            if not df_event.empty:
-                pohyb_detail_percentages = (pohyb_detail_series / len(df_event)) * 100
-                print("\nProcentuálně (z celkového počtu pozorování):")
-                print(pohyb_detail_percentages.round(1).astype(str) + "%")
+    density_grid = report_density_grid(
+        pd.to_numeric(df_event[COL_LON], errors="coerce"),
+        pd.to_numeric(df_event[COL_LAT], errors="coerce"),
+        EQ_LON,
+        EQ_LAT,
+        half_width_km=DENSITY_HALF_WIDTH_KM,
+        cell_km=DENSITY_CELL_KM,
+        bandwidth_km=DENSITY_BANDWIDTH_KM,
+        reference_raster=reference_raster,
+    )
+    print(
+        f"Síť hustoty {density_grid['density'].shape[1]}x"
+        f"{density_grid['density'].shape[0]} buněk po {DENSITY_CELL_KM:g} km, "
+        f"{density_grid['n_points']} hlášení (mimo síť {density_grid['n_outside']}), "
+        f"max. {density_grid['density'].max():.2f} hlášení/km²."
+    )
+    return create_custom_map(
+        df_event,
+        None,
+        "Hustota hlášení",
+        "hustota_hlaseni",
+        hover_data_extra=[
+            col
+            for col in HOVER_DATA_MAIN_MAP_COLS + covariate_columns
+            if col in df_event.columns
+        ],
+        write_png=GENERATE_PPTX,
+        density_grid=density_grid,
+    )
+
+
+def stage_multilayer_map(df_event):
+    print("\n--- Interaktivní mapa s přepínáním vrstev ---")
+    layers = [(None, "Přehled pozorování", None, None)]
+    layers += [
+        (col_for_color, title, cmap, col_for_hover)
+        for col_for_color, title, _, cmap, _, col_for_hover in MAP_CONFIGS
+    ]
+    layers.append(
+        (
+            "EMS_Intensity_Est",
+            "Odhad EMS-98 Intenzita",
+            EMS_COLOR_MAP,
+            "EMS_Intensity_Est",
+        )
+    )
+    fig = build_multilayer_map_figure(
+        df_event,
+        layers,
+        EVENT_INFO,
+        hover_data_extra=HOVER_DATA_MAIN_MAP_COLS + covariate_columns,
+    )
+    if fig is None:
+        return None
+    try:
+        layers_html_path = os.path.join(
+            OUTPUT_DIR, f"mapa_vrstvy_{EQ_YEAR_TARGET}.html"
+        )
+        save_figure_html(fig, layers_html_path)
+        print(f"Mapa s vrstvami uložena do HTML: {layers_html_path}")
+        return layers_html_path
+    except Exception as e:
+        print(f"CHYBA při ukládání mapy s vrstvami: {e}")
+        return None
+
+
+def stage_text_statistics(df_event):
+    print(f"\n--- Pozorování doma vs. venku ---")
+    misto_counts = df_event["Mist_Pozorovani_Kat_Full"].value_counts()
+    print(misto_counts)
+    if not df_event.empty:
+        misto_percentages = (misto_counts / len(df_event)) * 100
+        print("\nProcentuálně:")
+        print(misto_percentages.round(1).astype(str) + "%")
+    create_bar_chart(
+        misto_counts,
+        "Pozorování doma vs. venku",
+        "pozorovani_misto",
+        "Místo pozorování",
+        show_percentages=True,
+    )  # ZDE JE PRVNÍ VOLÁNÍ
+
+    # ... (zbytek kódu pro další grafy a mapy) ...
+    print(f"\n--- Typ pocítění ---")
+    pocit_counts = df_event["Pocit_Kategorie_Text_Full"].value_counts()
+    print(pocit_counts)
+    if not df_event.empty:
+        pocit_percentages = (pocit_counts / len(df_event)) * 100
+        print("\nProcentuálně:")
+        print(pocit_percentages.round(1).astype(str) + "%")
+    create_bar_chart(
+        pocit_counts,
+        "Typ pocítění",
+        "pocit_kdo",
+        "Kategorie pocítění",
+        show_percentages=True,
+    )
+    print(f"\n--- Intenzita otřesů (popis) ---")
+    intenzita_counts = df_event["Intenzita_Kat_Full"].value_counts()
+    print(intenzita_counts)
+    if not df_event.empty:
+        intenzita_percentages = (intenzita_counts / len(df_event)) * 100
+        print("\nProcentuálně:")
+        print(intenzita_percentages.round(1).astype(str) + "%")
+    create_bar_chart(
+        intenzita_counts,
+        "Intenzita otřesů (popis)",
+        "intenzita_popis",
+        "Popis intenzity",
+        show_percentages=True,
+    )
+    print(f"\n--- Strach/Panika ---")
+    strach_counts = df_event["Strach_Pocit_Kat_Text_Full"].value_counts()
+    print(strach_counts)
+    if not df_event.empty:
+        strach_percentages = (strach_counts / len(df_event)) * 100
+        print("\nProcentuálně:")
+        print(strach_percentages.round(1).astype(str) + "%")
+    create_bar_chart(
+        strach_counts,
+        "Pocit strachu/paniky",
+        "strach_panika",
+        "Hlášení strachu/paniky",
+        show_percentages=True,
+    )
+    print("\n--- Pohyb předmětů ---")
+    if "Pohyb_Predmetu_Agregovany_Text_Full" in df_event.columns:
+        pohyb_agreg_counts = df_event[
+            "Pohyb_Predmetu_Agregovany_Text_Full"
+        ].value_counts()
+        print(pohyb_agreg_counts)
+        if not df_event.empty:
+            pohyb_agreg_percentages = (pohyb_agreg_counts / len(df_event)) * 100
+            print("\nProcentuálně:")
+            print(pohyb_agreg_percentages.round(1).astype(str) + "%")
+        if pohyb_agreg_counts.get("Ano (pohyb předmětů)", 0) > 0:
             create_bar_chart(
-                pohyb_detail_series,
-                "Detaily pohybů předmětů",
-                "pohyb_detaily",
-                "Typ pohybu",
+                pohyb_agreg_counts,
+                "Agregovaný pohyb předmětů",
+                "pohyb_predmetu_agreg",
+                "Pozorován pohyb?",
                 show_percentages=True,
             )
-print(f"\n--- Poškození budov ---")
-poskozeni_counts = df_event["Poskozeni_Obecne_Text_Full"].value_counts()
-print(poskozeni_counts)
-if not df_event.empty:
-    poskozeni_percentages = (poskozeni_counts / len(df_event)) * 100
-    print("\nProcentuálně:")
-    print(poskozeni_percentages.round(1).astype(str) + "%")
-create_bar_chart(
-    poskozeni_counts,
-    "Poškození budov",
-    "poskozeni_budov",
-    "Poškození hlášeno?",
-    show_percentages=True,
-)
-print(f"\n--- Analýza Zvuků ---")
-if "Zvuk_Reportovan_Text_Full" in df_event.columns:
-    zvuk_agreg_counts = df_event["Zvuk_Reportovan_Text_Full"].value_counts()
-    print(zvuk_agreg_counts)
+        if actual_movement_detail_cols:
+            observed_counts = movement_observed_flags(df_event).sum()
+            movement_details_data = observed_counts[observed_counts > 0].to_dict()
+            if movement_details_data:
+                pohyb_detail_series = pd.Series(movement_details_data).sort_values(
+                    ascending=False
+                )
+                print("Detaily pohybů (počet):")
+                print(pohyb_detail_series)
+                if not df_event.empty:
+                    pohyb_detail_percentages = (
+                        pohyb_detail_series / len(df_event)
+                    ) * 100
+                    print("\nProcentuálně (z celkového počtu pozorování):")
+                    print(pohyb_detail_percentages.round(1).astype(str) + "%")
+                create_bar_chart(
+                    pohyb_detail_series,
+                    "Detaily pohybů předmětů",
+                    "pohyb_detaily",
+                    "Typ pohybu",
+                    show_percentages=True,
+                )
+    print(f"\n--- Poškození budov ---")
+    poskozeni_counts = df_event["Poskozeni_Obecne_Text_Full"].value_counts()
+    print(poskozeni_counts)
     if not df_event.empty:
-        zvuk_agreg_percentages = (zvuk_agreg_counts / len(df_event)) * 100
+        poskozeni_percentages = (poskozeni_counts / len(df_event)) * 100
         print("\nProcentuálně:")
-        print(zvuk_agreg_percentages.round(1).astype(str) + "%")
-    if zvuk_agreg_counts.get("Ano (zvuk reportován)", 0) > 0:
-        create_bar_chart(
-            zvuk_agreg_counts,
-            "Agregovaný report zvuků",
-            "zvuky_agreg",
-            "Zvuk reportován?",
-            show_percentages=True,
-        )
-    if actual_sound_cols:
-        sound_details_data = {}
-        for col_name in actual_sound_cols:
-            s = df_event[col_name]
-            s_str_lower_stripped = s.astype(str).str.strip().str.lower()
-            condition = s.notna() & (
-                ~s_str_lower_stripped.isin(NEGATIVE_OR_EMPTY_VALUES)
-            )
-            observed_count = condition.sum()
-            if observed_count > 0:
-                sound_details_data[col_name] = observed_count
-        if sound_details_data:
-            zvuk_detail_series = pd.Series(sound_details_data).sort_values(
-                ascending=False
-            )
-            print("Detaily zvuků (počet):")
-            print(zvuk_detail_series)
-            if not df_event.empty:
-                zvuk_detail_percentages = (zvuk_detail_series / len(df_event)) * 100
-                print("\nProcentuálně (z celkového počtu pozorování):")
-                print(zvuk_detail_percentages.round(1).astype(str) + "%")
+        print(poskozeni_percentages.round(1).astype(str) + "%")
+    create_bar_chart(
+        poskozeni_counts,
+        "Poškození budov",
+        "poskozeni_budov",
+        "Poškození hlášeno?",
+        show_percentages=True,
+    )
+    print(f"\n--- Analýza Zvuků ---")
+    if "Zvuk_Reportovan_Text_Full" in df_event.columns:
+        zvuk_agreg_counts = df_event["Zvuk_Reportovan_Text_Full"].value_counts()
+        print(zvuk_agreg_counts)
+        if not df_event.empty:
+            zvuk_agreg_percentages = (zvuk_agreg_counts / len(df_event)) * 100
+            print("\nProcentuálně:")
+            print(zvuk_agreg_percentages.round(1).astype(str) + "%")
+        if zvuk_agreg_counts.get("Ano (zvuk reportován)", 0) > 0:
             create_bar_chart(
-                zvuk_detail_series,
-                "Detaily reportovaných zvuků",
-                "zvuky_detaily",
-                "Typ zvuku",
+                zvuk_agreg_counts,
+                "Agregovaný report zvuků",
+                "zvuky_agreg",
+                "Zvuk reportován?",
                 show_percentages=True,
             )
+        if actual_sound_cols:
+            observed_counts = answer_observed_flags(
+                df_event, actual_sound_cols, NEGATIVE_OR_EMPTY_VALUES
+            ).sum()
+            sound_details_data = observed_counts[observed_counts > 0].to_dict()
+            if sound_details_data:
+                zvuk_detail_series = pd.Series(sound_details_data).sort_values(
+                    ascending=False
+                )
+                print("Detaily zvuků (počet):")
+                print(zvuk_detail_series)
+                if not df_event.empty:
+                    zvuk_detail_percentages = (zvuk_detail_series / len(df_event)) * 100
+                    print("\nProcentuálně (z celkového počtu pozorování):")
+                    print(zvuk_detail_percentages.round(1).astype(str) + "%")
+                create_bar_chart(
+                    zvuk_detail_series,
+                    "Detaily reportovaných zvuků",
+                    "zvuky_detaily",
+                    "Typ zvuku",
+                    show_percentages=True,
+                )
 
-print("\n--- Generování parametrických map ---")
-map_configs = [
-    (
-        "Pocit_Kategorie_Legenda",
-        "Kdo pocítil otřesy",
-        "felt_by",
-        {"Většina": "green", "Jen respondent": "orange", "Nezadáno": "lightgrey"},
-        None,
-        "Pocit_Kategorie_Text_Full",
-    ),
-    (
-        "Zvuk_Reportovan_Legenda",
-        "Reportované zvuky",
-        "sounds_reported",
-        {"Ano": "purple", "Ne": "lightskyblue", "Nezadáno": "lightgrey"},
-        None,
-        "Zvuk_Reportovan_Text_Full",
-    ),
-    (
-        "Poskozeni_Obecne_Legenda",
-        "Poškození budov",
-        "damage",
-        {"Ano": "darkred", "Ne": "darkgreen", "Nezadáno": "lightgrey"},
-        None,
-        "Poskozeni_Obecne_Text_Full",
-    ),
-    (
-        "Pohyb_Predmetu_Legenda",
-        "Pohyb předmětů",
-        "object_movement",
-        {"Ano": "orangered", "Ne": "mediumseagreen", "Nezadáno": "lightgrey"},
-        None,
-        "Pohyb_Predmetu_Agregovany_Text_Full",
-    ),
-    (
-        "Intenzita_Kat_Legenda",
-        "Intenzita otřesů (popis)",
-        "tremor_intensity_descr",
-        None,
-        None,
-        "Intenzita_Kat_Full",
-    ),
-    (
-        "Strach_Pocit_Legenda",
-        "Pocit strachu/paniky",
-        "fear",
-        {"Ano": "crimson", "Ne/Nezadáno": "teal"},
-        None,
-        "Strach_Pocit_Kat_Text_Full",
-    ),
-    (
-        "Mist_Pozorovani_Legenda",
-        "Místo pozorování",
-        "in_building",
-        {"Doma": "sandybrown", "Venku/Nezadáno": "skyblue"},
-        None,
-        "Mist_Pozorovani_Kat_Full",
-    ),
-]
-for config_idx, config in enumerate(map_configs):
-    col_for_color, title, fname, cmap, hover_extra, col_for_hover = config
-    cat_order_current = []
-    if col_for_color in df_event.columns and df_event[col_for_color].nunique() > 0:
-        unique_values = df_event[col_for_color].unique().tolist()
-        if cmap:
-            cat_order_current = list(cmap.keys())
-            missing = sorted([v for v in unique_values if v not in cat_order_current])
-            cat_order_current.extend(missing)
-        else:
-            nezadano_like = [
-                "Nezadáno",
-                "Nezadáno/Jiné",
-                "Nezadáno (info chybí)",
-                "Neklasifikováno",
-                "nan",
-            ]
-            standard_vals = sorted(
-                [
-                    v
-                    for v in unique_values
-                    if str(v) not in nezadano_like and not pd.isna(v)
-                ],
-                key=lambda x: str(x).lower(),
-            )
-            nezadano_vals = sorted(
-                [v for v in unique_values if str(v) in nezadano_like or pd.isna(v)],
-                key=lambda x: str(x).lower(),
+
+def stage_summary_workbook(df_event, df_isoseismal_metrics):
+    print("\n--- Export souhrnného sešitu (XLSX) ---")
+    n_reports = len(df_event)
+    ems_counts = df_event["EMS_Intensity_Est"].value_counts()
+    summary_sheets = {
+        "EMS": count_table(
+            ems_counts.reindex(sorted(ems_counts.index, key=sort_ems_key)),
+            n_reports,
+            category_label="EMS_Intensity_Est",
+        )
+    }
+    for sheet_name, col in SUMMARY_WORKBOOK_CATEGORY_SHEETS.items():
+        if col in df_event.columns:
+            summary_sheets[sheet_name] = count_table(
+                df_event[col].value_counts(), n_reports, category_label=col
             )
-            cat_order_current = standard_vals + nezadano_vals
-    png_path = create_custom_map(
+    detail_counts = {}
+    if actual_movement_detail_cols:
+        detail_counts["Pohyb_detaily"] = movement_observed_flags(df_event).sum()
+    if actual_sound_cols:
+        detail_counts["Zvuk_detaily"] = answer_observed_flags(
+            df_event, actual_sound_cols, NEGATIVE_OR_EMPTY_VALUES
+        ).sum()
+    for sheet_name, observed_counts in detail_counts.items():
+        summary_sheets[sheet_name] = count_table(
+            observed_counts.sort_values(ascending=False),
+            n_reports,
+            category_label="Sloupec",
+        )
+    if df_isoseismal_metrics is not None and not df_isoseismal_metrics.empty:
+        summary_sheets["Izoseisty"] = df_isoseismal_metrics
+    summary_sheets["Hlaseni"] = df_event
+
+    workbook_path = os.path.join(OUTPUT_DIR, f"souhrn_{EQ_YEAR_TARGET}.xlsx")
+    try:
+        written = write_summary_workbook(workbook_path, summary_sheets)
+    except Exception as e:
+        print(f"CHYBA při ukládání souhrnného sešitu: {e}")
+        return None
+    if written is None:
+        return None
+    print(f"Souhrnný sešit ({len(written)} listů) uložen do: {workbook_path}")
+    return workbook_path
+
+
+def stage_results_store(df_event, df_isoseismal_metrics):
+    print(f"\n--- Zápis do databáze výsledků: {RESULTS_DB_PATH} ---")
+    store_columns = ["EMS_Intensity_Est"] + list(
+        SUMMARY_WORKBOOK_CATEGORY_SHEETS.values()
+    )
+    store_columns = [col for col in store_columns if col in df_event.columns]
+    try:
+        stored = store_event_results(
+            RESULTS_DB_PATH,
+            EVENT_INFO,
+            target_eq_datetime_utc,
+            df_event,
+            "EMS_Intensity_Est",
+            sort_ems_key,
+            category_columns=store_columns[1:] + ["Podezrele_Hlaseni"],
+            distributions={col: df_event[col].value_counts() for col in store_columns},
+            df_hull_metrics=df_isoseismal_metrics,
+            time_col=COL_OBS_DATETIME,
+            lat_col=COL_LAT,
+            lon_col=COL_LON,
+        )
+        print(
+            f"Událost {stored['event_id']}: uloženo {stored['n_reports']} hlášení, "
+            f"{stored['n_distribution_rows']} řádků rozdělení, "
+            f"{stored['n_hull_rows']} izoseist."
+        )
+        df_nearby = events_within_km(
+            RESULTS_DB_PATH, EQ_LAT, EQ_LON, RESULTS_NEARBY_EVENTS_KM
+        )
+        print(f"Události v databázi do {RESULTS_NEARBY_EVENTS_KM:g} km od epicentra:")
+        print(
+            df_nearby[
+                [
+                    "event_id",
+                    "location_name",
+                    "origin_time_utc",
+                    "magnitude",
+                    "distance_km",
+                ]
+            ]
+            .round(1)
+            .to_string(index=False)
+        )
+        df_pooled = pooled_intensity_distance(
+            RESULTS_DB_PATH, event_ids=df_nearby["event_id"]
+        )
+        print(
+            f"Data intenzita-vzdálenost těchto událostí: {len(df_pooled)} hlášení "
+            f"z {df_pooled['event_id'].nunique()} událostí."
+        )
+    except Exception as e:
+        print(f"CHYBA při zápisu do databáze výsledků: {e}")
+        return None
+    return stored
+
+
+def stage_parametric_map(config, df_event):
+    col_for_color, title, fname, cmap, hover_extra, col_for_hover = config
+    print(f"\n--- Parametrická mapa: {title} ---")
+    cat_order_current = parametric_category_order(df_event, col_for_color, cmap)
+    return create_custom_map(
         df_event,
         col_for_color,
         title,
@@ -1032,67 +963,500 @@ for config_idx, config in enumerate(map_configs):
         hover_extra,
         col_for_hover,
         show_isoseismal_areas=False,
+        write_html=not MULTILAYER_INTERACTIVE_MAP,
+        write_png=GENERATE_PPTX,
     )
-    if png_path:
-        generated_map_files_for_pptx.append((png_path, title))
-
-print("\n--- Generování EMS mapy s izoseismálními oblastmi ---")
-ems_cat_order = sorted(df_event["EMS_Intensity_Est"].unique(), key=sort_ems_key)
-ems_hulls_map_title = "Odhad EMS-98 Intenzita s oblastmi"
-ems_hulls_map_png_path = create_custom_map(
-    df_event,
-    "EMS_Intensity_Est",
-    ems_hulls_map_title,
-    "ems_intensity_hulls",
-    {"EMS_Intensity_Est": ems_cat_order},
-    ems_color_map,
-    [
-        COL_TREMOR_TYPE,
-        COL_FELT_BY,
-        COL_DAMAGE_OVERALL,
-        "Pohyb_Predmetu_Agregovany_Text_Full",
-    ],
-    "EMS_Intensity_Est",
-    show_isoseismal_areas=True,
-    ems_color_map_for_hulls=ems_color_map,
-    sort_ems_key_func=sort_ems_key,
+
+
+def stage_isoseismals(df_event):
+    print("\n--- Metriky izoseismálních oblastí ---")
+    df_hull_reports = df_event
+    if OUTLIER_EXCLUDE_FROM_HULLS and "Podezrele_Hlaseni" in df_event.columns:
+        df_hull_reports = df_event[~df_event["Podezrele_Hlaseni"]]
+        print(
+            f"INFO: {len(df_event) - len(df_hull_reports)} podezřelých hlášení "
+            "vynecháno z izoseismálních oblastí."
+        )
+    ems_isoseismal_hulls = build_isoseismal_hulls(
+        df_hull_reports,
+        EMS_COLOR_MAP.keys(),
+        sort_ems_key,
+        lat_col=COL_LAT,
+        lon_col=COL_LON,
+    )
+    df_isoseismal_metrics = compute_isoseismal_metrics(
+        ems_isoseismal_hulls, EQ_LAT, EQ_LON
+    )
+    if not df_isoseismal_metrics.empty:
+        print(df_isoseismal_metrics.round(2).to_string(index=False))
+        try:
+            isoseismal_metrics_path = os.path.join(
+                OUTPUT_DIR, f"izoseisty_metriky_{EQ_YEAR_TARGET}.csv"
+            )
+            df_isoseismal_metrics.to_csv(isoseismal_metrics_path, index=False)
+            print(f"Metriky izoseist uloženy do: {isoseismal_metrics_path}")
+        except Exception as e:
+            print(f"CHYBA při ukládání metrik izoseist: {e}")
+    else:
+        print("INFO: Žádné izoseismální oblasti pro výpočet metrik.")
+    return {
+        "ems_isoseismal_hulls": ems_isoseismal_hulls,
+        "df_isoseismal_metrics": df_isoseismal_metrics,
+    }
+
+
+def stage_intensity_raster(df_event):
+    print("\n--- Export rastru interpolované intenzity (GeoTIFF) ---")
+    raster_ems_values = df_event["EMS_Intensity_Est"].map(sort_ems_key)
+    raster_ems_values = raster_ems_values.where(raster_ems_values <= 12)
+    raster_lons = df_event[COL_LON].to_numpy()
+    raster_lats = df_event[COL_LAT].to_numpy()
+    raster_values = raster_ems_values.to_numpy(dtype=float)
+    if RASTER_LOCALITY_CELL_DEG:
+        raster_lons, raster_lats, raster_values = aggregate_locality_intensities(
+            raster_lons, raster_lats, raster_values, RASTER_LOCALITY_CELL_DEG
+        )
+        print(f"Intenzity agregovány do {len(raster_values)} lokalit.")
+    raster_path = os.path.join(OUTPUT_DIR, f"intenzita_ems_{EQ_YEAR_TARGET}.tif")
+    if write_intensity_geotiff(
+        raster_path,
+        raster_lons,
+        raster_lats,
+        raster_values,
+        EQ_LON,
+        EQ_LAT,
+        half_width_deg=RASTER_HALF_WIDTH_DEG,
+        cell_size_deg=RASTER_CELL_SIZE_DEG,
+        k_neighbours=RASTER_IDW_NEIGHBOURS,
+        idw_power=RASTER_IDW_POWER,
+        max_distance_km=RASTER_MAX_DISTANCE_KM,
+    ):
+        print(f"Rastr intenzity uložen do: {raster_path}")
+        return raster_path
+    return None
+
+
+def stage_time_window_sweep(df_reports):
+    print("\n--- Citlivost na šířku časového okna ---")
+    # Celá validovaná tabulka: okna mohou přesahovat hranici měsíce
+    df_sweep = select_event_window(
+        df_reports, target_eq_datetime_utc, max(SWEEP_WINDOW_HOURS)
+    )
+    if df_sweep.empty:
+        print("INFO: V nejširším okně nejsou žádná hlášení.")
+        return None
+    df_sweep = prepare_categories(df_sweep, verbose=False)
+    df_sweep["EMS_Intensity_Est"] = classify_ems_intensity(df_sweep)
+    df_sweep_distribution, df_sweep_summary = time_window_sweep(
+        df_sweep,
+        target_eq_datetime_utc,
+        SWEEP_CATEGORY_COLUMNS,
+        COL_OBS_DATETIME,
+        window_hours=SWEEP_WINDOW_HOURS,
+        ems_levels=EMS_COLOR_MAP.keys(),
+        sort_ems_key_func=sort_ems_key,
+        eq_lat=EQ_LAT,
+        eq_lon=EQ_LON,
+        lat_col=COL_LAT,
+        lon_col=COL_LON,
+    )
+    stable_hours = mark_stable_windows(df_sweep_summary, "EMS_Intensity_Est")
+    print(
+        df_sweep_summary[
+            [
+                "window_hours",
+                "n_reports",
+                "n_added",
+                "tvd_EMS_Intensity_Est",
+                "tvd_pridanych_EMS_Intensity_Est",
+                "stabilni_EMS_Intensity_Est",
+                "felt_area_km2",
+            ]
+        ]
+        .round(3)
+        .to_string(index=False)
+    )
+    if stable_hours is not None:
+        print(
+            f"Rozdělení EMS se ustaluje od okna +/- {stable_hours:g} h "
+            f"(TVD přidaných hlášení pod {STABLE_ADDED_TVD_THRESHOLD})."
+        )
+    else:
+        print("VAROVÁNÍ: Rozdělení EMS se v testovaných oknech neustálilo.")
+    try:
+        sweep_distribution_path = os.path.join(
+            OUTPUT_DIR, f"citlivost_okna_rozdeleni_{EQ_YEAR_TARGET}.csv"
+        )
+        df_sweep_distribution.to_csv(sweep_distribution_path, index=False)
+        sweep_summary_path = os.path.join(
+            OUTPUT_DIR, f"citlivost_okna_souhrn_{EQ_YEAR_TARGET}.csv"
+        )
+        df_sweep_summary.to_csv(sweep_summary_path, index=False)
+        print(f"Tabulky citlivosti uloženy do: {sweep_summary_path}")
+        fig_sweep = build_sweep_figure(
+            df_sweep_distribution,
+            df_sweep_summary,
+            "EMS_Intensity_Est",
+            category_order=sorted(EMS_COLOR_MAP, key=sort_ems_key),
+            color_map=EMS_COLOR_MAP,
+            stable_hours=stable_hours,
+        )
+        if fig_sweep is not None:
+            sweep_chart_path = os.path.join(
+                OUTPUT_DIR, f"graf_citlivost_okna_ems_{EQ_YEAR_TARGET}.html"
+            )
+            save_figure_html(fig_sweep, sweep_chart_path)
+            print(f"Graf citlivosti uložen do: {sweep_chart_path}")
+    except Exception as e:
+        print(f"CHYBA při ukládání citlivosti na časové okno: {e}")
+    return df_sweep_summary
+
+
+def stage_vector_tiles(df_event, ems_isoseismal_hulls):
+    print("\n--- Export vektorových dlaždic (MVT) ---")
+    if VECTOR_TILE_FORMAT == "mbtiles":
+        tiles_path = os.path.join(OUTPUT_DIR, f"dlazdice_{EQ_YEAR_TARGET}.mbtiles")
+    else:
+        tiles_path = os.path.join(OUTPUT_DIR, f"dlazdice_{EQ_YEAR_TARGET}")
+    try:
+        tiles_info = write_vector_tiles(
+            tiles_path,
+            df_event,
+            "EMS_Intensity_Est",
+            sort_ems_key,
+            category_columns=VECTOR_TILE_CATEGORY_COLUMNS,
+            hulls=ems_isoseismal_hulls,
+            lat_col=COL_LAT,
+            lon_col=COL_LON,
+            min_zoom=VECTOR_TILE_MIN_ZOOM,
+            max_zoom=VECTOR_TILE_MAX_ZOOM,
+            output_format=VECTOR_TILE_FORMAT,
+            n_processes=VECTOR_TILE_N_PROCESSES,
+            name=f"{EQ_LOCATION_NAME} {EQ_YEAR_TARGET}",
+        )
+    except Exception as e:
+        print(f"CHYBA při exportu vektorových dlaždic: {e}")
+        return None
+    if tiles_info is None:
+        return None
+    if VECTOR_TILE_FORMAT == "dir":
+        viewer_path = write_tile_viewer_html(
+            tiles_path,
+            tiles_info,
+            EQ_LAT,
+            EQ_LON,
+            8,
+            EMS_COLOR_MAP,
+            title=f"{EQ_LOCATION_NAME} {EQ_YEAR_TARGET}",
+        )
+        print(f"Prohlížeč dlaždic: {viewer_path}")
+        print(f"      Spusťte 'python -m http.server' v adresáři {tiles_path}")
+    return tiles_info
+
+
+def stage_ems_hulls_map(df_event, ems_isoseismal_hulls, df_isoseismal_metrics):
+    print("\n--- Generování EMS mapy s izoseismálními oblastmi ---")
+    ems_cat_order = sorted(df_event["EMS_Intensity_Est"].unique(), key=sort_ems_key)
+    return create_custom_map(
+        df_event,
+        "EMS_Intensity_Est",
+        "Odhad EMS-98 Intenzita s oblastmi",
+        "ems_intensity_hulls",
+        {"EMS_Intensity_Est": ems_cat_order},
+        EMS_COLOR_MAP,
+        [
+            COL_TREMOR_TYPE,
+            COL_FELT_BY,
+            COL_DAMAGE_OVERALL,
+            "Pohyb_Predmetu_Agregovany_Text_Full",
+            "Podezrele_Hlaseni_Text",
+        ]
+        + covariate_columns,
+        "EMS_Intensity_Est",
+        show_isoseismal_areas=True,
+        ems_color_map_for_hulls=EMS_COLOR_MAP,
+        sort_ems_key_func=sort_ems_key,
+        isoseismal_hulls=ems_isoseismal_hulls,
+        isoseismal_metrics=df_isoseismal_metrics,
+    )
+
+
+def stage_misfit_map(macroseismic_solution, df_misfit):
+    if not macroseismic_solution:
+        return None
+    print("\n--- Generování mapy makroseismické inverze ---")
+    misfit_map_title = "Makroseismická inverze - plocha misfitu"
+    fig_misfit = go.Figure()
+    fig_misfit.add_trace(
+        go.Scattermapbox(
+            lat=df_misfit["lat"],
+            lon=df_misfit["lon"],
+            mode="markers",
+            marker=go.scattermapbox.Marker(
+                size=6,
+                color=df_misfit["misfit_rms"],
+                colorscale="Viridis_r",
+                colorbar=dict(title="RMS misfit", x=0.02, xanchor="left"),
+                opacity=0.6,
+            ),
+            customdata=df_misfit[["misfit_rms", "best_magnitude"]].values,
+            hovertemplate=(
+                "RMS misfit: %{customdata[0]:.2f}<br>"
+                "Nejlepší Mm: %{customdata[1]:.1f}<extra></extra>"
+            ),
+            name="Misfit (uzly sítě)",
+            showlegend=True,
+        )
+    )
+    fig_misfit.add_trace(
+        go.Scattermapbox(
+            lat=[macroseismic_solution["lat"]],
+            lon=[macroseismic_solution["lon"]],
+            mode="markers",
+            marker=go.scattermapbox.Marker(size=17, color="black", opacity=1),
+            name=f"Makroseismické epicentrum (Mm: "
+            f"{macroseismic_solution['magnitude']:.1f})",
+            hoverinfo="name",
+            showlegend=True,
+        )
+    )
+    fig_misfit.add_trace(
+        go.Scattermapbox(
+            lat=[EQ_LAT],
+            lon=[EQ_LON],
+            mode="markers",
+            marker=go.scattermapbox.Marker(
+                size=17, color="red", symbol="star", opacity=1
+            ),
+            name=f"Epicentrum (Mag: {format_magnitude(EQ_MAGNITUDE)})",
+            hoverinfo="name",
+            showlegend=True,
+        )
+    )
+    fig_misfit.update_layout(
+        mapbox_style="open-street-map",
+        margin={"r": 10, "t": 50, "l": 10, "b": 10},
+        title=f"Zemětřesení {EQ_LOCATION_NAME}",
+        legend_title_text=misfit_map_title,
+        legend=dict(
+            bgcolor="rgba(255,255,255,0.9)",
+            bordercolor="Black",
+            borderwidth=1,
+            font=dict(family="Arial", size=10, color="black"),
+            yanchor="top",
+            y=0.98,
+            xanchor="right",
+            x=0.98,
+        ),
+        mapbox_zoom=7.5,
+        mapbox_center={"lat": EQ_LAT, "lon": EQ_LON},
+    )
+    try:
+        misfit_html_path = os.path.join(
+            OUTPUT_DIR, f"mapa_inverze_misfit_{EQ_YEAR_TARGET}.html"
+        )
+        save_figure_html(fig_misfit, misfit_html_path)
+        print(f"Mapa '{misfit_map_title}' uložena do HTML: {misfit_html_path}")
+        misfit_png_path = os.path.join(
+            OUTPUT_DIR, f"mapa_inverze_misfit_{EQ_YEAR_TARGET}.png"
+        )
+        save_figure_png(fig_misfit, misfit_png_path)
+        print(f"Mapa '{misfit_map_title}' uložena do PNG: {misfit_png_path}")
+        return misfit_png_path
+    except Exception as e:
+        print(f"CHYBA při ukládání mapy '{misfit_map_title}': {e}.")
+        if "kaleido" in str(e).lower():
+            print("      Nainstalujte 'kaleido': pip install kaleido")
+        return None
+
+
+# Mapové etapy v pořadí snímků prezentace: (název etapy, titulek snímku)
+map_slide_stages = []
+pipeline_stages = [
+    Stage("text_statistics", stage_text_statistics, inputs=["df_event"]),
+]
+if MULTILAYER_INTERACTIVE_MAP:
+    pipeline_stages.append(
+        Stage("map_vrstvy", stage_multilayer_map, inputs=["df_event"])
+    )
+# Samostatné mapy vrstev jsou v režimu jedné mapy potřeba jen pro PNG do prezentace
+if GENERATE_PPTX or not MULTILAYER_INTERACTIVE_MAP:
+    pipeline_stages.append(
+        Stage("map_pozorovani_hlavni", stage_main_map, inputs=["df_event"])
+    )
+    map_slide_stages.append(("map_pozorovani_hlavni", "Přehled pozorování"))
+    for config in MAP_CONFIGS:
+        map_stage_name = f"map_{config[2]}"
+        pipeline_stages.append(
+            Stage(
+                map_stage_name,
+                functools.partial(stage_parametric_map, config),
+                inputs=["df_event"],
+            )
+        )
+        map_slide_stages.append((map_stage_name, config[1]))
+if RUN_DENSITY_MAP:
+    pipeline_stages.append(
+        Stage("map_hustota_hlaseni", stage_density_map, inputs=["df_event"])
+    )
+    map_slide_stages.append(("map_hustota_hlaseni", "Hustota hlášení"))
+pipeline_stages += [
+    Stage(
+        "isoseismals",
+        stage_isoseismals,
+        inputs=["df_event"],
+        outputs=["ems_isoseismal_hulls", "df_isoseismal_metrics"],
+    ),
+    Stage(
+        "map_ems_intensity_hulls",
+        stage_ems_hulls_map,
+        inputs=["df_event", "ems_isoseismal_hulls", "df_isoseismal_metrics"],
+    ),
+]
+map_slide_stages.append(
+    ("map_ems_intensity_hulls", "Odhad EMS-98 Intenzita s oblastmi")
+)
+if RUN_SUMMARY_WORKBOOK:
+    pipeline_stages.append(
+        Stage(
+            "summary_workbook",
+            stage_summary_workbook,
+            inputs=["df_event", "df_isoseismal_metrics"],
+        )
+    )
+if RUN_RESULTS_STORE:
+    pipeline_stages.append(
+        Stage(
+            "results_store",
+            stage_results_store,
+            inputs=["df_event", "df_isoseismal_metrics"],
+        )
+    )
+if RUN_VECTOR_TILE_EXPORT:
+    pipeline_stages.append(
+        Stage(
+            "vector_tiles",
+            stage_vector_tiles,
+            inputs=["df_event", "ems_isoseismal_hulls"],
+        )
+    )
+if RUN_TIME_WINDOW_SWEEP:
+    pipeline_stages.append(
+        Stage("time_window_sweep", stage_time_window_sweep, inputs=["df_reports"])
+    )
+if RUN_INTENSITY_RASTER_EXPORT:
+    pipeline_stages.append(
+        Stage("intensity_raster", stage_intensity_raster, inputs=["df_event"])
+    )
+if RUN_MACROSEISMIC_INVERSION:
+    pipeline_stages += [
+        Stage(
+            "inversion",
+            stage_inversion,
+            inputs=["df_event"],
+            outputs=["macroseismic_solution", "df_misfit"],
+        ),
+        Stage(
+            "map_inverze_misfit",
+            stage_misfit_map,
+            inputs=["macroseismic_solution", "df_misfit"],
+        ),
+    ]
+    map_slide_stages.append(
+        ("map_inverze_misfit", "Makroseismická inverze - plocha misfitu")
+    )
+
+
+# --- PowerPoint: snímky se přidávají průběžně, jak etapy dokončují mapy ---
+prs = Presentation()
+prs.slide_width = Inches(10)
+prs.slide_height = Inches(5.625)
+map_slide_titles = dict(map_slide_stages)
+added_map_slides = {}  # název etapy -> snímek
+
+
+def add_map_slide(prs, png_path, map_slide_title):
+    if not png_path:
+        return None
+    if not os.path.exists(png_path):
+        print(f"VAROVÁNÍ: Soubor s mapou {png_path} nebyl nalezen.")
+        return None
+    slide = prs.slides.add_slide(prs.slide_layouts[6])
+    title_shape = slide.shapes.add_textbox(
+        Inches(0.5), Inches(0.2), Inches(9), Inches(0.5)
+    )
+    title_frame = title_shape.text_frame
+    title_frame.text = f"{EQ_LOCATION_NAME}: {map_slide_title}"
+    title_frame.paragraphs[0].font.size = Inches(0.24)
+    title_frame.paragraphs[0].font.bold = True
+    img_width_on_slide = Inches(9)
+    img_height_on_slide = img_width_on_slide * (750 / 1000)
+    left = (prs.slide_width - img_width_on_slide) / 2
+    top = Inches(0.75)
+    try:
+        slide.shapes.add_picture(
+            png_path,
+            left,
+            top,
+            width=img_width_on_slide,
+            height=img_height_on_slide,
+        )
+        print(f"Přidána mapa '{map_slide_title}' do prezentace.")
+    except Exception as e:
+        print(f"CHYBA při přidávání obrázku {png_path} do prezentace: {e}")
+    return slide
+
+
+def on_stage_result(stage_name, outputs):
+    # Volá plánovač v hlavním vlákně hned po dokončení etapy
+    if stage_name not in map_slide_titles:
+        return
+    slide = add_map_slide(prs, outputs[stage_name], map_slide_titles[stage_name])
+    if slide is not None:
+        added_map_slides[stage_name] = slide
+
+
+def order_slides(prs, slides_in_order):
+    # python-pptx nemá veřejné API pro pořadí snímků; pořadí určuje seznam
+    # sldId v prezentaci, jeho položky se přesunou na konec v daném pořadí
+    slide_id_list = prs.slides._sldIdLst
+    entries = {entry.id: entry for entry in slide_id_list}
+    for slide in slides_in_order:
+        entry = entries[slide.slide_id]
+        slide_id_list.remove(entry)
+        slide_id_list.append(entry)
+
+
+print(
+    f"\n--- Spouštění {len(pipeline_stages)} etap výpočtu "
+    f"({STAGE_EXECUTOR}, max. {STAGE_MAX_WORKERS} souběžně) ---"
 )
-if ems_hulls_map_png_path:
-    generated_map_files_for_pptx.append((ems_hulls_map_png_path, ems_hulls_map_title))
+scheduler = StageScheduler(
+    pipeline_stages, executor_kind=STAGE_EXECUTOR, max_workers=STAGE_MAX_WORKERS
+)
+pipeline_results = scheduler.run(
+    initial_results={"df_event": df_event, "df_reports": df},
+    on_result=on_stage_result if GENERATE_PPTX else None,
+)
+print("\nDoba běhu etap:")
+for stage_name, duration in sorted(
+    scheduler.stage_durations.items(), key=lambda item: -item[1]
+):
+    print(f"  {stage_name}: {duration:.2f} s")
 
 print("\n--- Generování PowerPoint prezentace ---")
-if generated_map_files_for_pptx:
-    prs = Presentation()
-    prs.slide_width = Inches(10)
-    prs.slide_height = Inches(5.625)
-    blank_slide_layout = prs.slide_layouts[6]
-    for png_path, map_slide_title in generated_map_files_for_pptx:
-        if os.path.exists(png_path):
-            slide = prs.slides.add_slide(blank_slide_layout)
-            title_shape = slide.shapes.add_textbox(
-                Inches(0.5), Inches(0.2), Inches(9), Inches(0.5)
-            )
-            title_frame = title_shape.text_frame
-            title_frame.text = f"{EQ_LOCATION_NAME}: {map_slide_title}"
-            title_frame.paragraphs[0].font.size = Inches(0.24)
-            title_frame.paragraphs[0].font.bold = True
-            img_width_on_slide = Inches(9)
-            img_height_on_slide = img_width_on_slide * (750 / 1000)
-            left = (prs.slide_width - img_width_on_slide) / 2
-            top = Inches(0.75)
-            try:
-                slide.shapes.add_picture(
-                    png_path,
-                    left,
-                    top,
-                    width=img_width_on_slide,
-                    height=img_height_on_slide,
-                )
-                print(f"Přidána mapa '{map_slide_title}' do prezentace.")
-            except Exception as e:
-                print(f"CHYBA při přidávání obrázku {png_path} do prezentace: {e}")
-        else:
-            print(f"VAROVÁNÍ: Soubor s mapou {png_path} nebyl nalezen.")
+if not GENERATE_PPTX:
+    print("INFO: Prezentace se negeneruje (GENERATE_PPTX = False).")
+elif added_map_slides:
+    # Snímky přibývaly v pořadí dokončení etap, seřadit podle deklarace
+    order_slides(
+        prs,
+        [
+            added_map_slides[stage_name]
+            for stage_name, _ in map_slide_stages
+            if stage_name in added_map_slides
+        ],
+    )
     pptx_filename = os.path.join(
         OUTPUT_DIR,
         f"prezentace_mapy_{EQ_LOCATION_NAME.lower().replace(' ', '_')}_{EQ_YEAR_TARGET}.pptx",
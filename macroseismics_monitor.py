@@ -0,0 +1,381 @@
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from macroseismics_core import load_report_table
+
+# --- Monitor četnosti hlášení a automatická detekce událostí ---
+# Hlášení se přiřazují do prostorových buněk (cell_deg x cell_deg) a časových
+# košů (bucket_minutes). Pro každou buňku se drží kruhový buffer košů s
+# průběžnými součty krátkého okna a pozadí, takže každé hlášení stojí O(1)
+# bez ohledu na délku historie. Shluk (burst) nastane, když četnost v krátkém
+# okně překročí rate_factor násobek četnosti pozadí.
+DEFAULT_BUCKET_MINUTES = 10
+DEFAULT_WINDOW_BUCKETS = 3
+DEFAULT_BACKGROUND_BUCKETS = 144  # 24 h při 10min koších
+DEFAULT_CELL_DEG = 0.5
+DEFAULT_MIN_REPORTS = 10
+DEFAULT_RATE_FACTOR = 5.0
+DEFAULT_MIN_BACKGROUND_RATE = 0.1  # hlášení na koš, aby prázdné pozadí nedělilo nulou
+
+
+class _CellCounter:
+    # Kruhový buffer košů jedné buňky s průběžnými součty oken
+    __slots__ = (
+        "counts",
+        "sum_lat",
+        "sum_lon",
+        "first_seconds",
+        "head_bucket",
+        "short_count",
+        "background_count",
+    )
+
+    def __init__(self, ring_size, bucket):
+        self.counts = np.zeros(ring_size, dtype=np.int64)
+        self.sum_lat = np.zeros(ring_size)
+        self.sum_lon = np.zeros(ring_size)
+        self.first_seconds = np.full(ring_size, np.inf)
+        self.head_bucket = bucket
+        self.short_count = 0
+        self.background_count = 0
+
+
+class ReportRateMonitor:
+    def __init__(
+        self,
+        bucket_minutes=DEFAULT_BUCKET_MINUTES,
+        window_buckets=DEFAULT_WINDOW_BUCKETS,
+        background_buckets=DEFAULT_BACKGROUND_BUCKETS,
+        cell_deg=DEFAULT_CELL_DEG,
+        min_reports=DEFAULT_MIN_REPORTS,
+        rate_factor=DEFAULT_RATE_FACTOR,
+        min_background_rate=DEFAULT_MIN_BACKGROUND_RATE,
+    ):
+        self.bucket_seconds = bucket_minutes * 60
+        self.window_buckets = window_buckets
+        self.background_buckets = background_buckets
+        self.ring_size = window_buckets + background_buckets
+        self.cell_deg = cell_deg
+        self.min_reports = min_reports
+        self.rate_factor = rate_factor
+        self.min_background_rate = min_background_rate
+        self.cells = {}
+        self.active_bursts = {}
+        self.n_reports = 0
+
+    def _advance(self, cell, bucket):
+        # Posun hlavy bufferu; koš opouštějící krátké okno přechází do pozadí
+        steps = bucket - cell.head_bucket
+        if steps <= 0:
+            return
+        if steps >= self.ring_size:
+            cell.counts[:] = 0
+            cell.sum_lat[:] = 0.0
+            cell.sum_lon[:] = 0.0
+            cell.first_seconds[:] = np.inf
+            cell.short_count = 0
+            cell.background_count = 0
+            cell.head_bucket = bucket
+            return
+        for b in range(cell.head_bucket + 1, bucket + 1):
+            leaving_short = (b - self.window_buckets) % self.ring_size
+            cell.short_count -= cell.counts[leaving_short]
+            cell.background_count += cell.counts[leaving_short]
+            slot = b % self.ring_size  # nejstarší koš pozadí, recykluje se
+            cell.background_count -= cell.counts[slot]
+            cell.counts[slot] = 0
+            cell.sum_lat[slot] = 0.0
+            cell.sum_lon[slot] = 0.0
+            cell.first_seconds[slot] = np.inf
+        cell.head_bucket = bucket
+
+    def _is_burst(self, cell):
+        short_rate = cell.short_count / self.window_buckets
+        background_rate = max(
+            cell.background_count / self.background_buckets, self.min_background_rate
+        )
+        return (
+            cell.short_count >= self.min_reports
+            and short_rate >= self.rate_factor * background_rate
+        )
+
+    def _short_window_slots(self, cell):
+        return [
+            (cell.head_bucket - i) % self.ring_size for i in range(self.window_buckets)
+        ]
+
+    def _short_window_centroid(self, cell):
+        slots = self._short_window_slots(cell)
+        n = cell.counts[slots].sum()
+        if n == 0:
+            return np.nan, np.nan
+        return cell.sum_lat[slots].sum() / n, cell.sum_lon[slots].sum() / n
+
+    def update(self, timestamp, lat, lon):
+        # Zpracuje jedno hlášení; vrací seznam uzavřených kandidátů událostí
+        ts = pd.Timestamp(timestamp)
+        if ts.tzinfo is None:
+            ts = ts.tz_localize("UTC")
+        seconds = ts.timestamp()
+        bucket = int(seconds // self.bucket_seconds)
+        key = (int(np.floor(lat / self.cell_deg)), int(np.floor(lon / self.cell_deg)))
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = _CellCounter(self.ring_size, bucket)
+            self.cells[key] = cell
+        self._advance(cell, bucket)
+        age = cell.head_bucket - bucket
+        if age >= self.ring_size:
+            return self._close_expired(bucket)  # příliš staré hlášení
+        slot = bucket % self.ring_size
+        cell.counts[slot] += 1
+        cell.sum_lat[slot] += lat
+        cell.sum_lon[slot] += lon
+        cell.first_seconds[slot] = min(cell.first_seconds[slot], seconds)
+        if age < self.window_buckets:
+            cell.short_count += 1
+        else:
+            cell.background_count += 1
+        self.n_reports += 1
+
+        if self._is_burst(cell):
+            burst = self.active_bursts.get(key)
+            centroid_lat, centroid_lon = self._short_window_centroid(cell)
+            if burst is None:
+                # Začátek shluku = nejstarší hlášení v krátkém okně
+                first_seconds = cell.first_seconds[self._short_window_slots(cell)].min()
+                burst = {
+                    "cell": key,
+                    "first_report_utc": pd.Timestamp(first_seconds, unit="s", tz="UTC"),
+                    "trigger_report_utc": ts,
+                    "last_report_utc": ts,
+                    "n_reports": int(cell.short_count),
+                    "peak_window_reports": int(cell.short_count),
+                    "lat": centroid_lat,
+                    "lon": centroid_lon,
+                    "last_bucket": bucket,
+                }
+                self.active_bursts[key] = burst
+            else:
+                burst["n_reports"] += 1
+                burst["last_report_utc"] = max(burst["last_report_utc"], ts)
+                burst["last_bucket"] = max(burst["last_bucket"], bucket)
+                if cell.short_count > burst["peak_window_reports"]:
+                    burst["peak_window_reports"] = int(cell.short_count)
+                    burst["lat"], burst["lon"] = centroid_lat, centroid_lon
+        return self._close_expired(bucket)
+
+    def close_expired(self, now=None):
+        # Uzavře shluky podle hodin (now=None -> aktuální čas UTC); po posledním
+        # hlášení události už update() nepřijde, shluk by jinak zůstal otevřený
+        now = pd.Timestamp.now(tz="UTC") if now is None else pd.Timestamp(now)
+        if now.tzinfo is None:
+            now = now.tz_localize("UTC")
+        return self._close_expired(int(now.timestamp() // self.bucket_seconds))
+
+    def _close_expired(self, current_bucket):
+        # Shluk končí, když v buňce přes celé krátké okno nepřišlo hlášení
+        closed = []
+        for key in list(self.active_bursts):
+            burst = self.active_bursts[key]
+            if current_bucket - burst["last_bucket"] >= self.window_buckets:
+                closed.append(self._finalize(self.active_bursts.pop(key)))
+        return _merge_candidates(closed) if closed else []
+
+    def _finalize(self, burst):
+        return {
+            "first_report_utc": burst["first_report_utc"],
+            "trigger_report_utc": burst["trigger_report_utc"],
+            "last_report_utc": burst["last_report_utc"],
+            "lat": float(burst["lat"]),
+            "lon": float(burst["lon"]),
+            "n_reports": int(burst["n_reports"]),
+            "peak_window_reports": int(burst["peak_window_reports"]),
+            "cells": [burst["cell"]],
+        }
+
+    def flush(self):
+        # Uzavře všechny aktivní shluky (konec vstupu)
+        closed = [self._finalize(b) for b in self.active_bursts.values()]
+        self.active_bursts = {}
+        return _merge_candidates(closed)
+
+
+def _merge_candidates(candidates):
+    # Shluky v různých buňkách, které se časově překrývají, jsou jedna událost;
+    # poloha se bere z buňky s nejvyšší špičkou (nejblíže epicentru)
+    candidates = sorted(candidates, key=lambda c: c["first_report_utc"])
+    merged = []
+    for cand in candidates:
+        if merged and cand["first_report_utc"] <= merged[-1]["last_report_utc"]:
+            event = merged[-1]
+            if cand["peak_window_reports"] > event["peak_window_reports"]:
+                event["lat"], event["lon"] = cand["lat"], cand["lon"]
+                event["peak_window_reports"] = cand["peak_window_reports"]
+            event["trigger_report_utc"] = min(
+                event["trigger_report_utc"], cand["trigger_report_utc"]
+            )
+            event["last_report_utc"] = max(
+                event["last_report_utc"], cand["last_report_utc"]
+            )
+            event["n_reports"] += cand["n_reports"]
+            event["cells"] = event["cells"] + cand["cells"]
+        else:
+            merged.append(dict(cand))
+    return merged
+
+
+def detect_events(
+    df_reports, col_datetime="eqdatetime", col_lat="lat", col_lon="lon", **kwargs
+):
+    # Dávkové zpracování tabulky (např. celé historie) přes stejný monitor
+    monitor = ReportRateMonitor(**kwargs)
+    df_sorted = df_reports[[col_datetime, col_lat, col_lon]].dropna()
+    df_sorted = df_sorted.sort_values(col_datetime, kind="stable")
+    candidates = []
+    for ts, lat, lon in zip(
+        df_sorted[col_datetime], df_sorted[col_lat], df_sorted[col_lon]
+    ):
+        candidates.extend(monitor.update(ts, float(lat), float(lon)))
+    candidates.extend(monitor.flush())
+    return _merge_candidates(candidates)
+
+
+def candidate_event_window(candidate, margin_hours=0.5):
+    # Časové okno a střed kandidáta ve tvaru očekávaném analytickým skriptem;
+    # jako čas události slouží hlášení, které shluk spustilo (časy v dotaznících
+    # jsou nepřesné a nejstarší hlášení bývá výrazně před skutečným časem)
+    return {
+        "eq_datetime_utc": candidate["trigger_report_utc"],
+        "start_utc": candidate["first_report_utc"] - pd.Timedelta(hours=margin_hours),
+        "end_utc": candidate["last_report_utc"] + pd.Timedelta(hours=margin_hours),
+        "lat": candidate["lat"],
+        "lon": candidate["lon"],
+    }
+
+
+def detected_event_identity(eq_datetime_utc):
+    # Detekovaná událost nemá katalogové ID ani magnitudu: záporné ID a název
+    # z času (na minuty), aby nepřepsala výstupy ani záznamy jiné události
+    ts = pd.Timestamp(eq_datetime_utc)
+    return {
+        "gfu_id": -int(ts.strftime("%Y%m%d%H%M")),
+        "location_name": f"detekce {ts.strftime('%Y%m%d %H%M')}",
+        "magnitude": None,
+    }
+
+
+def start_analysis_for_candidate(candidate, script_path):
+    # Spustí analytický skript s časem a polohou kandidáta (přes proměnné prostředí)
+    window = candidate_event_window(candidate)
+    env = dict(os.environ)
+    env["MACROSEIS_EQ_DATETIME_UTC"] = window["eq_datetime_utc"].strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    env["MACROSEIS_EQ_LAT"] = f"{window['lat']:.4f}"
+    env["MACROSEIS_EQ_LON"] = f"{window['lon']:.4f}"
+    identity = detected_event_identity(window["eq_datetime_utc"])
+    env["MACROSEIS_EQ_GFU_ID"] = str(identity["gfu_id"])
+    env["MACROSEIS_EQ_LOCATION_NAME"] = identity["location_name"]
+    print(
+        f"Spouštím analýzu pro kandidáta {env['MACROSEIS_EQ_DATETIME_UTC']} UTC "
+        f"({env['MACROSEIS_EQ_LAT']} N, {env['MACROSEIS_EQ_LON']} E)"
+    )
+    return subprocess.run([sys.executable, script_path], env=env, check=False)
+
+
+def watch_report_table(
+    data_file_path,
+    read_table_func,
+    on_candidate,
+    poll_seconds=60,
+    col_datetime="eqdatetime",
+    col_lat="lat",
+    col_lon="lon",
+    max_polls=None,
+    **monitor_kwargs,
+):
+    # Sleduje rostoucí tabulku hlášení; zpracovány jsou jen nově přidané řádky.
+    # read_table_func vrací tabulku s indexem = pořadí řádku v souboru (jako
+    # load_report_table, který index zachová i po vyřazení řádků kontrolou).
+    # Soubor se znovu čte, jen když se změní čas úpravy nebo velikost; neúspěšné
+    # čtení (např. soubor se právě zapisuje) se opakuje při dalším dotazu.
+    # Shluky bez dalších hlášení se při každém dotazu uzavírají podle hodin.
+    monitor = ReportRateMonitor(**monitor_kwargs)
+    n_rows_seen = 0
+    last_signature = None
+    n_polls = 0
+    while max_polls is None or n_polls < max_polls:
+        n_polls += 1
+        df_all = None
+        try:
+            stat = os.stat(data_file_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            print(f"CHYBA: Soubor {data_file_path} nelze číst: {e}")
+            signature = None
+        if signature is not None and signature != last_signature:
+            try:
+                df_all = read_table_func(data_file_path)
+                last_signature = signature
+            except Exception as e:
+                print(
+                    f"VAROVÁNÍ: Tabulku {data_file_path} nelze načíst "
+                    f"({type(e).__name__}: {e}), zkusím znovu."
+                )
+        if df_all is not None:
+            n_rows_total = int(df_all.index.max()) + 1 if len(df_all) else 0
+            if n_rows_total < n_rows_seen:
+                print("VAROVÁNÍ: Tabulka se zkrátila, monitor začíná znovu.")
+                monitor = ReportRateMonitor(**monitor_kwargs)
+                n_rows_seen = 0
+            df_new = df_all[df_all.index >= n_rows_seen]
+            n_rows_seen = n_rows_total
+            # Nové řádky nemusí přijít časově seřazené (např. první načtení historie)
+            df_new = df_new[[col_datetime, col_lat, col_lon]].dropna()
+            df_new = df_new.sort_values(col_datetime, kind="stable")
+            for ts, lat, lon in zip(
+                df_new[col_datetime], df_new[col_lat], df_new[col_lon]
+            ):
+                for candidate in monitor.update(ts, float(lat), float(lon)):
+                    on_candidate(candidate)
+            print(
+                f"Monitor: zpracováno {len(df_new)} nových hlášení "
+                f"(celkem {monitor.n_reports}), aktivních shluků: "
+                f"{len(monitor.active_bursts)}."
+            )
+        for candidate in monitor.close_expired():
+            on_candidate(candidate)
+        if max_polls is None or n_polls < max_polls:
+            time.sleep(poll_seconds)
+    return monitor
+
+
+def _read_report_table(data_file_path):
+    # Sdílené načtení s kontrolou kvality a převodem času do UTC (jako ve
+    # zpracování jedné události), aby monitor a analýza viděly stejná hlášení
+    return load_report_table(data_file_path)
+
+
+if __name__ == "__main__":
+    # Použití: python macroseismics_monitor.py <tabulka.xlsx> [analyticky_skript.py]
+    if len(sys.argv) < 2:
+        sys.exit("Použití: python macroseismics_monitor.py <tabulka.xlsx> [skript.py]")
+    monitored_file = sys.argv[1]
+    analysis_script = sys.argv[2] if len(sys.argv) > 2 else None
+
+    def _on_candidate(candidate):
+        print(
+            f"KANDIDÁT UDÁLOSTI: {candidate['first_report_utc']} - "
+            f"{candidate['last_report_utc']}, {candidate['lat']:.3f} N, "
+            f"{candidate['lon']:.3f} E, {candidate['n_reports']} hlášení"
+        )
+        if analysis_script:
+            start_analysis_for_candidate(candidate, analysis_script)
+
+    watch_report_table(monitored_file, _read_report_table, _on_candidate)
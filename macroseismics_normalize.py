@@ -0,0 +1,111 @@
+import difflib
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# --- Normalizace volných textových odpovědí dotazníku ---
+# Sloupce odpovědí mají jen několik různých hodnot, proto se normalizují pouze
+# unikátní hodnoty (pd.factorize) a výsledek se na řádky rozšíří přes kódy.
+# Normalizovaná hodnota se porovná se slovníkem kanonických odpovědí, překlepy
+# se přiřadí nejbližší odpovědi (difflib), nerozpoznané varianty se vypíší.
+FUZZY_MATCH_CUTOFF = 0.8
+# Předpony zápory a síly: nejbližší odpověď se přijme, jen pokud má stejné
+# předpony ve stejných slovech, jinak zůstane text nerozpoznaný (přiřazení
+# "bylo" <-> "nebylo" nebo "slabé" <-> "silné" by převrátilo význam).
+# Porovnává se bez diakritiky, delší předpony dříve než kratší.
+FUZZY_GUARDED_PREFIXES = ("nepatr", "ne", "slab", "siln", "znac", "mirn")
+
+# Escape sekvence řídicích znaků, které v textu buněk ponechá openpyxl (_x001B_)
+_EXCEL_ESCAPE_RE = re.compile(r"_x[0-9a-fA-F]{4}_")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(value):
+    # Malá písmena, NFC, bez okrajových a zdvojených mezer; chybějící -> None
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(
+        value, bool
+    ):
+        # Čísla uložená Excelem jako float (1.0) -> "1"
+        return f"{value:g}"
+    text = unicodedata.normalize("NFC", str(value))
+    text = _EXCEL_ESCAPE_RE.sub("", text)
+    text = _WHITESPACE_RE.sub(" ", text).strip().lower()
+    return text or None
+
+
+def _strip_diacritics(text):
+    return "".join(
+        c for c in unicodedata.normalize("NFD", text) if not unicodedata.combining(c)
+    )
+
+
+def _guarded_prefixes(text):
+    # Pro každé slovo jeho hlídaná předpona (nebo ""), např. "nebylo" -> ("ne",)
+    prefixes = []
+    for word in _strip_diacritics(text).split(" "):
+        prefixes.append(
+            next((p for p in FUZZY_GUARDED_PREFIXES if word.startswith(p)), "")
+        )
+    return tuple(prefixes)
+
+
+def _match_canonical(text, vocabulary, cutoff):
+    if text is None or not vocabulary or text in vocabulary:
+        return text, True
+    matches = difflib.get_close_matches(text, vocabulary, n=1, cutoff=cutoff)
+    if matches and _guarded_prefixes(matches[0]) == _guarded_prefixes(text):
+        return matches[0], True
+    return text, False
+
+
+def normalize_answers(series, vocabulary=None, cutoff=FUZZY_MATCH_CUTOFF, verbose=True):
+    # Vrací Series kanonických odpovědí (NaN pro chybějící a prázdné hodnoty)
+    codes, uniques = pd.factorize(series)
+    vocabulary = list(vocabulary or [])
+    canonical = []
+    corrected = []
+    unmatched = []
+    for code, raw_value in enumerate(uniques):
+        text = normalize_text(raw_value)
+        matched_text, found = _match_canonical(text, vocabulary, cutoff)
+        canonical.append(matched_text)
+        if not found:
+            unmatched.append((raw_value, code))
+        elif vocabulary and text is not None and text != matched_text:
+            corrected.append((raw_value, matched_text, code))
+
+    if verbose and (corrected or unmatched):
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        for raw_value, matched_text, code in corrected:
+            print(
+                f"INFO: Sloupec '{series.name}': '{raw_value}' -> '{matched_text}' "
+                f"({counts[code]} záznamů)"
+            )
+        for raw_value, code in unmatched:
+            print(
+                f"VAROVÁNÍ: Sloupec '{series.name}': nerozpoznaná odpověď "
+                f"'{raw_value}' ({counts[code]} záznamů)"
+            )
+
+    # Kód -1 (chybějící hodnota) ukazuje na poslední prvek
+    lookup = np.array(canonical + [None], dtype=object)
+    return pd.Series(lookup[codes], index=series.index, name=series.name).fillna(np.nan)
+
+
+def answer_observed_flags(df, columns, negative_values):
+    # Příznak "odpověď uvedena" pro každý sloupec: vyplněno a není negativní
+    negative_values = set(negative_values)
+    flags = {}
+    for col in columns:
+        codes, uniques = pd.factorize(df[col])
+        normalized = [normalize_text(v) for v in uniques]
+        unique_flags = np.array(
+            [t is not None and t not in negative_values for t in normalized] + [False],
+            dtype=bool,
+        )
+        flags[col] = unique_flags[codes]
+    return pd.DataFrame(flags, index=df.index, columns=list(columns))
@@ -0,0 +1,191 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from macroseismics_geo import project_equal_area
+from macroseismics_isoseismals import MAX_EMS_SORT_VALUE
+
+# --- Detekce hlášení nekonzistentních s okolím ---
+# Každé hlášení se porovná s k nejbližšími sousedy (KD-strom v rovinné
+# projekci kolem epicentra) a s robustním útlumem intenzity se vzdáleností.
+# Vše je vektorizované: jeden dotaz do stromu pro všechna hlášení a operace
+# nad maticí sousedů (n x k), takže i statisíce hlášení trvají sekundy.
+# Podezřelé je hlášení, u kterého se shodnou alespoň dvě ze tří kritérií
+# (jediné kritérium samo o sobě označuje příliš mnoho hlášení).
+OUTLIER_K_NEIGHBOURS = 12
+OUTLIER_MAX_NEIGHBOUR_DISTANCE_KM = 30.0
+OUTLIER_MIN_VALID_NEIGHBOURS = 5
+OUTLIER_EMS_THRESHOLD = 3.0
+OUTLIER_DISTANCE_MAD_FACTOR = 3.0
+OUTLIER_EFFECT_DISAGREEMENT = 0.9
+OUTLIER_MIN_CRITERIA = 2
+
+OUTLIER_REASON_LABELS = ["EMS vs. okolí", "EMS vs. vzdálenost", "projevy vs. okolí"]
+
+
+def _neighbour_values(values, neighbour_idx, self_mask):
+    # Hodnoty sousedů (n x k); chybějící soused (index n) a hlášení samo -> NaN
+    padded = np.append(np.asarray(values, dtype=float), np.nan)
+    neighbour_values = padded[neighbour_idx]
+    neighbour_values[self_mask] = np.nan
+    return neighbour_values
+
+
+def detect_spatial_outliers(
+    df_reports,
+    ems_col,
+    sort_ems_key_func,
+    eq_lat,
+    eq_lon,
+    lat_col="lat",
+    lon_col="lon",
+    flag_cols=(),
+    k_neighbours=OUTLIER_K_NEIGHBOURS,
+    max_neighbour_distance_km=OUTLIER_MAX_NEIGHBOUR_DISTANCE_KM,
+    min_valid_neighbours=OUTLIER_MIN_VALID_NEIGHBOURS,
+    ems_threshold=OUTLIER_EMS_THRESHOLD,
+    distance_mad_factor=OUTLIER_DISTANCE_MAD_FACTOR,
+    effect_disagreement=OUTLIER_EFFECT_DISAGREEMENT,
+    min_criteria=OUTLIER_MIN_CRITERIA,
+    depth_km=10.0,
+):
+    n_reports = len(df_reports)
+    lats = pd.to_numeric(df_reports[lat_col], errors="coerce").to_numpy(dtype=float)
+    lons = pd.to_numeric(df_reports[lon_col], errors="coerce").to_numpy(dtype=float)
+    # Řadicí hodnoty jen pro unikátní stupně; neklasifikované -> NaN
+    ems_codes, ems_uniques = pd.factorize(df_reports[ems_col])
+    unique_sort_vals = np.array(
+        [sort_ems_key_func(level) for level in ems_uniques] + [np.nan], dtype=float
+    )
+    ems = unique_sort_vals[ems_codes]
+    ems[ems > MAX_EMS_SORT_VALUE] = np.nan
+
+    x, y = project_equal_area(lons, lats, eq_lon, eq_lat)
+    epicentral_km = np.hypot(x, y)
+    columns = {
+        "epicentral_distance_km": epicentral_km,
+        "n_neighbours": np.zeros(n_reports, dtype=int),
+        "neighbour_ems_median": np.full(n_reports, np.nan),
+        "ems_neighbour_residual": np.full(n_reports, np.nan),
+        "ems_distance_residual": np.full(n_reports, np.nan),
+        "effect_disagreement": np.full(n_reports, np.nan),
+        "outlier_ems_neighbours": np.zeros(n_reports, dtype=bool),
+        "outlier_ems_distance": np.zeros(n_reports, dtype=bool),
+        "outlier_effects": np.zeros(n_reports, dtype=bool),
+    }
+    valid_xy = np.isfinite(x) & np.isfinite(y)
+    if valid_xy.sum() < 2:
+        result = pd.DataFrame(columns, index=df_reports.index)
+        result["is_outlier"] = False
+        return result
+
+    rows = np.flatnonzero(valid_xy)
+    tree = cKDTree(np.column_stack([x[rows], y[rows]]))
+    k = min(k_neighbours + 1, len(rows))
+    _, neighbour_idx = tree.query(
+        np.column_stack([x[rows], y[rows]]),
+        k=k,
+        distance_upper_bound=max_neighbour_distance_km,
+        workers=-1,
+    )
+    neighbour_idx = neighbour_idx.reshape(len(rows), k)
+    # Hlášení samo se vyřadí podle indexu. Při shodných souřadnicích (hlášení
+    # geokódovaná do středu obce) nemusí být mezi k+1 nalezenými vůbec, pak
+    # se vyřadí nejvzdálenější soused, aby jich zůstalo k.
+    self_mask = neighbour_idx == np.arange(len(rows))[:, None]
+    self_mask[~self_mask.any(axis=1), -1] = True
+    found = (neighbour_idx < len(rows)) & ~self_mask
+
+    # 1) EMS proti mediánu sousedů
+    ems_rows = ems[rows]
+    neighbour_ems = _neighbour_values(ems_rows, neighbour_idx, self_mask)
+    n_valid_neighbour_ems = np.isfinite(neighbour_ems).sum(axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # řádky bez sousedů
+        neighbour_median = np.nanmedian(neighbour_ems, axis=1)
+    neighbour_residual = ems_rows - neighbour_median
+    outlier_neighbours = (n_valid_neighbour_ems >= min_valid_neighbours) & (
+        np.abs(neighbour_residual) >= ems_threshold
+    )
+
+    # 2) EMS proti robustně proloženému útlumu I = a + b*log10(R)
+    hypocentral_km = np.sqrt(epicentral_km[rows] ** 2 + depth_km**2)
+    distance_residual = np.full(len(rows), np.nan)
+    outlier_distance = np.zeros(len(rows), dtype=bool)
+    fit_mask = np.isfinite(ems_rows)
+    if fit_mask.sum() >= 3:
+        log_r = np.log10(hypocentral_km)
+        design = np.column_stack([np.ones(fit_mask.sum()), log_r[fit_mask]])
+        coeffs, *_ = np.linalg.lstsq(design, ems_rows[fit_mask], rcond=None)
+        distance_residual = ems_rows - (coeffs[0] + coeffs[1] * log_r)
+        residuals_fit = distance_residual[fit_mask]
+        mad = 1.4826 * np.median(np.abs(residuals_fit - np.median(residuals_fit)))
+        # Stupně EMS jsou diskrétní a MAD bývá malý, práh tedy nejméně ems_threshold
+        outlier_distance = np.abs(distance_residual) >= max(
+            distance_mad_factor * mad, ems_threshold
+        )
+
+    # 3) Projevy (pohyb předmětů, zvuk) proti podílu u sousedů
+    disagreement = np.full(len(rows), np.nan)
+    for col in flag_cols:
+        if col not in df_reports.columns:
+            continue
+        flags = df_reports[col].to_numpy()[rows].astype(float)
+        neighbour_flags = _neighbour_values(flags, neighbour_idx, self_mask)
+        n_valid_flags = np.isfinite(neighbour_flags).sum(axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            neighbour_share = np.nanmean(neighbour_flags, axis=1)
+        col_disagreement = np.where(
+            n_valid_flags >= min_valid_neighbours,
+            np.abs(flags - neighbour_share),
+            np.nan,
+        )
+        disagreement = np.fmax(disagreement, col_disagreement)
+    outlier_effects = disagreement >= effect_disagreement
+
+    columns["n_neighbours"][rows] = found.sum(axis=1)
+    columns["neighbour_ems_median"][rows] = neighbour_median
+    columns["ems_neighbour_residual"][rows] = neighbour_residual
+    columns["ems_distance_residual"][rows] = distance_residual
+    columns["effect_disagreement"][rows] = disagreement
+    columns["outlier_ems_neighbours"][rows] = outlier_neighbours
+    columns["outlier_ems_distance"][rows] = outlier_distance
+    columns["outlier_effects"][rows] = outlier_effects
+    result = pd.DataFrame(columns, index=df_reports.index)
+    n_criteria = (
+        result["outlier_ems_neighbours"].astype(int)
+        + result["outlier_ems_distance"].astype(int)
+        + result["outlier_effects"].astype(int)
+    )
+    result["is_outlier"] = n_criteria >= min_criteria
+    return result
+
+
+def outlier_reason_text(df_outliers):
+    # Textový popis pro hover: Ano/Ne podle is_outlier, v závorce splněná
+    # kritéria (kombinace tří příznaků -> 8 řetězců)
+    codes = (
+        df_outliers["outlier_ems_neighbours"].to_numpy(dtype=int)
+        + 2 * df_outliers["outlier_ems_distance"].to_numpy(dtype=int)
+        + 4 * df_outliers["outlier_effects"].to_numpy(dtype=int)
+    )
+    reasons = np.array(
+        [
+            ""
+            if code == 0
+            else " ("
+            + ", ".join(
+                label
+                for bit, label in enumerate(OUTLIER_REASON_LABELS)
+                if code & (1 << bit)
+            )
+            + ")"
+            for code in range(8)
+        ],
+        dtype=object,
+    )
+    verdict = np.where(df_outliers["is_outlier"].to_numpy(dtype=bool), "Ano", "Ne")
+    return pd.Series(verdict.astype(object) + reasons[codes], index=df_outliers.index)
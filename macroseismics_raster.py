@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from macroseismics_geo import project_equal_area
+
+# --- Export interpolované intenzity do GeoTIFF ---
+# Síť v zeměpisných souřadnicích (EPSG:4326) kolem epicentra, hodnoty se
+# interpolují metodou IDW z k nejbližších pozorování v rovinné projekci.
+# Soubor se zapisuje po dlaždicích, celá síť tedy nikdy není v paměti.
+RASTER_NODATA = -9999.0
+RASTER_BLOCK_SIZE = 256
+RASTER_OVERVIEW_FACTORS = (2, 4, 8, 16, 32)
+
+
+def aggregate_locality_intensities(lons, lats, values, cell_deg):
+    # Medián intenzity v buňkách cell_deg x cell_deg ("lokalitách")
+    df_cells = pd.DataFrame(
+        {
+            "lon": np.asarray(lons, dtype=float),
+            "lat": np.asarray(lats, dtype=float),
+            "value": np.asarray(values, dtype=float),
+        }
+    ).dropna()
+    df_cells["cell_x"] = np.floor(df_cells["lon"] / cell_deg).astype(np.int64)
+    df_cells["cell_y"] = np.floor(df_cells["lat"] / cell_deg).astype(np.int64)
+    grouped = df_cells.groupby(["cell_x", "cell_y"], sort=False).agg(
+        lon=("lon", "mean"), lat=("lat", "mean"), value=("value", "median")
+    )
+    return (
+        grouped["lon"].to_numpy(),
+        grouped["lat"].to_numpy(),
+        grouped["value"].to_numpy(),
+    )
+
+
+def _idw_block(tree, obs_values, query_x, query_y, k, power, max_distance_km):
+    k = min(k, len(obs_values))
+    # Omezení vzdálenosti prořezává hledání ve stromu, vzdálené buňky jsou levné
+    dist, idx = tree.query(
+        np.column_stack([query_x, query_y]),
+        k=k,
+        distance_upper_bound=max_distance_km,
+        workers=-1,
+    )
+    if k == 1:
+        dist = dist[:, None]
+        idx = idx[:, None]
+    found = np.isfinite(dist)
+    weights = np.where(found, 1.0 / np.maximum(dist, 1e-6) ** power, 0.0)
+    values = obs_values[np.where(found, idx, 0)]
+    weight_sum = weights.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = (weights * values).sum(axis=1) / weight_sum
+    result[weight_sum == 0] = RASTER_NODATA
+    return result
+
+
+def write_intensity_geotiff(
+    output_path,
+    obs_lons,
+    obs_lats,
+    obs_values,
+    center_lon,
+    center_lat,
+    half_width_deg=1.5,
+    cell_size_deg=0.005,
+    k_neighbours=12,
+    idw_power=2.0,
+    max_distance_km=25.0,
+    block_size=RASTER_BLOCK_SIZE,
+    overview_factors=RASTER_OVERVIEW_FACTORS,
+):
+    try:
+        import rasterio
+        from rasterio.enums import Resampling
+        from rasterio.transform import from_origin
+        from rasterio.windows import Window
+    except ImportError:
+        print("INFO: Export rastru přeskočen - chybí knihovna 'rasterio'.")
+        print("      Nainstalujte 'rasterio': pip install rasterio")
+        return None
+
+    obs_lons = np.asarray(obs_lons, dtype=float)
+    obs_lats = np.asarray(obs_lats, dtype=float)
+    obs_values = np.asarray(obs_values, dtype=float)
+    valid = np.isfinite(obs_lons) & np.isfinite(obs_lats) & np.isfinite(obs_values)
+    obs_lons, obs_lats, obs_values = obs_lons[valid], obs_lats[valid], obs_values[valid]
+    if len(obs_values) == 0:
+        print("INFO: Export rastru přeskočen - žádná platná pozorování.")
+        return None
+
+    obs_x, obs_y = project_equal_area(obs_lons, obs_lats, center_lon, center_lat)
+    tree = cKDTree(np.column_stack([obs_x, obs_y]))
+
+    west = center_lon - half_width_deg
+    north = center_lat + half_width_deg
+    n_cells = int(round(2 * half_width_deg / cell_size_deg))
+    width = height = n_cells
+    transform = from_origin(west, north, cell_size_deg, cell_size_deg)
+    profile = {
+        "driver": "GTiff",
+        "width": width,
+        "height": height,
+        "count": 1,
+        "dtype": "float32",
+        "crs": "EPSG:4326",
+        "transform": transform,
+        "nodata": RASTER_NODATA,
+        "tiled": True,
+        "blockxsize": block_size,
+        "blockysize": block_size,
+        "compress": "deflate",
+        "predictor": 3,
+        "BIGTIFF": "IF_SAFER",
+    }
+
+    with rasterio.open(output_path, "w", **profile) as dst:
+        for row_off in range(0, height, block_size):
+            block_h = min(block_size, height - row_off)
+            # Středy buněk v řádcích bloku
+            block_lats = north - (np.arange(row_off, row_off + block_h) + 0.5) * (
+                cell_size_deg
+            )
+            for col_off in range(0, width, block_size):
+                block_w = min(block_size, width - col_off)
+                block_lons = west + (np.arange(col_off, col_off + block_w) + 0.5) * (
+                    cell_size_deg
+                )
+                mesh_lons, mesh_lats = np.meshgrid(block_lons, block_lats)
+                query_x, query_y = project_equal_area(
+                    mesh_lons.ravel(), mesh_lats.ravel(), center_lon, center_lat
+                )
+                block_values = _idw_block(
+                    tree,
+                    obs_values,
+                    query_x,
+                    query_y,
+                    k_neighbours,
+                    idw_power,
+                    max_distance_km,
+                )
+                dst.write(
+                    block_values.reshape(block_h, block_w).astype(np.float32),
+                    1,
+                    window=Window(col_off, row_off, block_w, block_h),
+                )
+        # Interní přehledy (overviews) zhruba do velikosti jednoho bloku
+        factors = [
+            f for f in overview_factors if max(width, height) / f >= block_size / 2
+        ]
+        if factors:
+            dst.build_overviews(factors, Resampling.average)
+            dst.update_tags(ns="rio_overview", resampling="average")
+    return output_path
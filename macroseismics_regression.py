@@ -0,0 +1,526 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from macroseismics_core import (
+    CANONICAL_ANSWERS,
+    COL_DAMAGE_OVERALL,
+    COL_LAT,
+    COL_LON,
+    COL_OBS_DATETIME,
+    COL_TREMOR_TYPE,
+    COLS_OBJECT_MOVEMENT_DETAILS,
+    EMS_COLOR_MAP,
+    REPORT_TIMEZONE,
+    VALIDATION_RULES,
+    classify_ems_intensity,
+    load_report_table,
+    prepare_categories,
+    select_event_window,
+    sort_ems_key,
+)
+from macroseismics_isoseismals import (
+    build_isoseismal_hulls,
+    clear_isoseismal_hull_cache,
+    compute_isoseismal_metrics,
+)
+from macroseismics_normalize import normalize_answers
+from macroseismics_outliers import detect_spatial_outliers
+from macroseismics_validation import validate_reports
+
+# --- Regresní kontrola výstupů a výkonu ---
+# Zpracování se spustí nad zmrazenými výřezy dat (fixtures) a výsledky se
+# porovnají s uloženými "zlatými" výstupy: klasifikace každého hlášení,
+# souhrnné tabulky kategorií a vrcholy izoseismálních obálek. Každá etapa má
+# rozpočet času (perf_counter, běh bez trasování) a špičky paměti
+# (tracemalloc, samostatný druhý běh). Jakákoli odchylka ukončí skript
+# s kódem 1 a vypíše rozdíly.
+#
+# Použití:
+#   python macroseismics_regression.py                  kontrola všech případů
+#   python macroseismics_regression.py --update-golden  přepsání zlatých výstupů
+#   python macroseismics_regression.py --extract-fixture makroseis2025.xlsx
+#                                                       nové zmrazení výřezů
+REGRESSION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regression")
+REGRESSION_CASES = [
+    {
+        "name": "mirotice2025",
+        "fixture": "mirotice2025_okno.xlsx",
+        "golden": "mirotice2025_golden.json",
+        "eq_datetime_utc": "2025-04-24 17:32:47.3",
+        "window_hours": 1.5,
+        "eq_lat": 49.422,
+        "eq_lon": 14.043,
+        # Pevný okamžik kontroly kvality: pravidlo "čas v budoucnosti" jinak
+        # závisí na hodinách stroje a výsledky by se časem samy změnily
+        "validation_now": "2025-06-01 00:00",
+    },
+]
+# Rozpočty etap: sekundy (bez trasování) a špička paměti v MB (tracemalloc).
+# Načítání je dominováno čtením xlsx (~2 s), rozpočet má rezervu pro CI.
+REGRESSION_BUDGETS = {
+    "load": {"seconds": 8.0, "peak_mb": 20.0},
+    "event_window": {"seconds": 0.1, "peak_mb": 5.0},
+    "categories": {"seconds": 0.3, "peak_mb": 5.0},
+    "ems_classification": {"seconds": 0.25, "peak_mb": 5.0},
+    "summaries": {"seconds": 0.1, "peak_mb": 2.0},
+    "isoseismals": {"seconds": 0.2, "peak_mb": 5.0},
+}
+# Pomalejší stroj: rozpočty času lze hromadně násobit (proměnná prostředí)
+REGRESSION_TIME_SCALE = float(
+    os.environ.get("MACROSEISMICS_REGRESSION_TIME_SCALE", "1")
+)
+SUMMARY_COLUMNS = [
+    "EMS_Intensity_Est",
+    "Mist_Pozorovani_Kat_Full",
+    "Pocit_Kategorie_Text_Full",
+    "Intenzita_Kat_Full",
+    "Strach_Pocit_Kat_Text_Full",
+    "Pohyb_Predmetu_Agregovany_Text_Full",
+    "Poskozeni_Obecne_Text_Full",
+    "Zvuk_Reportovan_Text_Full",
+]
+GOLDEN_COORD_DECIMALS = 7
+GOLDEN_FLOAT_TOLERANCE = 1e-6
+MAX_PRINTED_DIFFERENCES = 20
+FIXTURE_MARGIN_HOURS = 1.0  # výřez je o tolik širší než okno události
+# Přibližné přiřazení odpovědí: (sloupec, text, očekávaná kanonická odpověď;
+# None = text zůstane nerozpoznaný). Překlep nesmí převrátit zápor ani sílu.
+NORMALIZATION_CASES = [
+    (COL_DAMAGE_OVERALL, "nebilo", "nebylo"),
+    (COL_DAMAGE_OVERALL, "byloo", "bylo"),
+    (COL_DAMAGE_OVERALL, "ebylo", None),
+    (COL_DAMAGE_OVERALL, "nbylo", None),
+    (COL_TREMOR_TYPE, "slabé zachvení", "slabé zachvění"),
+    (COL_TREMOR_TYPE, "silné zhoupnuti", "silné zhoupnutí"),
+    (COL_TREMOR_TYPE, "silbé zachvění", None),
+    (COL_TREMOR_TYPE, "slné zachvění", None),
+    (COL_TREMOR_TYPE, "s. zachvění", None),
+    (COLS_OBJECT_MOVEMENT_DETAILS[0], "nehybal se", "nehýbal se"),
+    (COLS_OBJECT_MOVEMENT_DETAILS[0], "hýbal se", None),
+    (COLS_OBJECT_MOVEMENT_DETAILS[0], "patrně se kývaly", None),
+]
+# Syntetické pole bez odlehlých hlášení (útlum + šum, hlášení ve středech
+# obcí, tedy se shodnými souřadnicemi): detekce smí označit jen malý podíl
+CLEAN_FIELD_N_REPORTS = 2000
+CLEAN_FIELD_N_LOCALITIES = 300
+CLEAN_FIELD_EMS_NOISE = 0.5
+CLEAN_FIELD_FLAG_NOISE = 0.1
+CLEAN_FIELD_MAX_OUTLIER_RATE = 0.02
+CLEAN_FIELD_SEED = 20250424
+
+
+# --- Etapy zpracování ---
+def _run_stages(case, fixture_path, on_stage):
+    # on_stage(název, funkce) spustí etapu a vrátí její výsledek (měření kolem)
+    df = on_stage(
+        "load", lambda: load_report_table(fixture_path, now=case["validation_now"])
+    )
+    eq_datetime_utc = pd.Timestamp(case["eq_datetime_utc"], tz="UTC")
+    df_event = on_stage(
+        "event_window",
+        lambda: select_event_window(df, eq_datetime_utc, case["window_hours"]),
+    )
+    df_event = on_stage(
+        "categories", lambda: prepare_categories(df_event, verbose=False)
+    )
+    df_event["EMS_Intensity_Est"] = on_stage(
+        "ems_classification", lambda: classify_ems_intensity(df_event)
+    )
+    summaries = on_stage("summaries", lambda: _summary_tables(df_event))
+    hulls, df_metrics = on_stage(
+        "isoseismals", lambda: _isoseismals(df_event, case["eq_lat"], case["eq_lon"])
+    )
+    return {
+        "n_loaded": len(df),
+        "df_event": df_event,
+        "summaries": summaries,
+        "hulls": hulls,
+        "df_metrics": df_metrics,
+    }
+
+
+def _summary_tables(df_event):
+    tables = {}
+    for col in SUMMARY_COLUMNS:
+        if col not in df_event.columns:
+            continue
+        counts = df_event[col].value_counts(dropna=False)
+        tables[col] = {
+            str(category): {
+                "count": int(count),
+                "percent": round(100.0 * count / len(df_event), 6),
+            }
+            for category, count in counts.items()
+        }
+    return tables
+
+
+def _isoseismals(df_event, eq_lat, eq_lon):
+    hulls = build_isoseismal_hulls(
+        df_event,
+        EMS_COLOR_MAP.keys(),
+        sort_ems_key,
+        lat_col=COL_LAT,
+        lon_col=COL_LON,
+        use_cache=False,
+    )
+    return hulls, compute_isoseismal_metrics(hulls, eq_lat, eq_lon)
+
+
+def _timed_run(case, fixture_path):
+    durations = {}
+
+    def on_stage(name, func):
+        started = time.perf_counter()
+        result = func()
+        durations[name] = time.perf_counter() - started
+        return result
+
+    return _run_stages(case, fixture_path, on_stage), durations
+
+
+def _memory_run(case, fixture_path):
+    # Druhý běh jen kvůli paměti (tracemalloc zpomaluje alokace)
+    peaks = {}
+
+    def on_stage(name, func):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = func()
+        peaks[name] = (tracemalloc.get_traced_memory()[1] - baseline) / 1e6
+        return result
+
+    tracemalloc.start()
+    try:
+        _run_stages(case, fixture_path, on_stage)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+# --- Zlaté výstupy ---
+def golden_outputs(results):
+    df_event = results["df_event"].sort_index()
+    label_columns = [c for c in SUMMARY_COLUMNS if c in df_event.columns]
+    labels = df_event[label_columns].astype(object)
+    labels = labels.where(labels.notna(), None)
+    metrics = results["df_metrics"]
+    metric_columns = [c for c in metrics.columns if c != "ems_level"]
+    return {
+        "n_loaded": results["n_loaded"],
+        "n_event": len(df_event),
+        "labels": {
+            "index": [int(i) for i in df_event.index],
+            "columns": {col: labels[col].tolist() for col in label_columns},
+        },
+        "summaries": results["summaries"],
+        "hulls": {
+            hull["level"]: np.round(
+                np.column_stack([hull["lons"], hull["lats"]]), GOLDEN_COORD_DECIMALS
+            ).tolist()
+            for hull in results["hulls"]
+        },
+        "hull_metrics": {
+            row["ems_level"]: {
+                c: None if pd.isna(row[c]) else float(row[c]) for c in metric_columns
+            }
+            for _, row in metrics.iterrows()
+        },
+    }
+
+
+def _values_differ(expected, actual):
+    if isinstance(expected, float) or isinstance(actual, float):
+        if expected is None or actual is None:
+            return expected is not actual
+        return not np.isclose(
+            expected, actual, rtol=GOLDEN_FLOAT_TOLERANCE, atol=GOLDEN_FLOAT_TOLERANCE
+        )
+    return expected != actual
+
+
+def _diff_values(path, expected, actual, differences):
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual), key=str):
+            if key not in actual:
+                differences.append(f"{path}/{key}: chybí (očekáváno {expected[key]!r})")
+            elif key not in expected:
+                differences.append(f"{path}/{key}: navíc ({actual[key]!r})")
+            else:
+                _diff_values(f"{path}/{key}", expected[key], actual[key], differences)
+    elif isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            differences.append(
+                f"{path}: délka {len(actual)}, očekáváno {len(expected)}"
+            )
+        for i, (exp, act) in enumerate(zip(expected, actual)):
+            _diff_values(f"{path}[{i}]", exp, act, differences)
+    elif _values_differ(expected, actual):
+        differences.append(f"{path}: {actual!r}, očekáváno {expected!r}")
+
+
+def diff_golden(expected, actual):
+    # Štítky se porovnávají podle indexu hlášení, ne podle pozice v seznamu
+    differences = []
+    for key in ("n_loaded", "n_event", "summaries", "hulls", "hull_metrics"):
+        _diff_values(key, expected.get(key), actual.get(key), differences)
+    expected_labels = expected.get("labels", {})
+    actual_labels = actual.get("labels", {})
+    expected_rows = dict(
+        zip(
+            expected_labels.get("index", []),
+            zip(*expected_labels.get("columns", {}).values()),
+        )
+    )
+    actual_rows = dict(
+        zip(
+            actual_labels.get("index", []),
+            zip(*actual_labels.get("columns", {}).values()),
+        )
+    )
+    columns = list(actual_labels.get("columns", {}))
+    if list(expected_labels.get("columns", {})) != columns:
+        differences.append(
+            f"labels: sloupce {columns}, "
+            f"očekáváno {list(expected_labels.get('columns', {}))}"
+        )
+    for index in sorted(set(expected_rows) | set(actual_rows)):
+        if index not in actual_rows:
+            differences.append(f"labels[{index}]: hlášení chybí")
+        elif index not in expected_rows:
+            differences.append(f"labels[{index}]: hlášení navíc")
+        else:
+            for col, exp, act in zip(columns, expected_rows[index], actual_rows[index]):
+                if exp != act:
+                    differences.append(
+                        f"labels[{index}]/{col}: {act!r}, očekáváno {exp!r}"
+                    )
+    return differences
+
+
+# --- Zmrazení výřezu dat ---
+def extract_fixture(source_path, case, sheet_name=0):
+    # Surové řádky z okolí okna události + všechna hlášení, která kontrola
+    # kvality vyřadí (aby výřez pokrýval i validaci)
+    df_raw = pd.read_excel(
+        source_path, sheet_name=sheet_name, na_values=["NULL", "null", ""]
+    )
+    validation = validate_reports(df_raw, VALIDATION_RULES, now=case["validation_now"])
+    local_times = pd.to_datetime(
+        df_raw[COL_OBS_DATETIME], dayfirst=True, errors="coerce"
+    )
+    utc_times = local_times.dt.tz_localize(
+        REPORT_TIMEZONE, ambiguous="NaT", nonexistent="NaT"
+    ).dt.tz_convert("UTC")
+    eq_datetime_utc = pd.Timestamp(case["eq_datetime_utc"], tz="UTC")
+    margin = pd.Timedelta(hours=case["window_hours"] + FIXTURE_MARGIN_HOURS)
+    near_event = (utc_times >= eq_datetime_utc - margin) & (
+        utc_times <= eq_datetime_utc + margin
+    )
+    selected = near_event.to_numpy() | validation["rejected"]
+    fixture_path = os.path.join(REGRESSION_DIR, case["fixture"])
+    os.makedirs(REGRESSION_DIR, exist_ok=True)
+    df_raw[selected].to_excel(fixture_path, index=False)
+    print(
+        f"Výřez '{case['name']}': {int(near_event.sum())} hlášení z okolí události "
+        f"a {int(validation['rejected'].sum())} vyřazovaných uloženo do: {fixture_path}"
+    )
+    return fixture_path
+
+
+# --- Kontrola normalizace odpovědí ---
+def check_normalization():
+    print("\n=== Přibližné přiřazení odpovědí ===")
+    failures = []
+    for col, text, expected in NORMALIZATION_CASES:
+        actual = normalize_answers(
+            pd.Series([text], name=col), CANONICAL_ANSWERS[col], verbose=False
+        ).iloc[0]
+        if expected is None:
+            expected = text
+        if actual != expected:
+            print(f"CHYBA: '{text}' ({col}) -> '{actual}', očekáváno '{expected}'")
+            failures.append(f"normalizace '{text}'")
+    if not failures:
+        print(f"Všech {len(NORMALIZATION_CASES)} odpovědí přiřazeno správně.")
+    return failures
+
+
+# --- Kontrola detekce podezřelých hlášení ---
+def clean_report_field(eq_lat, eq_lon, seed=CLEAN_FIELD_SEED):
+    rng = np.random.default_rng(seed)
+    locality_lats = eq_lat + rng.uniform(-0.7, 0.7, CLEAN_FIELD_N_LOCALITIES)
+    locality_lons = eq_lon + rng.uniform(-1.0, 1.0, CLEAN_FIELD_N_LOCALITIES)
+    locality = rng.integers(0, CLEAN_FIELD_N_LOCALITIES, CLEAN_FIELD_N_REPORTS)
+    lats = locality_lats[locality]
+    lons = locality_lons[locality]
+    distance_km = np.hypot(
+        (lats - eq_lat) * 111.2, (lons - eq_lon) * 111.2 * np.cos(np.radians(eq_lat))
+    )
+    ems = 7.0 - 2.5 * np.log10(np.hypot(distance_km, 10.0))
+    ems = np.clip(
+        np.rint(ems + rng.normal(0.0, CLEAN_FIELD_EMS_NOISE, len(ems))), 1, 6
+    ).astype(int)
+    ems_labels = {
+        sort_ems_key(level): level
+        for level in EMS_COLOR_MAP
+        if sort_ems_key(level) <= 12
+    }
+    flip = rng.random(len(ems)) < CLEAN_FIELD_FLAG_NOISE
+    return pd.DataFrame(
+        {
+            COL_LAT: lats,
+            COL_LON: lons,
+            "EMS_Intensity_Est": [ems_labels[value] for value in ems],
+            "Pohyb_Predmetu_Agregovany_Bool": (ems >= 4) ^ flip,
+            "Zvuk_Reportovan_Bool": ems >= 3,
+        }
+    )
+
+
+def check_outlier_rate(case):
+    print("\n=== Podezřelá hlášení v čistém syntetickém poli ===")
+    df_clean = clean_report_field(case["eq_lat"], case["eq_lon"])
+    df_outliers = detect_spatial_outliers(
+        df_clean,
+        "EMS_Intensity_Est",
+        sort_ems_key,
+        case["eq_lat"],
+        case["eq_lon"],
+        lat_col=COL_LAT,
+        lon_col=COL_LON,
+        flag_cols=["Pohyb_Predmetu_Agregovany_Bool", "Zvuk_Reportovan_Bool"],
+    )
+    rate = df_outliers["is_outlier"].mean()
+    print(
+        f"Označeno {int(df_outliers['is_outlier'].sum())} z {len(df_clean)} "
+        f"({100 * rate:.1f} %, nejvýše {100 * CLEAN_FIELD_MAX_OUTLIER_RATE:.0f} %)."
+    )
+    if rate > CLEAN_FIELD_MAX_OUTLIER_RATE:
+        print("CHYBA: Detekce označuje příliš mnoho hlášení v čistém poli.")
+        return ["podíl podezřelých hlášení"]
+    return []
+
+
+# --- Kontrola izolace cache obálek ---
+def check_hull_cache_isolation(case):
+    print("\n=== Cache izoseismálních obálek ===")
+    df_clean = clean_report_field(case["eq_lat"], case["eq_lon"])
+
+    def cached_hulls():
+        return build_isoseismal_hulls(
+            df_clean,
+            EMS_COLOR_MAP.keys(),
+            sort_ems_key,
+            lat_col=COL_LAT,
+            lon_col=COL_LON,
+        )
+
+    clear_isoseismal_hull_cache()
+    first = cached_hulls()
+    expected = [(h["level"], h["lons"].copy(), h["lats"].copy()) for h in first]
+    # Volající upraví vrácené obálky, další volání z cache je nesmí vidět
+    for h in first:
+        h["lons"] += 1.0
+        h["level"] = "upraveno"
+    first.clear()
+    second = cached_hulls()
+    clear_isoseismal_hull_cache()
+    if len(second) != len(expected) or any(
+        h["level"] != level
+        or not np.array_equal(h["lons"], lons)
+        or not np.array_equal(h["lats"], lats)
+        for h, (level, lons, lats) in zip(second, expected)
+    ):
+        print("CHYBA: Úprava vrácených obálek změnila obsah cache.")
+        return ["izolace cache obálek"]
+    print(f"Cache vrací nezměněné kopie obálek (počet: {len(expected)}).")
+    return []
+
+
+# --- Kontrola jednoho případu ---
+def run_case(case, update_golden=False):
+    print(f"\n=== Regresní případ '{case['name']}' ===")
+    fixture_path = os.path.join(REGRESSION_DIR, case["fixture"])
+    golden_path = os.path.join(REGRESSION_DIR, case["golden"])
+    results, durations = _timed_run(case, fixture_path)
+    actual = golden_outputs(results)
+    failures = []
+
+    if update_golden:
+        with open(golden_path, "w", encoding="utf-8") as f:
+            json.dump(actual, f, ensure_ascii=False, indent=1)
+        print(f"Zlaté výstupy přepsány: {golden_path}")
+    else:
+        with open(golden_path, encoding="utf-8") as f:
+            expected = json.load(f)
+        differences = diff_golden(expected, actual)
+        if differences:
+            print(f"CHYBA: {len(differences)} rozdílů proti {golden_path}:")
+            for line in differences[:MAX_PRINTED_DIFFERENCES]:
+                print(f"  {line}")
+            if len(differences) > MAX_PRINTED_DIFFERENCES:
+                print(f"  ... a dalších {len(differences) - MAX_PRINTED_DIFFERENCES}")
+            failures.append("výstupy")
+        else:
+            print(
+                f"Výstupy shodné se zlatými ({actual['n_event']} hlášení, "
+                f"{len(actual['hulls'])} izoseist)."
+            )
+
+    peaks = _memory_run(case, fixture_path)
+    print(
+        f"{'etapa':<20} {'čas [s]':>9} {'rozpočet':>9} {'paměť [MB]':>11} {'rozpočet':>9}"
+    )
+    for name, seconds in durations.items():
+        budget = REGRESSION_BUDGETS.get(name, {})
+        max_seconds = budget.get("seconds", np.inf) * REGRESSION_TIME_SCALE
+        max_peak_mb = budget.get("peak_mb", np.inf)
+        over = []
+        if seconds > max_seconds:
+            over.append("čas")
+        if peaks[name] > max_peak_mb:
+            over.append("paměť")
+        print(
+            f"{name:<20} {seconds:>9.3f} {max_seconds:>9.2f} "
+            f"{peaks[name]:>11.1f} {max_peak_mb:>9.1f}"
+            + (f"  PŘEKROČENO ({', '.join(over)})" if over else "")
+        )
+        if over:
+            failures.append(f"rozpočet {name}")
+    return failures
+
+
+if __name__ == "__main__":
+    if "--extract-fixture" in sys.argv:
+        source_index = sys.argv.index("--extract-fixture") + 1
+        if source_index >= len(sys.argv):
+            sys.exit(
+                "Použití: python macroseismics_regression.py --extract-fixture <tabulka.xlsx>"
+            )
+        for regression_case in REGRESSION_CASES:
+            extract_fixture(sys.argv[source_index], regression_case)
+        sys.exit(0)
+
+    all_failures = (
+        check_normalization()
+        + check_outlier_rate(REGRESSION_CASES[0])
+        + check_hull_cache_isolation(REGRESSION_CASES[0])
+    )
+    for regression_case in REGRESSION_CASES:
+        all_failures += [
+            f"{regression_case['name']}: {failure}"
+            for failure in run_case(
+                regression_case, update_golden="--update-golden" in sys.argv
+            )
+        ]
+    if all_failures:
+        print(f"\nCHYBA: REGRESE - {'; '.join(all_failures)}")
+        sys.exit(1)
+    print("\n--- REGRESNÍ KONTROLA ÚSPĚŠNÁ ---")
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import sys
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from macroseismics_core import (
+    COL_LAT,
+    COL_LON,
+    COL_OBS_DATETIME,
+    EMS_COLOR_MAP,
+    HOVER_DATA_MAIN_MAP_COLS,
+    MAP_CONFIGS,
+    build_bar_figure,
+    build_map_figure,
+    classify_ems_intensity,
+    compact_figure_json,
+    load_report_table,
+    make_event_info,
+    parametric_category_order,
+    prepare_categories,
+    sort_ems_key,
+)
+
+# --- Lokální HTTP služba nad daty v paměti ---
+# Data se načtou, normalizují a klasifikují jednou při startu (klasifikace je
+# po řádcích nezávislá, takže platí pro libovolné okno). Dotazy pak jen vyříznou
+# časové okno přes searchsorted a výsledky jdou do LRU cache. Výpočty běží ve
+# vláknech, event loop tedy souběžné požadavky neblokuje.
+#
+# Endpointy (GET, odpovědi v JSON):
+#   /columns                        dostupné sloupce pro barvu mapy a grafy
+#   /stats?time=...&hours=1.5       počty a procenta kategorií v okně
+#   /map?time=...&color=...         figura mapy (plotly JSON)
+#   /chart?time=...&column=...      figura sloupcového grafu (plotly JSON)
+# Parametr compact=1 u /map a /chart vrací kompaktní JSON: binární pole a
+# customdata v layout.meta (klient ji dekóduje jako COMPACT_FIGURE_POST_SCRIPT).
+# Okno lze zadat i jako start=...&end=... (časy v UTC, ISO formát).
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WINDOW_HOURS = 1.5
+DEFAULT_CACHE_ENTRIES = 128
+DEFAULT_CENTER_LAT = 49.81746
+DEFAULT_CENTER_LON = 15.47490
+DEFAULT_ZOOM = 6.0
+
+STATS_COLUMNS = [
+    "Mist_Pozorovani_Kat_Full",
+    "Pocit_Kategorie_Text_Full",
+    "Intenzita_Kat_Full",
+    "Strach_Pocit_Kat_Text_Full",
+    "Pohyb_Predmetu_Agregovany_Text_Full",
+    "Poskozeni_Obecne_Text_Full",
+    "Zvuk_Reportovan_Text_Full",
+    "EMS_Intensity_Est",
+]
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncLRUCache:
+    # LRU cache výsledků; rozpracovaný výpočet se sdílí mezi souběžnými dotazy
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_compute(self, key, compute_func):
+        future = self._entries.get(key)
+        if future is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return await asyncio.shield(future)
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, compute_func)
+        self._entries[key] = future
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            # Chybné výsledky se necachují
+            if self._entries.get(key) is future:
+                del self._entries[key]
+            raise
+
+
+class MacroseismicDataset:
+    def __init__(self, df_reports):
+        df_sorted = df_reports.sort_values(COL_OBS_DATETIME, kind="stable")
+        self.df = df_sorted.reset_index(drop=True)
+        self._times = self.df[COL_OBS_DATETIME].to_numpy(dtype="datetime64[ns]")
+
+    @classmethod
+    def from_file(cls, data_file_path, sheet_name=0):
+        df = load_report_table(data_file_path, sheet_name)
+        df = prepare_categories(df)
+        df["EMS_Intensity_Est"] = classify_ems_intensity(df)
+        return cls(df)
+
+    def window(self, start_utc, end_utc):
+        start = np.datetime64(start_utc.tz_convert("UTC").tz_localize(None), "ns")
+        end = np.datetime64(end_utc.tz_convert("UTC").tz_localize(None), "ns")
+        i = np.searchsorted(self._times, start, side="left")
+        j = np.searchsorted(self._times, end, side="right")
+        return self.df.iloc[i:j]
+
+
+def _parse_window(params):
+    def _ts(name):
+        try:
+            ts = pd.Timestamp(params[name])
+        except (ValueError, TypeError) as e:
+            raise ServiceError(400, f"Neplatný čas '{name}': {e}")
+        return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+    if "start" in params and "end" in params:
+        return _ts("start"), _ts("end")
+    if "time" in params:
+        center = _ts("time")
+        try:
+            hours = float(params.get("hours", DEFAULT_WINDOW_HOURS))
+        except ValueError:
+            raise ServiceError(400, "Neplatný parametr 'hours'.")
+        delta = pd.Timedelta(hours=hours)
+        return center - delta, center + delta
+    raise ServiceError(400, "Chybí časové okno (time[&hours] nebo start&end).")
+
+
+def _counts_dict(series):
+    counts = series.value_counts()
+    return {str(k): int(v) for k, v in counts.items()}
+
+
+def compute_stats(df_window):
+    n = len(df_window)
+    stats = {"n_reports": n, "categories": {}}
+    for col in STATS_COLUMNS:
+        if col not in df_window.columns:
+            continue
+        counts = _counts_dict(df_window[col])
+        if col == "EMS_Intensity_Est":
+            counts = dict(sorted(counts.items(), key=lambda kv: sort_ems_key(kv[0])))
+        stats["categories"][col] = {
+            "counts": counts,
+            "percent": {k: round(100.0 * v / n, 1) for k, v in counts.items()}
+            if n
+            else {},
+        }
+    return stats
+
+
+def _figure_json(fig, compact):
+    return compact_figure_json(fig) if compact else fig.to_json()
+
+
+def compute_map_json(df_window, color_column, event_info, compact=False):
+    config = next((c for c in MAP_CONFIGS if c[0] == color_column), None)
+    if color_column == "EMS_Intensity_Est":
+        ems_order = sorted(df_window["EMS_Intensity_Est"].unique(), key=sort_ems_key)
+        fig = build_map_figure(
+            df_window,
+            "EMS_Intensity_Est",
+            "Odhad EMS-98 Intenzita",
+            event_info,
+            {"EMS_Intensity_Est": ems_order},
+            EMS_COLOR_MAP,
+            HOVER_DATA_MAIN_MAP_COLS,
+            "EMS_Intensity_Est",
+        )
+    elif config is not None:
+        col_for_color, title, _, cmap, hover_extra, col_for_hover = config
+        cat_order = parametric_category_order(df_window, col_for_color, cmap)
+        fig = build_map_figure(
+            df_window,
+            col_for_color,
+            title,
+            event_info,
+            {col_for_color: cat_order} if cat_order else None,
+            cmap,
+            hover_extra,
+            col_for_hover,
+        )
+    else:
+        raise ServiceError(404, f"Neznámý sloupec pro barvu mapy: '{color_column}'.")
+    if fig is None:
+        raise ServiceError(404, f"Sloupec '{color_column}' v datech chybí.")
+    return _figure_json(fig, compact)
+
+
+def compute_chart_json(df_window, column, compact=False):
+    if column not in STATS_COLUMNS or column not in df_window.columns:
+        raise ServiceError(404, f"Neznámý sloupec pro graf: '{column}'.")
+    counts = df_window[column].value_counts()
+    if column == "EMS_Intensity_Est":
+        counts = counts.reindex(sorted(counts.index, key=sort_ems_key))
+    if counts.empty:
+        raise ServiceError(404, "V okně nejsou žádná pozorování.")
+    fig = build_bar_figure(
+        counts,
+        column,
+        column,
+        show_percentages=True,
+        n_total_observations=len(df_window),
+    )
+    return _figure_json(fig, compact)
+
+
+class MacroseismicService:
+    def __init__(self, dataset, cache_entries=DEFAULT_CACHE_ENTRIES):
+        self.dataset = dataset
+        self.cache = AsyncLRUCache(cache_entries)
+
+    def _event_info(self, params, df_window):
+        def _float(name, default):
+            try:
+                return float(params[name]) if name in params else default
+            except ValueError:
+                raise ServiceError(400, f"Neplatný parametr '{name}'.")
+
+        eq_lat = _float("lat", float(df_window[COL_LAT].median()))
+        eq_lon = _float("lon", float(df_window[COL_LON].median()))
+        return make_event_info(
+            eq_lat,
+            eq_lon,
+            params.get("magnitude", "?"),
+            params.get("id", "-"),
+            params.get("name", "dotaz"),
+            _float("center_lat", DEFAULT_CENTER_LAT),
+            _float("center_lon", DEFAULT_CENTER_LON),
+            _float("zoom", DEFAULT_ZOOM),
+        )
+
+    async def handle(self, path, params):
+        if path == "/columns":
+            return {
+                "map_colors": ["EMS_Intensity_Est"] + [c[0] for c in MAP_CONFIGS],
+                "chart_columns": STATS_COLUMNS,
+            }
+        if path == "/cache":
+            return {
+                "entries": len(self.cache._entries),
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+            }
+        if path not in ("/stats", "/map", "/chart"):
+            raise ServiceError(404, f"Neznámý endpoint '{path}'.")
+
+        start_utc, end_utc = _parse_window(params)
+        df_window = self.dataset.window(start_utc, end_utc)
+        if df_window.empty:
+            raise ServiceError(404, "V okně nejsou žádná pozorování.")
+        key = (path, start_utc, end_utc, tuple(sorted(params.items())))
+        compact = params.get("compact", "0") not in ("0", "false", "")
+        if path == "/stats":
+            return await self.cache.get_or_compute(
+                key, lambda: compute_stats(df_window)
+            )
+        if path == "/map":
+            event_info = self._event_info(params, df_window)
+            color = params.get("color", "EMS_Intensity_Est")
+            fig_json = await self.cache.get_or_compute(
+                key, lambda: compute_map_json(df_window, color, event_info, compact)
+            )
+            return fig_json
+        column = params.get("column", "EMS_Intensity_Est")
+        return await self.cache.get_or_compute(
+            key, lambda: compute_chart_json(df_window, column, compact)
+        )
+
+    async def handle_connection(self, reader, writer):
+        status, body = 200, b""
+        started = time.perf_counter()
+        request_line = ""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # hlavičky nepotřebujeme
+            parts = request_line.split()
+            if len(parts) < 2 or parts[0] != "GET":
+                raise ServiceError(405, "Podporována je pouze metoda GET.")
+            url = urlsplit(parts[1])
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            result = await self.handle(url.path, params)
+            # Figury se vrací jako hotový JSON řetězec, ostatní se serializuje
+            body = (result if isinstance(result, str) else json.dumps(result)).encode(
+                "utf-8"
+            )
+        except ServiceError as e:
+            status = e.status
+            body = json.dumps({"error": str(e)}).encode("utf-8")
+        except Exception as e:
+            status = 500
+            body = json.dumps({"error": f"Interní chyba: {e}"}).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "Error")
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {reason}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        print(
+            f"{request_line} -> {status} "
+            f"({(time.perf_counter() - started) * 1000:.1f} ms)"
+        )
+
+
+async def serve(
+    data_file_path,
+    host=DEFAULT_HOST,
+    port=DEFAULT_PORT,
+    cache_entries=DEFAULT_CACHE_ENTRIES,
+):
+    dataset = MacroseismicDataset.from_file(data_file_path)
+    service = MacroseismicService(dataset, cache_entries)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Služba běží na http://{host}:{port} ({len(dataset.df)} hlášení v paměti)")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    # Použití: python macroseismics_service.py [tabulka.xlsx] [port]
+    service_data_file = sys.argv[1] if len(sys.argv) > 1 else "makroseis2025.xlsx"
+    service_port = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PORT
+    asyncio.run(serve(service_data_file, port=service_port))
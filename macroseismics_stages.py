@@ -0,0 +1,202 @@
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+# --- Plánovač etap výpočtu (DAG) ---
+# Každá etapa deklaruje vstupy (názvy výsledků jiných etap) a výstupy.
+# Plánovač spouští všechny etapy, jejichž vstupy jsou hotové, souběžně na
+# poolu vláken nebo procesů. Callback on_result dostává výsledky v hlavním
+# vlákně hned po dokončení etapy. Výpisy etapy (print) se během běhu ukládají
+# do bufferu a vypíší se najednou po jejím dokončení, výstupy souběžných
+# etap se tak neprolínají.
+
+
+def fork_process_pool(max_workers, single_process_message):
+    # Pool procesů pro paralelní práci uvnitř etapy, nebo None (práce poběží
+    # v jednom procesu). Pouze 'fork' - jiné metody by znovu spustily celý
+    # hlavní skript. Fork vícevláknového procesu (etapy ve vláknech) může
+    # v potomkovi uváznout na zámku drženém jiným vláknem (logging, stdout,
+    # BLAS), proto se pak pool nevytváří.
+    if threading.active_count() > 1:
+        print(f"INFO: V procesu běží další vlákna, {single_process_message}.")
+        return None
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print(f"INFO: Start metoda 'fork' není dostupná, {single_process_message}.")
+        return None
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("fork")
+    )
+
+
+class _StageOutput:
+    # Náhrada sys.stdout: vlákno s aktivním bufferem (běžící etapa) zapisuje
+    # do něj, ostatní vlákna přímo do původního proudu
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        # Bez deklarace má etapa jeden výstup pojmenovaný jako etapa sama
+        self.outputs = tuple(outputs) if outputs else (name,)
+
+    def run(self, input_values):
+        result = self.func(**input_values)
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+        if not isinstance(result, dict) or set(result) != set(self.outputs):
+            raise ValueError(
+                f"Etapa '{self.name}' musí vrátit slovník s klíči {self.outputs}."
+            )
+        return result
+
+
+def _take_stage_log(output):
+    if output is None:
+        return ""
+    log = "".join(output.local.buffer)
+    output.local.buffer = None
+    return log
+
+
+def _run_stage(stage, input_values):
+    # Vrací výstupy, dobu běhu a výpis etapy; výpis selhané etapy nese výjimka
+    output = sys.stdout if isinstance(sys.stdout, _StageOutput) else None
+    if output is not None:
+        output.local.buffer = []
+    started = time.perf_counter()
+    try:
+        outputs = stage.run(input_values)
+    except Exception as e:
+        e.stage_log = _take_stage_log(output)
+        raise
+    return outputs, time.perf_counter() - started, _take_stage_log(output)
+
+
+class StageScheduler:
+    def __init__(self, stages, executor_kind="thread", max_workers=None):
+        self.stages = {}
+        self.producers = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicitní název etapy '{stage.name}'.")
+            self.stages[stage.name] = stage
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"Výstup '{output}' produkuje více etap.")
+                self.producers[output] = stage.name
+        self.executor_kind = executor_kind
+        self.max_workers = max_workers
+        self.stage_durations = {}
+        self.failed_stages = {}
+        self.skipped_stages = []
+        self._check_acyclic()
+
+    def _dependencies(self, stage):
+        return {self.producers[i] for i in stage.inputs if i in self.producers}
+
+    def _check_acyclic(self):
+        # Kahnův algoritmus; zbylé etapy tvoří cyklus
+        remaining = {name: self._dependencies(s) for name, s in self.stages.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Etapy tvoří cyklus: {sorted(remaining)}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def _make_executor(self):
+        if self.executor_kind == "process":
+            # Pouze 'fork' - jiné metody by znovu spustily celý hlavní skript
+            if "fork" in multiprocessing.get_all_start_methods():
+                return ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                )
+            print("INFO: Start metoda 'fork' není dostupná, etapy poběží ve vláknech.")
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def run(self, initial_results=None, on_result=None):
+        results = dict(initial_results or {})
+        missing = {
+            i
+            for s in self.stages.values()
+            for i in s.inputs
+            if i not in self.producers and i not in results
+        }
+        if missing:
+            raise ValueError(f"Chybí vstupy bez producenta: {sorted(missing)}")
+
+        pending = dict(self.stages)
+        running = {}
+        original_stdout = sys.stdout
+        sys.stdout = _StageOutput(original_stdout)
+        try:
+            self._run_pending(pending, running, results, on_result)
+        finally:
+            sys.stdout = original_stdout
+        return results
+
+    def _run_pending(self, pending, running, results, on_result):
+        with self._make_executor() as executor:
+            while pending or running:
+                for name in list(pending):
+                    stage = pending[name]
+                    deps = self._dependencies(stage)
+                    if deps & (set(self.failed_stages) | set(self.skipped_stages)):
+                        print(
+                            f"INFO: Etapa '{name}' přeskočena (selhala etapa, "
+                            "na které závisí)."
+                        )
+                        self.skipped_stages.append(name)
+                        del pending[name]
+                        continue
+                    if all(i in results for i in stage.inputs):
+                        input_values = {i: results[i] for i in stage.inputs}
+                        future = executor.submit(_run_stage, stage, input_values)
+                        running[future] = name
+                        del pending[name]
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        outputs, duration, log = future.result()
+                    except Exception as e:
+                        sys.stdout.write(getattr(e, "stage_log", ""))
+                        print(f"CHYBA v etapě '{name}': {e}")
+                        self.failed_stages[name] = e
+                        continue
+                    sys.stdout.write(log)
+                    self.stage_durations[name] = duration
+                    results.update(outputs)
+                    if on_result:
+                        on_result(name, outputs)
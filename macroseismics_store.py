@@ -0,0 +1,319 @@
+import json
+import sqlite3
+from datetime import UTC, datetime
+
+import numpy as np
+import pandas as pd
+
+from macroseismics_geo import EARTH_RADIUS_KM, haversine_km
+from macroseismics_isoseismals import MAX_EMS_SORT_VALUE
+
+# --- Trvalé úložiště výsledků napříč událostmi (SQLite) ---
+# Každý běh zapíše metadata události, klasifikovaná hlášení, rozdělení
+# kategorií a metriky izoseist do jednoho souboru SQLite. Opakovaný běh
+# stejné události (EQ_GFU_ID) její řádky nahradí, jiný čas nebo poloha
+# počátku pod stejným ID vyvolá chybu. Vkládá se hromadně
+# (executemany) v jedné transakci, tabulky jsou indexované podle události,
+# času a polohy. Dotazy (události v okruhu, data intenzita-vzdálenost)
+# pracují jen s databází, sešity s hlášeními se znovu nezpracovávají.
+RESULTS_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    event_id INTEGER PRIMARY KEY,
+    location_name TEXT,
+    origin_time_utc TEXT,
+    lat REAL,
+    lon REAL,
+    magnitude REAL,
+    n_reports INTEGER,
+    processed_utc TEXT
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (origin_time_utc);
+CREATE INDEX IF NOT EXISTS events_location ON events (lat, lon);
+CREATE TABLE IF NOT EXISTS reports (
+    event_id INTEGER,
+    report_time_utc TEXT,
+    lat REAL,
+    lon REAL,
+    epicentral_distance_km REAL,
+    ems_label TEXT,
+    ems_value INTEGER,
+    categories TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_event ON reports (event_id, ems_value);
+CREATE INDEX IF NOT EXISTS reports_time ON reports (report_time_utc);
+CREATE INDEX IF NOT EXISTS reports_location ON reports (lat, lon);
+CREATE TABLE IF NOT EXISTS distributions (
+    event_id INTEGER,
+    column_name TEXT,
+    category TEXT,
+    count INTEGER,
+    percent REAL
+);
+CREATE INDEX IF NOT EXISTS distributions_event ON distributions (event_id, column_name);
+CREATE TABLE IF NOT EXISTS hull_metrics (
+    event_id INTEGER,
+    ems_level TEXT,
+    ems_value INTEGER,
+    n_points INTEGER,
+    area_km2 REAL,
+    equivalent_radius_km REAL,
+    centroid_offset_km REAL,
+    centroid_azimuth_deg REAL,
+    major_axis_azimuth_deg REAL,
+    elongation REAL
+);
+CREATE INDEX IF NOT EXISTS hull_metrics_event ON hull_metrics (event_id);
+"""
+_EVENT_TABLES = ("events", "reports", "distributions", "hull_metrics")
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Opakovaný zápis stejného ID musí mít (téměř) stejný počátek, jinak jde
+# o kolizi ID dvou různých událostí a zápis se odmítne
+ORIGIN_MATCH_SECONDS = 60.0
+ORIGIN_MATCH_KM = 10.0
+
+
+def open_results_store(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(RESULTS_STORE_SCHEMA)
+    return connection
+
+
+def _utc_text(times):
+    # Časy jako text UTC (řadí se lexikograficky), NaT -> None
+    times = pd.to_datetime(pd.Series(times))
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert("UTC")
+    text = times.dt.strftime(_TIME_FORMAT).astype(object)
+    return text.where(times.notna(), None).tolist()
+
+
+def _check_same_origin(connection, event_id, origin_text, lat, lon):
+    stored = connection.execute(
+        "SELECT origin_time_utc, lat, lon, location_name FROM events "
+        "WHERE event_id = ?",
+        (event_id,),
+    ).fetchone()
+    if stored is None:
+        return
+    stored_time, stored_lat, stored_lon, stored_name = stored
+    time_shift = abs(
+        (pd.Timestamp(origin_text) - pd.Timestamp(stored_time)).total_seconds()
+    )
+    distance = float(haversine_km(lon, lat, stored_lon, stored_lat))
+    if time_shift > ORIGIN_MATCH_SECONDS or distance > ORIGIN_MATCH_KM:
+        raise ValueError(
+            f"Událost {event_id} už je v databázi s jiným počátkem "
+            f"({stored_name}, {stored_time} UTC, {stored_lat:.3f} N, "
+            f"{stored_lon:.3f} E; nyní {origin_text} UTC, {lat:.3f} N, "
+            f"{lon:.3f} E). Zápis odmítnut."
+        )
+
+
+def _nullable(values):
+    # Pole float -> seznam pro SQLite, NaN -> NULL
+    values = np.asarray(values, dtype=float)
+    cells = values.astype(object)
+    cells[~np.isfinite(values)] = None
+    return cells.tolist()
+
+
+def _ems_values(labels, sort_ems_key_func):
+    codes, uniques = pd.factorize(pd.Series(labels))
+    unique_values = [sort_ems_key_func(level) for level in uniques]
+    lookup = np.array(
+        [v if v <= MAX_EMS_SORT_VALUE else None for v in unique_values] + [None],
+        dtype=object,
+    )
+    return lookup[codes].tolist()
+
+
+def store_event_results(
+    db_path,
+    event_info,
+    origin_time_utc,
+    df_reports,
+    ems_col,
+    sort_ems_key_func,
+    category_columns=(),
+    distributions=None,
+    df_hull_metrics=None,
+    time_col="eqdatetime",
+    lat_col="lat",
+    lon_col="lon",
+):
+    # distributions: {sloupec: Series počtů}; vše jedné události v jedné transakci
+    event_id = int(event_info["gfu_id"])
+    n_reports = len(df_reports)
+    lats = pd.to_numeric(df_reports[lat_col], errors="coerce").to_numpy(dtype=float)
+    lons = pd.to_numeric(df_reports[lon_col], errors="coerce").to_numpy(dtype=float)
+    distances = haversine_km(lons, lats, event_info["lon"], event_info["lat"])
+
+    # Kategorie hlášení jako JSON (dotazovatelné přes json_extract)
+    category_columns = [c for c in category_columns if c in df_reports.columns]
+    category_values = [
+        df_reports[c].astype(object).where(df_reports[c].notna(), None).tolist()
+        for c in category_columns
+    ]
+    categories_json = [
+        json.dumps(dict(zip(category_columns, row)), ensure_ascii=False)
+        for row in zip(*category_values)
+    ] or [None] * n_reports
+
+    report_rows = list(
+        zip(
+            [event_id] * n_reports,
+            _utc_text(df_reports[time_col]),
+            _nullable(lats),
+            _nullable(lons),
+            _nullable(distances),
+            df_reports[ems_col]
+            .astype(object)
+            .where(df_reports[ems_col].notna(), None)
+            .tolist(),
+            _ems_values(df_reports[ems_col], sort_ems_key_func),
+            categories_json,
+        )
+    )
+    distribution_rows = []
+    for col, counts in (distributions or {}).items():
+        for category, count in counts.items():
+            distribution_rows.append(
+                (
+                    event_id,
+                    col,
+                    str(category),
+                    int(count),
+                    100.0 * count / n_reports if n_reports else None,
+                )
+            )
+    hull_rows = []
+    if df_hull_metrics is not None and not df_hull_metrics.empty:
+        hull_rows = list(
+            zip(
+                [event_id] * len(df_hull_metrics),
+                df_hull_metrics["ems_level"].astype(str),
+                _ems_values(df_hull_metrics["ems_level"], sort_ems_key_func),
+                df_hull_metrics["n_points"].astype(int).tolist(),
+                *[
+                    _nullable(df_hull_metrics[c])
+                    for c in (
+                        "area_km2",
+                        "equivalent_radius_km",
+                        "centroid_offset_km",
+                        "centroid_azimuth_deg",
+                        "major_axis_azimuth_deg",
+                        "elongation",
+                    )
+                ],
+            )
+        )
+
+    origin_text = _utc_text([origin_time_utc])[0]
+    connection = open_results_store(db_path)
+    try:
+        with connection:
+            _check_same_origin(
+                connection,
+                event_id,
+                origin_text,
+                float(event_info["lat"]),
+                float(event_info["lon"]),
+            )
+            for table in _EVENT_TABLES:
+                connection.execute(
+                    f"DELETE FROM {table} WHERE event_id = ?", (event_id,)
+                )
+            connection.execute(
+                "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    event_id,
+                    event_info.get("location_name"),
+                    origin_text,
+                    float(event_info["lat"]),
+                    float(event_info["lon"]),
+                    None
+                    if event_info.get("magnitude") is None
+                    else float(event_info["magnitude"]),
+                    n_reports,
+                    datetime.now(UTC).strftime(_TIME_FORMAT),
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?)", report_rows
+            )
+            connection.executemany(
+                "INSERT INTO distributions VALUES (?, ?, ?, ?, ?)", distribution_rows
+            )
+            connection.executemany(
+                "INSERT INTO hull_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                hull_rows,
+            )
+    finally:
+        connection.close()
+    return {
+        "event_id": event_id,
+        "n_reports": len(report_rows),
+        "n_distribution_rows": len(distribution_rows),
+        "n_hull_rows": len(hull_rows),
+    }
+
+
+# --- Dotazy nad úložištěm ---
+def _bounding_box(lat, lon, radius_km):
+    # Obdélník v zeměpisných souřadnicích obsahující celý kruh (pro index)
+    d_lat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = np.cos(np.radians(lat))
+    d_lon = 180.0 if cos_lat < 1e-6 else min(d_lat / cos_lat, 180.0)
+    return lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon
+
+
+def events_within_km(db_path, lat, lon, radius_km):
+    # Index (lat, lon) vybere kandidáty v obdélníku, přesně se filtruje haversinem
+    lat_min, lat_max, lon_min, lon_max = _bounding_box(lat, lon, radius_km)
+    connection = open_results_store(db_path)
+    try:
+        df_events = pd.read_sql_query(
+            "SELECT * FROM events WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?",
+            connection,
+            params=(lat_min, lat_max, lon_min, lon_max),
+        )
+    finally:
+        connection.close()
+    df_events["distance_km"] = haversine_km(
+        df_events["lon"], df_events["lat"], lon, lat
+    )
+    return (
+        df_events[df_events["distance_km"] <= radius_km]
+        .sort_values("distance_km")
+        .reset_index(drop=True)
+    )
+
+
+def pooled_intensity_distance(
+    db_path, event_ids=None, min_magnitude=None, max_distance_km=None
+):
+    # Dvojice (stupeň EMS, epicentrální vzdálenost) klasifikovaných hlášení
+    # všech vybraných událostí, doplněné o magnitudu události
+    query = (
+        "SELECT r.event_id, e.location_name, e.magnitude, "
+        "r.epicentral_distance_km, r.ems_value, r.ems_label "
+        "FROM reports r JOIN events e ON e.event_id = r.event_id "
+        "WHERE r.ems_value IS NOT NULL"
+    )
+    params = []
+    if event_ids is not None:
+        event_ids = [int(e) for e in event_ids]
+        query += f" AND r.event_id IN ({', '.join('?' * len(event_ids))})"
+        params += event_ids
+    if min_magnitude is not None:
+        query += " AND e.magnitude >= ?"
+        params.append(min_magnitude)
+    if max_distance_km is not None:
+        query += " AND r.epicentral_distance_km <= ?"
+        params.append(max_distance_km)
+    connection = open_results_store(db_path)
+    try:
+        return pd.read_sql_query(query, connection, params=params)
+    finally:
+        connection.close()
@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from macroseismics_isoseismals import build_isoseismal_hulls, compute_isoseismal_metrics
+
+# --- Citlivost výsledků na šířku časového okna ---
+# Hlášení se jednou seřadí podle absolutní časové odchylky od události. Okno
+# +/- w hodin je pak prefix tohoto pořadí (hranice přes searchsorted) a počty
+# kategorií v okně se čtou z kumulativních součtů indikátorů kategorií, takže
+# všechny šířky okna se spočítají v jednom průchodu daty.
+# Okna jsou vnořená, změna rozdělení proti předchozímu oknu (tvd_) je proto
+# vždy malá. Sloupec tvd_pridanych_ porovnává jen hlášení přidaná rozšířením
+# okna s rozdělením v předchozím okně (nezávisle na jejich počtu).
+# Rozdělení je ustálené od nejmenšího okna, po kterém už každé rozšíření
+# přidává hlášení s tvd_pridanych_ pod STABLE_ADDED_TVD_THRESHOLD. Rozšíření
+# s méně než STABLE_MIN_ADDED_REPORTS hlášeními se nehodnotí, TVD takto
+# malého vzorku je dána hlavně náhodou (4 hlášení dávají TVD po 0.25).
+DEFAULT_SWEEP_WINDOW_HOURS = (0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 6.0, 12.0)
+STABLE_ADDED_TVD_THRESHOLD = 0.25
+STABLE_MIN_ADDED_REPORTS = 10
+
+
+def _cumulative_category_counts(values):
+    # Kumulativní počty kategorií: řádek i = počty v prvních i hlášeních
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    cumulative = np.zeros((len(codes) + 1, len(uniques)), dtype=np.int64)
+    if len(codes):
+        one_hot = np.zeros((len(codes), len(uniques)), dtype=np.int64)
+        one_hot[np.arange(len(codes)), codes] = 1
+        np.cumsum(one_hot, axis=0, out=cumulative[1:])
+    return cumulative, [str(u) for u in uniques]
+
+
+def time_window_sweep(
+    df_reports,
+    eq_datetime_utc,
+    category_columns,
+    time_col,
+    window_hours=DEFAULT_SWEEP_WINDOW_HOURS,
+    ems_levels=None,
+    sort_ems_key_func=None,
+    eq_lat=None,
+    eq_lon=None,
+    lat_col="lat",
+    lon_col="lon",
+):
+    # Vrací (tabulka rozdělení v dlouhém formátu, souhrn po šířkách okna)
+    window_hours = sorted(float(w) for w in window_hours)
+    offsets_s = np.abs(
+        (df_reports[time_col] - eq_datetime_utc).dt.total_seconds().to_numpy()
+    )
+    order = np.argsort(offsets_s, kind="stable")
+    sorted_offsets_s = offsets_s[order]
+    window_ends = np.searchsorted(
+        sorted_offsets_s, np.asarray(window_hours) * 3600.0, side="right"
+    )
+
+    distribution_rows = []
+    summary = pd.DataFrame(
+        {
+            "window_hours": window_hours,
+            "n_reports": window_ends,
+            "n_added": np.diff(window_ends, prepend=0),
+        }
+    )
+    for col in category_columns:
+        if col not in df_reports.columns:
+            continue
+        cumulative, categories = _cumulative_category_counts(
+            df_reports[col].to_numpy()[order]
+        )
+        window_counts = cumulative[window_ends]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            window_shares = window_counts / window_ends[:, None]
+        for i, hours in enumerate(window_hours):
+            for j, category in enumerate(categories):
+                distribution_rows.append(
+                    {
+                        "window_hours": hours,
+                        "column": col,
+                        "category": category,
+                        "count": int(window_counts[i, j]),
+                        "percent": 100.0 * window_shares[i, j],
+                    }
+                )
+        # Změna rozdělení proti předchozí šířce okna (total variation distance)
+        tvd = np.full(len(window_hours), np.nan)
+        tvd[1:] = 0.5 * np.abs(np.diff(window_shares, axis=0)).sum(axis=1)
+        summary[f"tvd_{col}"] = tvd
+        # Přidaná hlášení proti předchozímu oknu: změna podílů je
+        # (přidané / všechna) * (podíly přidaných - podíly předchozího okna)
+        added_shares = np.full(len(window_hours), np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            added_shares[1:] = np.diff(window_ends) / window_ends[1:]
+            summary[f"tvd_pridanych_{col}"] = np.where(
+                added_shares > 0, tvd / added_shares, np.nan
+            )
+
+    if ems_levels is not None:
+        # Plocha pocítění (obálka nejnižšího stupně) pro každou šířku okna
+        df_sorted = df_reports.iloc[order]
+        felt_areas = []
+        for n_window in window_ends:
+            hulls = build_isoseismal_hulls(
+                df_sorted.iloc[:n_window],
+                ems_levels,
+                sort_ems_key_func,
+                lat_col=lat_col,
+                lon_col=lon_col,
+                use_cache=False,
+            )
+            metrics = compute_isoseismal_metrics(hulls, eq_lat, eq_lon)
+            felt_areas.append(
+                metrics["area_km2"].max() if not metrics.empty else np.nan
+            )
+        summary["felt_area_km2"] = felt_areas
+
+    return pd.DataFrame(distribution_rows), summary
+
+
+def stable_window_hours(
+    summary,
+    column,
+    threshold=STABLE_ADDED_TVD_THRESHOLD,
+    min_added=STABLE_MIN_ADDED_REPORTS,
+):
+    # Nejmenší šířka okna, po které už přidaná hlášení nemění rozdělení
+    # (tvd_pridanych_ pod threshold), None pokud se rozdělení neustálilo
+    tvd_added = summary[f"tvd_pridanych_{column}"].to_numpy()
+    evaluated = summary["n_added"].to_numpy() >= min_added
+    exceeds = evaluated & ~(tvd_added < threshold)
+    exceeds[0] = False
+    hours = summary["window_hours"].to_numpy()
+    for i in range(1, len(hours)):
+        if not exceeds[i:].any():
+            return float(hours[i - 1])
+    return None
+
+
+def mark_stable_windows(summary, column, **kwargs):
+    # Sloupec stabilni_<column>: okno leží v ustálené části
+    stable_hours = stable_window_hours(summary, column, **kwargs)
+    summary[f"stabilni_{column}"] = (
+        summary["window_hours"] >= stable_hours if stable_hours is not None else False
+    )
+    return stable_hours
+
+
+def build_sweep_figure(
+    df_distribution,
+    summary,
+    column,
+    category_order=None,
+    color_map=None,
+    stable_hours=None,
+    threshold=STABLE_ADDED_TVD_THRESHOLD,
+):
+    df_col = df_distribution[df_distribution["column"] == column]
+    if df_col.empty:
+        return None
+    fig = make_subplots(
+        rows=3,
+        cols=1,
+        shared_xaxes=True,
+        row_heights=[0.6, 0.2, 0.2],
+        vertical_spacing=0.05,
+    )
+    categories = category_order or sorted(df_col["category"].unique())
+    for category in categories:
+        df_cat = df_col[df_col["category"] == category]
+        if df_cat.empty:
+            continue
+        fig.add_trace(
+            go.Scatter(
+                x=df_cat["window_hours"],
+                y=df_cat["percent"],
+                mode="lines+markers",
+                name=category,
+                line=dict(color=(color_map or {}).get(category)),
+                customdata=df_cat["count"],
+                hovertemplate="+/- %{x} h: %{y:.1f}% (%{customdata})",
+            ),
+            row=1,
+            col=1,
+        )
+    tvd_added_col = f"tvd_pridanych_{column}"
+    if tvd_added_col in summary.columns:
+        fig.add_trace(
+            go.Scatter(
+                x=summary["window_hours"],
+                y=summary[tvd_added_col],
+                mode="lines+markers",
+                name="TVD přidaných",
+                line=dict(color="black"),
+                customdata=summary["n_added"],
+                hovertemplate="+/- %{x} h: %{y:.3f} (přidáno %{customdata})",
+                showlegend=False,
+            ),
+            row=2,
+            col=1,
+        )
+        fig.add_hline(y=threshold, line_dash="dash", line_color="grey", row=2, col=1)
+    fig.add_trace(
+        go.Bar(
+            x=summary["window_hours"],
+            y=summary["n_reports"],
+            name="Počet hlášení",
+            marker_color="lightgrey",
+            showlegend=False,
+        ),
+        row=3,
+        col=1,
+    )
+    if stable_hours is not None:
+        # Svislá čára přes všechny řádky (tvary berou na log ose přímo hodiny)
+        fig.add_vline(x=stable_hours, line_dash="dot", line_color="green")
+        title_suffix = f" - ustáleno od +/- {stable_hours:g} h"
+    else:
+        title_suffix = " - v testovaných oknech se neustálilo"
+    fig.update_xaxes(type="log", title_text="Polovina šířky okna (h)", row=3, col=1)
+    fig.update_yaxes(title_text="Podíl (%)", row=1, col=1)
+    fig.update_yaxes(title_text="TVD přidaných", row=2, col=1)
+    fig.update_yaxes(title_text="Hlášení", row=3, col=1)
+    fig.update_layout(
+        title=f"Citlivost rozdělení '{column}' na šířku časového okna{title_suffix}"
+    )
+    return fig
@@ -0,0 +1,456 @@
+import gzip
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from macroseismics_isoseismals import MAX_EMS_SORT_VALUE
+from macroseismics_stages import fork_process_pool
+
+# --- Export do vektorových dlaždic (Mapbox Vector Tiles) ---
+# Hlášení a izoseismální oblasti se rozřežou do dlaždic z/x/y ve Web Mercatoru
+# pro rozsah přiblížení. Body se na každé úrovni přiřadí dlaždicím a pixelům
+# vektorově (jedno řazení klíčů); hlášení ve stejné buňce cluster_px x
+# cluster_px pixelů dlaždice se sloučí do jednoho prvku s počtem "n", takže
+# velikost dlaždice nezávisí na hustotě dat. Kódování dlaždic běží paralelně
+# v procesech (fork), jen pokud v procesu neběží jiná vlákna - v pipeline tedy
+# s etapami v procesech (STAGE_EXECUTOR = "process"), ne ve vláknech.
+# Výstupem je adresář z/x/y.pbf s jednoduchým prohlížečem (index.html),
+# nebo soubor MBTiles.
+TILE_EXTENT = 4096
+TILE_POLYGON_BUFFER_PX = 64
+TILE_CLUSTER_PX = 16  # 1/256 šířky dlaždice, při vykreslení pod jeden pixel
+TILE_MAX_ZOOM_LIMIT = 14  # klíč dlaždice a pixelu se vejde do int64
+TILE_POINTS_LAYER = "hlaseni"
+TILE_HULLS_LAYER = "izoseisty"
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def lonlat_to_unit_mercator(lons, lats):
+    # Web Mercator normalizovaný na [0, 1], osa y směřuje dolů (jako dlaždice)
+    lons = np.asarray(lons, dtype=float)
+    lats = np.clip(np.asarray(lats, dtype=float), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    u = (lons + 180.0) / 360.0
+    v = 0.5 - np.log(np.tan(np.pi / 4.0 + np.radians(lats) / 2.0)) / (2.0 * np.pi)
+    return u, v
+
+
+def _encode_tile(task):
+    # Jedna dlaždice: body jsou už v pixelech dlaždice, polygony se ořežou zde
+    import mapbox_vector_tile
+    from shapely.affinity import affine_transform
+    from shapely.geometry import Point, Polygon, box
+
+    z, x, y, points, hulls, extent = task
+    layers = []
+    if points is not None:
+        px, py, properties = points
+        features = []
+        for i in range(len(px)):
+            features.append(
+                {
+                    "geometry": Point(int(px[i]), int(py[i])),
+                    "properties": {
+                        key: values[i] for key, values in properties.items()
+                    },
+                }
+            )
+        layers.append({"name": TILE_POINTS_LAYER, "features": features})
+
+    if hulls:
+        scale = 2**z
+        buffer = TILE_POLYGON_BUFFER_PX / extent
+        tile_box = box(
+            (x - buffer) / scale,
+            (y - buffer) / scale,
+            (x + 1 + buffer) / scale,
+            (y + 1 + buffer) / scale,
+        )
+        # Jednotkový Mercator -> pixely dlaždice
+        to_tile_px = [scale * extent, 0, 0, scale * extent, -x * extent, -y * extent]
+        features = []
+        for hull_u, hull_v, properties in hulls:
+            polygon = Polygon(np.column_stack([hull_u, hull_v]))
+            if not polygon.is_valid:
+                polygon = polygon.buffer(0)
+            clipped = polygon.intersection(tile_box)
+            if clipped.is_empty or clipped.area == 0:
+                continue
+            features.append(
+                {
+                    "geometry": affine_transform(clipped, to_tile_px),
+                    "properties": properties,
+                }
+            )
+        if features:
+            layers.append({"name": TILE_HULLS_LAYER, "features": features})
+
+    if not layers:
+        return z, x, y, None
+    data = mapbox_vector_tile.encode(
+        layers, default_options={"y_coord_down": True, "extents": extent}
+    )
+    return z, x, y, data
+
+
+def _point_tasks(u, v, properties, zoom, extent, cluster_px):
+    # Klíč (dlaždice, buňka) pro všechny body; první výskyt = nejvyšší EMS
+    scale = 2**zoom
+    cells = extent // cluster_px
+    global_px = np.clip((u * scale * cells).astype(np.int64), 0, scale * cells - 1)
+    global_py = np.clip((v * scale * cells).astype(np.int64), 0, scale * cells - 1)
+    tile_x, cell_x = np.divmod(global_px, cells)
+    tile_y, cell_y = np.divmod(global_py, cells)
+    keys = ((tile_x * scale + tile_y) * cells + cell_x) * cells + cell_y
+    unique_keys, first_idx, counts = np.unique(
+        keys, return_index=True, return_counts=True
+    )
+    # Prvek leží ve středu buňky
+    local_x = cell_x * cluster_px + cluster_px // 2
+    local_y = cell_y * cluster_px + cluster_px // 2
+    pixel_tiles = unique_keys // (cells * cells)
+    tile_ids, starts = np.unique(pixel_tiles, return_index=True)
+    ends = np.append(starts[1:], len(unique_keys))
+
+    pixel_properties = {key: values[first_idx] for key, values in properties.items()}
+    pixel_properties["n"] = counts
+    tasks = {}
+    for tile_id, start, end in zip(tile_ids, starts, ends):
+        tx, ty = divmod(int(tile_id), scale)
+        rows = first_idx[start:end]
+        tasks[(tx, ty)] = (
+            local_x[rows],
+            local_y[rows],
+            {
+                key: [
+                    v.item() if isinstance(v, np.generic) else v
+                    for v in values[start:end]
+                ]
+                for key, values in pixel_properties.items()
+            },
+        )
+    return tasks
+
+
+def _hull_tiles(hulls_unit, zoom):
+    # Dlaždice v obalovém obdélníku izoseist (prázdné se při kódování zahodí)
+    if not hulls_unit:
+        return []
+    scale = 2**zoom
+    u_all = np.concatenate([h[0] for h in hulls_unit])
+    v_all = np.concatenate([h[1] for h in hulls_unit])
+    x_range = range(
+        max(int(u_all.min() * scale), 0), min(int(u_all.max() * scale), scale - 1) + 1
+    )
+    y_range = range(
+        max(int(v_all.min() * scale), 0), min(int(v_all.max() * scale), scale - 1) + 1
+    )
+    return [(tx, ty) for tx in x_range for ty in y_range]
+
+
+def _write_mbtiles_metadata(connection, metadata):
+    connection.executemany(
+        "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+        [
+            (key, value if isinstance(value, str) else json.dumps(value))
+            for key, value in metadata.items()
+        ],
+    )
+
+
+def write_vector_tiles(
+    output_path,
+    df_reports,
+    ems_col,
+    sort_ems_key_func,
+    category_columns=(),
+    hulls=None,
+    lat_col="lat",
+    lon_col="lon",
+    min_zoom=4,
+    max_zoom=11,
+    output_format="dir",
+    n_processes=1,
+    extent=TILE_EXTENT,
+    cluster_px=TILE_CLUSTER_PX,
+    name="Makroseismická pozorování",
+):
+    # output_format: "dir" (adresář z/x/y.pbf + metadata.json) nebo "mbtiles"
+    try:
+        import mapbox_vector_tile  # noqa: F401
+        import shapely  # noqa: F401
+    except ImportError:
+        print(
+            "INFO: Export vektorových dlaždic přeskočen - chybí 'mapbox-vector-tile'."
+        )
+        print("      Nainstalujte 'mapbox-vector-tile': pip install mapbox-vector-tile")
+        return None
+    if output_format not in ("dir", "mbtiles"):
+        print(f"CHYBA: Neznámý formát dlaždic '{output_format}' (dir/mbtiles).")
+        return None
+    max_zoom = min(max_zoom, TILE_MAX_ZOOM_LIMIT)
+
+    lats = pd.to_numeric(df_reports[lat_col], errors="coerce").to_numpy(dtype=float)
+    lons = pd.to_numeric(df_reports[lon_col], errors="coerce").to_numpy(dtype=float)
+    valid = np.isfinite(lats) & np.isfinite(lons)
+    ems_codes, ems_uniques = pd.factorize(df_reports[ems_col])
+    unique_sort_vals = np.array(
+        [sort_ems_key_func(level) for level in ems_uniques] + [0], dtype=np.int64
+    )
+    unique_sort_vals[unique_sort_vals > MAX_EMS_SORT_VALUE] = 0
+    ems_labels = np.array([str(level) for level in ems_uniques] + [""], dtype=object)
+
+    # Vlastnosti bodů: stupeň EMS (text i číslo) a celočíselné kódy kategorií
+    properties = {
+        "ems": ems_labels[ems_codes],
+        "ems_stupen": unique_sort_vals[ems_codes],
+    }
+    code_dictionaries = {}
+    for col in category_columns:
+        if col not in df_reports.columns:
+            continue
+        codes, uniques = pd.factorize(df_reports[col])
+        properties[col] = codes.astype(np.int64)
+        code_dictionaries[col] = [str(value) for value in uniques]
+
+    # Řazení sestupně podle EMS: reprezentant pixelu je hlášení s nejvyšším stupněm
+    order = np.flatnonzero(valid)
+    order = order[np.argsort(-properties["ems_stupen"][order], kind="stable")]
+    u, v = lonlat_to_unit_mercator(lons[order], lats[order])
+    properties = {key: values[order] for key, values in properties.items()}
+
+    hulls_unit = []
+    for hull in hulls or []:
+        hull_u, hull_v = lonlat_to_unit_mercator(hull["lons"], hull["lats"])
+        hulls_unit.append(
+            (
+                hull_u,
+                hull_v,
+                {
+                    "ems": str(hull["level"]),
+                    "ems_stupen": int(sort_ems_key_func(hull["level"])),
+                    "n_bodu": int(hull["n_points"]),
+                },
+            )
+        )
+
+    tasks = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        point_tasks = (
+            _point_tasks(u, v, properties, zoom, extent, cluster_px) if len(u) else {}
+        )
+        tile_keys = set(point_tasks) | set(_hull_tiles(hulls_unit, zoom))
+        for tx, ty in sorted(tile_keys):
+            tasks.append((zoom, tx, ty, point_tasks.get((tx, ty)), hulls_unit, extent))
+
+    results = None
+    if n_processes and n_processes > 1 and len(tasks) > 1:
+        executor = fork_process_pool(n_processes, "dlaždice se kódují v jednom procesu")
+        if executor is not None:
+            results = executor.map(
+                _encode_tile, tasks, chunksize=max(1, len(tasks) // (4 * n_processes))
+            )
+    if results is None:
+        executor = None
+        results = map(_encode_tile, tasks)
+
+    metadata = {
+        "name": name,
+        "format": "pbf",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "bounds": ",".join(
+            f"{value:.6f}"
+            for value in (
+                np.nanmin(lons[valid]) if valid.any() else -180.0,
+                np.nanmin(lats[valid]) if valid.any() else -85.0,
+                np.nanmax(lons[valid]) if valid.any() else 180.0,
+                np.nanmax(lats[valid]) if valid.any() else 85.0,
+            )
+        ),
+        "json": {
+            "vector_layers": [
+                {
+                    "id": TILE_POINTS_LAYER,
+                    "fields": {
+                        "ems": "String",
+                        "ems_stupen": "Number",
+                        "n": "Number",
+                        **{col: "Number" for col in code_dictionaries},
+                    },
+                    "minzoom": min_zoom,
+                    "maxzoom": max_zoom,
+                },
+                {
+                    "id": TILE_HULLS_LAYER,
+                    "fields": {
+                        "ems": "String",
+                        "ems_stupen": "Number",
+                        "n_bodu": "Number",
+                    },
+                    "minzoom": min_zoom,
+                    "maxzoom": max_zoom,
+                },
+            ],
+            "kody_kategorii": code_dictionaries,
+        },
+    }
+
+    n_tiles = 0
+    n_bytes = 0
+    try:
+        if output_format == "mbtiles":
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            connection = sqlite3.connect(output_path)
+            connection.executescript(
+                "CREATE TABLE metadata (name TEXT, value TEXT);"
+                "CREATE UNIQUE INDEX metadata_name ON metadata (name);"
+                "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,"
+                " tile_row INTEGER, tile_data BLOB);"
+                "CREATE UNIQUE INDEX tile_index ON tiles"
+                " (zoom_level, tile_column, tile_row);"
+            )
+            with connection:
+                _write_mbtiles_metadata(connection, metadata)
+                batch = []
+                for z, x, y, data in results:
+                    if data is None:
+                        continue
+                    # MBTiles číslují řádky odspodu (TMS) a ukládají gzip
+                    batch.append((z, x, 2**z - 1 - y, gzip.compress(data)))
+                    n_tiles += 1
+                    n_bytes += len(data)
+                    if len(batch) >= 1000:
+                        connection.executemany(
+                            "INSERT INTO tiles VALUES (?, ?, ?, ?)", batch
+                        )
+                        batch = []
+                connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", batch)
+            connection.close()
+        else:
+            os.makedirs(output_path, exist_ok=True)
+            for z, x, y, data in results:
+                if data is None:
+                    continue
+                tile_dir = os.path.join(output_path, str(z), str(x))
+                os.makedirs(tile_dir, exist_ok=True)
+                with open(os.path.join(tile_dir, f"{y}.pbf"), "wb") as f:
+                    f.write(data)
+                n_tiles += 1
+                n_bytes += len(data)
+            with open(
+                os.path.join(output_path, "metadata.json"), "w", encoding="utf-8"
+            ) as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=1)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(
+        f"Vektorové dlaždice: {n_tiles} dlaždic (z{min_zoom}-{max_zoom}), "
+        f"{n_bytes / 1024:.0f} kB -> {output_path}"
+    )
+    return {
+        "path": output_path,
+        "n_tiles": n_tiles,
+        "n_bytes": n_bytes,
+        "metadata": metadata,
+    }
+
+
+# --- Jednoduchý prohlížeč adresáře dlaždic (MapLibre GL) ---
+_VIEWER_TEMPLATE = """<!DOCTYPE html>
+<html lang="cs">
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<link rel="stylesheet" href="https://unpkg.com/maplibre-gl@4/dist/maplibre-gl.css">
+<script src="https://unpkg.com/maplibre-gl@4/dist/maplibre-gl.js"></script>
+<style>html, body, #map { margin: 0; height: 100%; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+const config = __CONFIG__;
+const tilesUrl = new URL(".", window.location.href).href + "{z}/{x}/{y}.pbf";
+const emsColor = ["match", ["get", "ems"]];
+for (const [level, color] of Object.entries(config.ems_colors)) {
+  emsColor.push(level, color);
+}
+emsColor.push("rgb(200,200,200)");
+const map = new maplibregl.Map({
+  container: "map",
+  center: [config.center_lon, config.center_lat],
+  zoom: config.zoom,
+  style: {
+    version: 8,
+    sources: {
+      osm: {
+        type: "raster",
+        tiles: ["https://tile.openstreetmap.org/{z}/{x}/{y}.png"],
+        tileSize: 256,
+        attribution: "&copy; OpenStreetMap"
+      },
+      data: {
+        type: "vector",
+        tiles: [tilesUrl],
+        minzoom: config.minzoom,
+        maxzoom: config.maxzoom
+      }
+    },
+    layers: [
+      {id: "osm", type: "raster", source: "osm"},
+      {id: "izoseisty", type: "line", source: "data", "source-layer": "__HULLS__",
+       paint: {"line-color": emsColor, "line-width": 2}},
+      {id: "hlaseni", type: "circle", source: "data", "source-layer": "__POINTS__",
+       paint: {
+         "circle-color": emsColor,
+         "circle-radius": ["interpolate", ["linear"], ["ln", ["get", "n"]], 0, 4, 5, 12],
+         "circle-stroke-color": "black",
+         "circle-stroke-width": 0.5
+       }}
+    ]
+  }
+});
+map.on("click", "hlaseni", (e) => {
+  const props = e.features[0].properties;
+  const rows = [`<b>${props.ems}</b>`, `Hlášení v místě: ${props.n}`];
+  for (const [col, labels] of Object.entries(config.codes)) {
+    if (col in props && props[col] >= 0) {
+      rows.push(`${col}: ${labels[props[col]]}`);
+    }
+  }
+  new maplibregl.Popup().setLngLat(e.lngLat).setHTML(rows.join("<br>")).addTo(map);
+});
+</script>
+</body>
+</html>
+"""
+
+
+def write_tile_viewer_html(
+    tiles_dir, tiles_info, center_lat, center_lon, zoom, ems_color_map, title=""
+):
+    metadata = tiles_info["metadata"]
+    config = {
+        "center_lat": center_lat,
+        "center_lon": center_lon,
+        "zoom": zoom,
+        "minzoom": int(metadata["minzoom"]),
+        "maxzoom": int(metadata["maxzoom"]),
+        "ems_colors": ems_color_map,
+        "codes": metadata["json"]["kody_kategorii"],
+    }
+    html = (
+        _VIEWER_TEMPLATE.replace("__TITLE__", title or metadata["name"])
+        .replace("__CONFIG__", json.dumps(config, ensure_ascii=False))
+        .replace("__POINTS__", TILE_POINTS_LAYER)
+        .replace("__HULLS__", TILE_HULLS_LAYER)
+    )
+    viewer_path = os.path.join(tiles_dir, "index.html")
+    with open(viewer_path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return viewer_path
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+from macroseismics_normalize import answer_observed_flags, normalize_answers
+
+# --- Kontrola kvality hlášení (deklarativní pravidla) ---
+# Pravidla jsou slovníky {"name", "kind", "action", ...parametry druhu}.
+# Každé pravidlo se vyhodnotí jako vektorová maska nad celou tabulkou; každý
+# sloupec se převádí (to_datetime/to_numeric/normalizace) jen jednou, i když
+# ho používá více pravidel. Porušení se ukládají do bitové masky na řádek
+# (bit i = pravidlo i). Akce "reject" řádek vyřadí, "flag" ho jen označí.
+VALIDATION_BITMASK_COL = "Validace_Bitmaska"
+VALIDATION_TEXT_COL = "Validace_Poruseni"
+MAX_VALIDATION_RULES = 63
+
+
+def _parsed_column(df, cache, kind, col, vocabulary=None):
+    # Převedené sloupce se sdílejí mezi pravidly jednoho vyhodnocení
+    key = (kind, col)
+    if key not in cache:
+        if col not in df.columns:
+            cache[key] = None
+        elif kind == "datetime":
+            cache[key] = pd.to_datetime(df[col], dayfirst=True, errors="coerce")
+        elif kind == "numeric":
+            cache[key] = pd.to_numeric(df[col], errors="coerce")
+        else:
+            cache[key] = normalize_answers(df[col], vocabulary, verbose=False)
+    return cache[key]
+
+
+def _in_tz(timestamp, values):
+    # Hranice ve stejné časové zóně jako sloupec (naivní data = místní čas)
+    if values.dt.tz is not None and timestamp.tzinfo is None:
+        return timestamp.tz_localize(values.dt.tz)
+    return timestamp
+
+
+def _rule_mask(rule, df, cache, now):
+    kind = rule["kind"]
+    n_rows = len(df)
+    if kind == "datetime_invalid":
+        values = _parsed_column(df, cache, "datetime", rule["column"])
+        return (
+            np.ones(n_rows, dtype=bool) if values is None else values.isna().to_numpy()
+        )
+    if kind == "datetime_local_invalid":
+        # Místní čas, který při přechodu letního času neexistuje (jaro) nebo
+        # je nejednoznačný (podzim); převod do UTC by ho nepřiřadil
+        values = _parsed_column(df, cache, "datetime", rule["column"])
+        if values is None or values.dt.tz is not None:
+            return np.zeros(n_rows, dtype=bool)
+        localized = values.dt.tz_localize(
+            rule["timezone"], ambiguous="NaT", nonexistent="NaT"
+        )
+        return (localized.isna() & values.notna()).to_numpy()
+    if kind == "datetime_range":
+        values = _parsed_column(df, cache, "datetime", rule["column"])
+        if values is None:
+            return np.zeros(n_rows, dtype=bool)
+        mask = np.zeros(n_rows, dtype=bool)
+        if rule.get("min") is not None:
+            mask |= (values < _in_tz(pd.Timestamp(rule["min"]), values)).to_numpy()
+        if rule.get("max_ahead") is not None:
+            # Budoucí časy proti okamžiku kontroly (místní čas jako v datech)
+            latest = _in_tz(now, values) + pd.Timedelta(rule["max_ahead"])
+            mask |= (values > latest).to_numpy()
+        return mask
+    if kind == "numeric_invalid":
+        mask = np.zeros(n_rows, dtype=bool)
+        for col in rule["columns"]:
+            values = _parsed_column(df, cache, "numeric", col)
+            mask |= True if values is None else values.isna().to_numpy()
+        return mask
+    if kind == "range":
+        mask = np.zeros(n_rows, dtype=bool)
+        for col, (low, high) in rule["bounds"].items():
+            values = _parsed_column(df, cache, "numeric", col)
+            if values is None:
+                continue
+            values = values.to_numpy(dtype=float)
+            # NaN pokrývá pravidlo numeric_invalid, zde se nepočítá
+            mask |= (values < low) | (values > high)
+        return mask
+    if kind == "contradiction":
+        # Odpověď ze seznamu "values" a zároveň pozorovaný projev
+        answers = _parsed_column(
+            df, cache, "answers", rule["column"], rule.get("vocabulary")
+        )
+        if answers is None:
+            return np.zeros(n_rows, dtype=bool)
+        answered = answers.isin(rule["values"]).to_numpy()
+        effect_cols = [c for c in rule["effect_columns"] if c in df.columns]
+        if not effect_cols:
+            return np.zeros(n_rows, dtype=bool)
+        # Projevy se zjišťují jen u řádků s danou odpovědí (obvykle malý podíl)
+        mask = np.zeros(n_rows, dtype=bool)
+        if answered.any():
+            effects = answer_observed_flags(
+                df.loc[answered, effect_cols],
+                effect_cols,
+                rule["effect_negative_values"],
+            ).to_numpy()
+            mask[answered] = effects.any(axis=1)
+        return mask
+    raise ValueError(f"Neznámý druh pravidla '{kind}' ({rule['name']}).")
+
+
+def validate_reports(df, rules, now=None):
+    # Vrací bitovou masku porušení (uint64 na řádek), počty podle pravidel
+    # a převedené sloupce (cache), aby je načítání nemuselo převádět znovu
+    if len(rules) > MAX_VALIDATION_RULES:
+        raise ValueError(f"Nejvýše {MAX_VALIDATION_RULES} pravidel validace.")
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    cache = {}
+    bitmask = np.zeros(len(df), dtype=np.uint64)
+    reject_bits = np.uint64(0)
+    rule_rows = []
+    for bit, rule in enumerate(rules):
+        mask = np.asarray(_rule_mask(rule, df, cache, now), dtype=bool)
+        bit_value = np.uint64(1) << np.uint64(bit)
+        bitmask[mask] |= bit_value
+        if rule.get("action", "reject") == "reject":
+            reject_bits |= bit_value
+        rule_rows.append(
+            {
+                "bit": bit,
+                "rule": rule["name"],
+                "action": rule.get("action", "reject"),
+                "n_violations": int(mask.sum()),
+                "description": rule.get("description", ""),
+            }
+        )
+    return {
+        "bitmask": bitmask,
+        "rejected": (bitmask & reject_bits) != 0,
+        "rule_counts": pd.DataFrame(rule_rows),
+        "parsed": cache,
+    }
+
+
+def validation_reason_text(bitmask, rules):
+    # Názvy porušených pravidel pro každou unikátní masku, na řádky přes kódy
+    codes, uniques = pd.factorize(np.asarray(bitmask, dtype=np.uint64))
+    lookup = np.array(
+        [
+            ", ".join(
+                rule["name"] for bit, rule in enumerate(rules) if int(mask) & (1 << bit)
+            )
+            for mask in uniques
+        ]
+        + [""],
+        dtype=object,
+    )
+    return lookup[codes]
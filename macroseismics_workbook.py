@@ -0,0 +1,136 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# --- Souhrnný sešit Excel (xlsxwriter v režimu constant_memory) ---
+# Každý list se zapisuje po blocích řádků: blok se převede na seznamy hodnot
+# po sloupcích (typy podle dtype sloupce, NaN/NaT -> prázdná buňka) a řádky
+# se zapíší write_row. V režimu constant_memory drží xlsxwriter v paměti jen
+# aktuální řádek, velikost sešitu tedy paměť neomezuje.
+WORKBOOK_BLOCK_ROWS = 10000
+EXCEL_MAX_SHEET_NAME = 31
+EXCEL_MAX_ROWS = 1048576
+_INVALID_SHEET_CHARS_RE = re.compile(r"[\[\]:*?/\\]")
+
+
+def count_table(counts, n_total, category_label="Kategorie"):
+    # Počty a procenta z celkového počtu hlášení jako tabulka pro list sešitu
+    counts = pd.Series(counts)
+    return pd.DataFrame(
+        {
+            category_label: [str(k) for k in counts.index],
+            "Pocet": counts.to_numpy(dtype=np.int64),
+            "Procento": (100.0 * counts.to_numpy(dtype=float) / n_total)
+            if n_total
+            else np.nan,
+        }
+    )
+
+
+def _sheet_name(name, used_names):
+    base = _INVALID_SHEET_CHARS_RE.sub("_", str(name))[:EXCEL_MAX_SHEET_NAME] or "List"
+    candidate = base
+    suffix = 2
+    # Názvy listů v Excelu nerozlišují velikost písmen
+    while candidate.lower() in used_names:
+        tail = f"_{suffix}"
+        candidate = base[: EXCEL_MAX_SHEET_NAME - len(tail)] + tail
+        suffix += 1
+    used_names.add(candidate.lower())
+    return candidate
+
+
+def _column_kind(series):
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "number"
+    return "text"
+
+
+def _block_values(series, kind):
+    # Hodnoty bloku jednoho sloupce jako seznam nativních typů Pythonu
+    if kind == "bool":
+        return series.astype(object).where(series.notna(), None).tolist()
+    if kind == "number":
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+        cells = values.astype(object)
+        cells[~np.isfinite(values)] = None
+        return cells.tolist()
+    if kind == "datetime":
+        if series.dt.tz is not None:
+            series = series.dt.tz_localize(None)
+        cells = series.dt.to_pydatetime().astype(object)
+        cells[series.isna().to_numpy()] = None
+        return cells.tolist()
+    codes, uniques = pd.factorize(series)
+    # Převod na text jen pro unikátní hodnoty, kód -1 (chybějící) -> None
+    lookup = np.array([str(u) for u in uniques] + [None], dtype=object)
+    return lookup[codes].tolist()
+
+
+def _write_sheet(worksheet, df, formats, block_rows):
+    kinds = [_column_kind(df[col]) for col in df.columns]
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], formats["header"])
+    for col_idx, (col, kind) in enumerate(zip(df.columns, kinds)):
+        width = min(max(len(str(col)) + 2, 10), 50)
+        if kind == "datetime":
+            worksheet.set_column(col_idx, col_idx, max(width, 20), formats["datetime"])
+        else:
+            worksheet.set_column(col_idx, col_idx, width)
+    worksheet.freeze_panes(1, 0)
+
+    n_rows = min(len(df), EXCEL_MAX_ROWS - 1)
+    if n_rows < len(df):
+        print(
+            f"VAROVÁNÍ: List '{worksheet.name}' zkrácen na {n_rows} řádků "
+            f"(limit Excelu), vynecháno {len(df) - n_rows}."
+        )
+    for start in range(0, n_rows, block_rows):
+        block = df.iloc[start : min(start + block_rows, n_rows)]
+        columns = [
+            _block_values(block[col], kind) for col, kind in zip(block.columns, kinds)
+        ]
+        for offset, row in enumerate(zip(*columns)):
+            worksheet.write_row(start + offset + 1, 0, row)
+    if len(df.columns):
+        worksheet.autofilter(0, 0, n_rows, len(df.columns) - 1)
+    return n_rows
+
+
+def write_summary_workbook(output_path, sheets, block_rows=WORKBOOK_BLOCK_ROWS):
+    # sheets: {název listu: DataFrame}, listy v pořadí slovníku
+    try:
+        import xlsxwriter
+    except ImportError:
+        print("INFO: Export sešitu přeskočen - chybí knihovna 'xlsxwriter'.")
+        print("      Nainstalujte 'xlsxwriter': pip install xlsxwriter")
+        return None
+
+    workbook = xlsxwriter.Workbook(
+        output_path,
+        {
+            "constant_memory": True,
+            "strings_to_urls": False,
+            "strings_to_formulas": False,
+        },
+    )
+    formats = {
+        "header": workbook.add_format({"bold": True, "bg_color": "#DDDDDD"}),
+        "datetime": workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"}),
+    }
+    written = {}
+    used_names = set()
+    try:
+        for name, df in sheets.items():
+            if df is None:
+                continue
+            worksheet = workbook.add_worksheet(_sheet_name(name, used_names))
+            written[worksheet.name] = _write_sheet(worksheet, df, formats, block_rows)
+    finally:
+        workbook.close()
+    return written